@@ -5,18 +5,20 @@ from os.path import abspath, dirname, join as os_path_join
 import json
 from bs4 import BeautifulSoup
 
+from webarticlecurator import parses_page, StreamingLinkExtractor
+
 
 # BEGIN SITE SPECIFIC extract_next_page_url FUNCTIONS ##################################################################
 
 
-def extract_next_page_url_p444(archive_page_raw_html):
+@parses_page
+def extract_next_page_url_p444(soup):
     """
-        extracts and returns next page URL from an HTML code if there is one...
+        extracts and returns next page URL from the parsed HTML code if there is one...
         Specific for 444.hu
         :returns string of url if there is one, None otherwise
     """
     ret = None
-    soup = BeautifulSoup(archive_page_raw_html, 'lxml')
     next_page = soup.find(class_='infinity-next button')
     if next_page is not None and 'href' in next_page.attrs:
         ret = next_page['href']
@@ -228,25 +230,25 @@ def extract_article_urls_from_page_nol(archive_page_raw_html):
     return urls
 
 
+_extract_links_origo = StreamingLinkExtractor(class_='archive-cikk')
+
+
 def extract_article_urls_from_page_origo(archive_page_raw_html):
     """
-        extracts and returns as a list the URLs belonging to articles from an HTML code
+        extracts and returns as a list the URLs belonging to articles from an HTML code (without parsing the whole page)
     :param archive_page_raw_html: archive page containing list of articles with their URLs
     :return: list that contains URLs
     """
-    soup = BeautifulSoup(archive_page_raw_html, 'lxml')
-    main_container = soup.find_all(class_='archive-cikk')
-    urls = {link for link in safe_extract_hrefs_from_a_tags(main_container)}
-    return urls
+    return _extract_links_origo(archive_page_raw_html)
 
 
-def extract_article_urls_from_page_p444(archive_page_raw_html):
+@parses_page
+def extract_article_urls_from_page_p444(soup):
     """
-        extracts and returns as a list the URLs belonging to articles from an HTML code
-    :param archive_page_raw_html: archive page containing list of articles with their URLs
+        extracts and returns as a list the URLs belonging to articles from the parsed HTML code
+    :param soup: parsed archive page containing list of articles with their URLs (shared with extract_next_page_url)
     :return: list that contains URLs
     """
-    soup = BeautifulSoup(archive_page_raw_html, 'lxml')
     main_container = soup.find_all(class_='card')
     # % -> %25 if not found (escaping error is introduced between 2019 and 2021)
     urls = {link.replace('%', '%25') for link in safe_extract_hrefs_from_a_tags(main_container)}
@@ -383,16 +385,16 @@ def extract_article_urls_from_page_gov_koronavirus(archive_page_raw_html):
     return urls
 
 
+_extract_links_telex = StreamingLinkExtractor('div', class_='article', url_prefix='https://telex.hu')
+
+
 def extract_article_urls_from_page_telex(archive_page_raw_html):
     """
-        extracts and returns as a list the URLs belonging to articles from an HTML code
+        extracts and returns as a list the URLs belonging to articles from an HTML code (without parsing the whole page)
     :param archive_page_raw_html: archive page containing list of articles with their URLs
     :return: list that contains URLs
     """
-    soup = BeautifulSoup(archive_page_raw_html, 'lxml')
-    main_container = soup.find_all('div', class_='article')
-    urls = {f'https://telex.hu{link}' for link in safe_extract_hrefs_from_a_tags(main_container)}
-    return urls
+    return _extract_links_telex(archive_page_raw_html)
 
 
 def extract_article_urls_from_page_test(filename, test_logger):
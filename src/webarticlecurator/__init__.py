@@ -4,11 +4,19 @@
 from .logger import Logger
 from .utils import wrap_input_constants, DummyConverter, create_or_check_clean_dir, \
     write_content_to_url_named_file
-from .enhanced_downloader import WarcCachingDownloader
+from .enhanced_downloader import WarcCachingDownloader, WarcReader
+from .warc_index import CDXJIndex, HashedUrlIndex, HashedIndexWriter, MergedUrlIndex, write_cdxj_index, \
+    write_hashed_index, merge_url_indices
+from .parsed_page import ParsedPage, parses_page
+from .streaming_extractor import StreamingLinkExtractor
 from .other_modes import validate_warc_file, online_test, sample_warc_by_urls, \
-    archive_page_contains_article_url
+    archive_page_contains_article_url, create_cdxj_index
 from .news_crawler import NewsArchiveCrawler, NewsArticleCrawler
+from .checkpoint import Checkpoint
+from .extraction_pool import ExtractionPool
 from .version import __version__
 
 __all__ = ['NewsArchiveCrawler', 'NewsArticleCrawler', 'DummyConverter', 'WarcCachingDownloader', 'Logger',
-           'wrap_input_constants', __version__]
+           'wrap_input_constants', 'WarcReader', 'ParsedPage', 'parses_page', 'StreamingLinkExtractor',
+           'create_cdxj_index', 'Checkpoint', 'ExtractionPool', 'CDXJIndex', 'HashedUrlIndex', 'HashedIndexWriter',
+           'MergedUrlIndex', 'write_cdxj_index', 'write_hashed_index', 'merge_url_indices', __version__]
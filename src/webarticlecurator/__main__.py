@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
+import os
 import sys
 from argparse import ArgumentParser, ArgumentTypeError, FileType
+from contextlib import nullcontext
 
 from . import wrap_input_constants, NewsArchiveCrawler, NewsArticleCrawler, sample_warc_by_urls, \
-    validate_warc_file, online_test, archive_page_contains_article_url, Logger, __version__
+    validate_warc_file, online_test, archive_page_contains_article_url, create_cdxj_index, Logger, Checkpoint, \
+    __version__
 
 
 def str2bool(v):
@@ -21,6 +24,14 @@ def str2bool(v):
         raise ArgumentTypeError('Boolean value expected.')
 
 
+def host_and_int(v):
+    """HOST=N (eg. for --pool-maxsize-by-host)"""
+    host, sep, n = v.rpartition('=')
+    if len(host) == 0 or not n.isdigit():
+        raise ArgumentTypeError('HOST=N expected.')
+    return host, int(n)
+
+
 def parse_args_crawl(parser):
     parser.add_argument(dest='command', choices={'crawl'}, metavar='crawl',
                         help='Crawl a portal with the supplied configuration and arguments')
@@ -44,6 +55,20 @@ def parse_args_crawl(parser):
                                                    ' and print the number of extracted URLs per page')
     parser.add_argument('--strict', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
                         help='Set strict-mode in WARCReader to enable validation')
+    parser.add_argument('--index-sidecar', type=str2bool, nargs='?', const=True, default=True, metavar='True/False',
+                        help='Store and reuse the index of the old WARC files in sidecar files next to them'
+                             ' (default True)')
+    parser.add_argument('--index-workers', type=int, default=1,
+                        help='Number of processes to index multiple old WARC files in parallel (default 1)')
+    parser.add_argument('--reader-cache-size', type=int, default=0, metavar='MiB',
+                        help='Size of the cache for the decoded content of pages read from the old WARC files'
+                             ' in the memory (default 0: no cache)')
+    parser.add_argument('--reader-cache-policy', choices=('lru', 'fifo'), default='lru',
+                        help='Eviction policy of the cache for the decoded content (see --reader-cache-size,'
+                             ' default lru)')
+    parser.add_argument('--raw-record-copy', type=str2bool, nargs='?', const=True, default=True,
+                        metavar='True/False', help='Copy cached records verbatim (without decompressing and'
+                                                   ' reserialising them) into the new WARC files (default True)')
     parser.add_argument('--crawler-name', type=str, help='The name of the crawler for the WARC info record',
                         default='WebArticleCurator {0}'.format(__version__))
     parser.add_argument('--user-agent', type=str, help='The User-Agent string to use in headers while downloading')
@@ -60,6 +85,69 @@ def parse_args_crawl(parser):
     parser.add_argument('--limit-period', type=int, help='Limit (seconds) the period the number of HTTP request'
                                                          ' see also --max-no-of-calls-in-period',
                         default=1)
+    parser.add_argument('--max-no-of-calls-in-period-per-host', type=int, default=None,
+                        help='An extra limit of the number of HTTP requests per period (see --limit-period)'
+                             ' to each host (default: no per-host limit)')
+    parser.add_argument('--rate-limiter', choices=('fixed-window', 'token-bucket', 'adaptive'),
+                        default='fixed-window',
+                        help='fixed-window limits each downloader separately, token-bucket limits each host'
+                             ' for all downloaders together, adaptive is a token-bucket with its rate adjusted to'
+                             ' the latency of the server and backing off on 429/503 (default fixed-window)')
+    parser.add_argument('--rate-limit-burst', type=int, default=None,
+                        help='Max number of HTTP requests at once for --rate-limiter token-bucket'
+                             ' (default --max-no-of-calls-in-period)')
+    parser.add_argument('--rate-limit-state-dir', type=str, default=None, metavar='DIR',
+                        help='Share the token buckets (see --rate-limiter) with other processes through files'
+                             ' in this directory (default: not shared)')
+    parser.add_argument('--archive-prefetch', type=int, default=0, metavar='K',
+                        help='Download the next K archive pages speculatively when their URLs are predictable'
+                             ' (page numbering with max_pagenum, default 0: no prefetching)')
+    parser.add_argument('--archive-date-workers', type=int, default=1,
+                        help='Number of threads crawling the archive pages of different dates in parallel'
+                             ' (for date-based archives, default 1)')
+    parser.add_argument('--archive-column-workers', type=int, default=1,
+                        help='Number of threads crawling the columns of the archive concurrently (default 1)')
+    parser.add_argument('--download-workers', type=int, default=1,
+                        help='Number of article downloads in flight (the limits of --max-no-of-calls-in-period'
+                             ' apply to all of them together, default 1)')
+    parser.add_argument('--extraction-workers', type=int, default=1,
+                        help='Number of processes running the portal specific extractor functions (parsing HTML)'
+                             ' in parallel (default 1: in the crawler process)')
+    parser.add_argument('--checkpoint', type=str, default=None, metavar='FILE',
+                        help='Save the state of the crawl periodically to this file to be able to --resume it')
+    parser.add_argument('--checkpoint-interval', type=int, default=300, metavar='SECONDS',
+                        help='Seconds between two checkpoints (see --checkpoint, default 300)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume the crawl from --checkpoint (the WARC files of the previous run are used as'
+                             ' source WARC files up to the checkpoint without scanning them)')
+    parser.add_argument('--overwrite-checkpoint', action='store_true',
+                        help='Start a new crawl even if --checkpoint already exists (its URL log is lost)')
+    parser.add_argument('--downloader-backend', choices=('requests', 'aiohttp'), default='requests',
+                        help='The HTTP client used for downloading (aiohttp is asyncio-based and requires the aiohttp'
+                             ' extra, default requests)')
+    parser.add_argument('--host-encodings-file', type=str, default=None, metavar='FILE',
+                        help='Load the encodings learned for the hosts of the pages without charset from this JSON'
+                             ' file and save the newly learned ones to it to reuse them in later crawls'
+                             ' (default: they are kept only in the --checkpoint)')
+    parser.add_argument('--connect-timeout', type=float, default=None, metavar='SECONDS',
+                        help='Timeout of connecting to the server (default: no timeout)')
+    parser.add_argument('--read-timeout', type=float, default=None, metavar='SECONDS',
+                        help='Timeout of waiting for the server to send data (default: no timeout)')
+    parser.add_argument('--max-body-size', type=int, default=0, metavar='MiB',
+                        help='Drop the responses larger than this size as truncated (default 0: no limit)')
+    parser.add_argument('--max-download-time', type=float, default=None, metavar='SECONDS',
+                        help='Drop the responses which take longer to download (from sending the request)'
+                             ' as truncated (default: no limit)')
+    parser.add_argument('--pool-connections', type=int, default=10,
+                        help='Number of hosts whose connections are kept alive (default 10)')
+    parser.add_argument('--pool-maxsize', type=int, default=10,
+                        help='Number of connections kept alive per host, it should be at least the number of'
+                             ' threads downloading from the same host (see --download-workers, default 10)')
+    parser.add_argument('--pool-maxsize-by-host', type=host_and_int, nargs='+', default=(), metavar='HOST=N',
+                        help='Override --pool-maxsize for the given hosts (eg. www.example.com=4)')
+    parser.add_argument('--connection-retries', type=int, default=0,
+                        help='Number of retries on connection errors (eg. failed DNS lookup, refused connection,'
+                             ' default 0)')
     parser.add_argument('--proxy-url', type=str, help='SOCKS Proxy URL to use eg. socks5h://localhost:9050',
                         default=None)
     parser.add_argument('--allow-cookies', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
@@ -88,6 +176,13 @@ def parse_args_crawl(parser):
                               (not cli_args.articles_warc and not cli_args.articles_just_cache)):
         print('Must specify at least --archive-warc and --articles-warc as destination!', file=sys.stderr)
         exit(1)
+    if cli_args.resume and cli_args.checkpoint is None:
+        print('Must specify --checkpoint to --resume from!', file=sys.stderr)
+        exit(1)
+    if cli_args.checkpoint is not None and not cli_args.resume and not cli_args.overwrite_checkpoint and \
+            (os.path.exists(cli_args.checkpoint) or os.path.exists('{0}.log'.format(cli_args.checkpoint))):
+        print('The checkpoint already exists, specify --resume or --overwrite-checkpoint!', file=sys.stderr)
+        exit(1)
     if cli_args.corpus and not cli_args.old_articles_warc:
         print('Must specify at least --old-articles-warc as source!', file=sys.stderr)
         exit(1)
@@ -111,6 +206,15 @@ def parse_args_validate_and_list(parser):
     return args
 
 
+def parse_args_index(parser):
+    parser.add_argument(dest='command', choices={'index'}, metavar='index',
+                        help='Create SURT-sorted CDXJ index files next to the supplied warc files'
+                             ' (created by this program) to be used instead of scanning them')
+    parser.add_argument('-s', '--source-warcfile', type=str, metavar='SOURCE WARCFILE', nargs='+', required=True,
+                        help='A warc file (created by this program) to work from')
+    return parser.parse_args()
+
+
 def parse_args_sample(parser):
     parser.add_argument(dest='command', choices={'sample'}, metavar='sample',
                         help='Copy the supplied list of URLs to the output warc file from the internet '
@@ -171,32 +275,58 @@ def parse_args_checkurls(parser):
     parser.add_argument('-i', '--input-urls', dest='url_input_stream', type=FileType(), default=sys.stdin,
                         help='Use input file instead of STDIN (one URL per line)', metavar='FILE')
     parser.add_argument('-d ', '--out-dir', type=str, help='Output directory (must be empty)', metavar='DIR')
+    parser.add_argument('--extraction-workers', type=int, default=1,
+                        help='Number of processes extracting the URLs from the pages in parallel (default 1)')
+    parser.add_argument('--reader-cache-size', type=int, default=0, metavar='MiB',
+                        help='Size of the cache for the decoded content of pages read from the source WARC files'
+                             ' in the memory (default 0: no cache)')
+    parser.add_argument('--reader-cache-policy', choices=('lru', 'fifo'), default='lru',
+                        help='Eviction policy of the cache for the decoded content (see --reader-cache-size,'
+                             ' default lru)')
     return parser.parse_args()
 
 
 def main_crawl(args):
     """ read input data from the given files, initialize variables """
-    portal_settings = wrap_input_constants(args.config)
+    portal_settings = wrap_input_constants(args.config, args.extraction_workers)
     # These parameters go down directly to the downloader
     download_params = {'program_name': args.crawler_name, 'user_agent': args.user_agent,
                        'overwrite_warc': args.no_overwrite_warc, 'err_threshold': args.cumulative_error_threshold,
                        'known_bad_urls': args.known_bad_urls, 'strict_mode': args.strict,
+                       'index_sidecar': args.index_sidecar, 'index_workers': args.index_workers,
                        'max_no_of_calls_in_period': args.max_no_of_calls_in_period, 'limit_period': args.limit_period,
+                       'max_no_of_calls_in_period_per_host': args.max_no_of_calls_in_period_per_host,
                        'proxy_url': args.proxy_url, 'allow_cookies': args.allow_cookies,
-                       'stay_offline': args.stay_offline, 'verify_request': portal_settings['verify_request']}
-    if args.archive:
-        # For the article links only...
-        archive_crawler = NewsArchiveCrawler(portal_settings, args.old_archive_warc, args.archive_warc,
-                                             args.archive_just_cache, args.known_article_urls, args.debug_params,
-                                             download_params)
-        for url in archive_crawler.url_iterator():  # Get the list of urls in the archive...
-            print(url, flush=True)
-    else:
-        articles_crawler = NewsArticleCrawler(portal_settings, args.old_articles_warc, args.articles_warc,
-                                              args.old_archive_warc, args.archive_warc, args.articles_just_cache,
-                                              args.archive_just_cache, args.known_article_urls, args.debug_params,
-                                              download_params)
-        articles_crawler.download_and_extract_all_articles()
+                       'stay_offline': args.stay_offline, 'verify_request': portal_settings['verify_request'],
+                       'raw_record_copy': args.raw_record_copy, 'reader_cache_size': args.reader_cache_size,
+                       'reader_cache_policy': args.reader_cache_policy, 'downloader_backend': args.downloader_backend,
+                       'rate_limiter': args.rate_limiter, 'rate_limit_burst': args.rate_limit_burst,
+                       'rate_limit_state_dir': args.rate_limit_state_dir, 'connect_timeout': args.connect_timeout,
+                       'read_timeout': args.read_timeout, 'max_body_size': args.max_body_size,
+                       'max_download_time': args.max_download_time, 'pool_connections': args.pool_connections,
+                       'pool_maxsize': args.pool_maxsize, 'pool_maxsize_by_host': dict(args.pool_maxsize_by_host),
+                       'connection_retries': args.connection_retries,
+                       'host_encodings_file': args.host_encodings_file}
+    # These parameters go down directly to the archive crawler
+    archive_params = {'prefetch_window': args.archive_prefetch, 'date_workers': args.archive_date_workers,
+                      'column_workers': args.archive_column_workers}
+    checkpoint = None
+    if args.checkpoint is not None:
+        checkpoint = Checkpoint(args.checkpoint, args.checkpoint_interval, args.resume, args.overwrite_checkpoint)
+    with portal_settings['EXTRACTION_POOL'] or nullcontext():  # Stop the extraction processes at the end
+        if args.archive:
+            # For the article links only...
+            archive_crawler = NewsArchiveCrawler(portal_settings, args.old_archive_warc, args.archive_warc,
+                                                 args.archive_just_cache, args.known_article_urls, args.debug_params,
+                                                 download_params, archive_params, checkpoint)
+            for url in archive_crawler.url_iterator():  # Get the list of urls in the archive...
+                print(url, flush=True)
+        else:
+            articles_crawler = NewsArticleCrawler(portal_settings, args.old_articles_warc, args.articles_warc,
+                                                  args.old_archive_warc, args.archive_warc, args.articles_just_cache,
+                                                  args.archive_just_cache, args.known_article_urls, args.debug_params,
+                                                  download_params, args.download_workers, archive_params, checkpoint)
+            articles_crawler.download_and_extract_all_articles()
 
 
 def main_validate_and_list(args):
@@ -208,6 +338,11 @@ def main_validate_and_list(args):
             print(url)
 
 
+def main_index(args):
+    """ __file__ index [source warcfiles]     # Writes source_warcfile.cdxj for each source warcfile """
+    create_cdxj_index(args.source_warcfile, Logger())
+
+
 def main_cat_and_sample(args):
     """ __file__ sample [source warcfiles or None] [urls list file or stdin] [target warcfile] [Online or Offline] """
     if args.command == 'sample':
@@ -236,13 +371,14 @@ def main_cat_and_sample(args):
 
 def main_checkurls(args):
     """ __file__ checkurls [source warcfiles] [urls list file or stdin] [out_dir] [config] """
-    extract_article_urls_from_page_plus_fun = \
-        wrap_input_constants(args.config)['EXTRACT_ARTICLE_URLS_FROM_PAGE_PLUS_FUN']
+    portal_settings = wrap_input_constants(args.config, args.extraction_workers)
     main_logger = Logger()
     out_dir = getattr(args, 'out_dir', None)
     main_logger.log('INFO', 'Adding URLs to', out_dir, ':')
-    archive_page_contains_article_url(extract_article_urls_from_page_plus_fun, args.source_warcfile,
-                                      args.url_input_stream, main_logger, out_dir)
+    with portal_settings['EXTRACTION_POOL'] or nullcontext():  # Stop the extraction processes at the end
+        archive_page_contains_article_url(portal_settings['EXTRACT_ARTICLE_URLS_FROM_PAGE_PLUS_FUN'],
+                                          args.source_warcfile, args.url_input_stream, main_logger, out_dir,
+                                          args.reader_cache_size, args.reader_cache_policy)
     main_logger.log('INFO', 'Done!')
 
 
@@ -260,7 +396,7 @@ def main():
                 'listurls': (parse_args_validate_and_list, main_validate_and_list),
                 'sample': (parse_args_sample, main_cat_and_sample), 'download': (parse_args_donwload, main_download),
                 'cat': (parse_args_cat, main_cat_and_sample), 'crawl': (parse_args_crawl, main_crawl),
-                'checkurls': (parse_args_checkurls, main_checkurls)}
+                'checkurls': (parse_args_checkurls, main_checkurls), 'index': (parse_args_index, main_index)}
     parser = ArgumentParser()
     parser.add_argument('command', choices=commands.keys(), metavar='COMMAND',
                         help='Please choose from the available commands ({0}) to set mode and see detailed help!'.
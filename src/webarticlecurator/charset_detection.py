@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import re
+import json
+from threading import Lock
+from functools import partial
+from codecs import getincrementaldecoder, lookup, BOM_UTF8, BOM_UTF16_LE, BOM_UTF16_BE, BOM_UTF32_LE, BOM_UTF32_BE
+
+from chardet import detect
+
+# The order matters: the UTF-32 LE BOM starts with the UTF-16 LE BOM
+BOMS = ((BOM_UTF8, 'UTF-8-SIG'), (BOM_UTF32_LE, 'UTF-32'), (BOM_UTF32_BE, 'UTF-32'), (BOM_UTF16_LE, 'UTF-16'),
+        (BOM_UTF16_BE, 'UTF-16'))
+# <meta charset="..."> and <meta http-equiv="Content-Type" content="text/html; charset=..."> (and XML declaration)
+META_CHARSET_RE = re.compile(rb'<meta\s[^>]*?charset\s*=\s*["\']?\s*([a-z0-9_\-:.]+)', re.IGNORECASE)
+XML_ENCODING_RE = re.compile(rb'^\s*<\?xml\s[^>]*?encoding\s*=\s*["\']([a-z0-9_\-:.]+)', re.IGNORECASE)
+META_PRESCAN_SIZE = 4096  # The encoding declaration must be at the beginning of the page
+DETECTOR_PREFIX_SIZE = 65536  # The statistical detector is slow, it gets only the beginning of the page
+DECODE_CHUNK_SIZE = 65536  # The body is decoded in chunks (see decode_body())
+
+
+def _declared_encoding(data):
+    """The encoding declared in the beginning of the page or None if it is missing or unknown"""
+    prefix = data[:META_PRESCAN_SIZE]
+    m = XML_ENCODING_RE.search(prefix) or META_CHARSET_RE.search(prefix)
+    if m is None:
+        return None
+    enc = m.group(1).decode('ascii')
+    try:
+        codec_name = lookup(enc).name
+    except LookupError:
+        return None
+    if codec_name.startswith(('utf-16', 'utf-32')):  # It was found in ASCII, so it is not UTF-16/32 (see HTML5)
+        enc = 'UTF-8'
+    return enc
+
+
+def _decode_chunks(body, enc, errors):
+    """Decode the body (binary file object) from its start chunk by chunk and yield the decoded parts"""
+    decoder = getincrementaldecoder(enc)(errors)
+    body.seek(0)
+    try:
+        for chunk in iter(partial(body.read, DECODE_CHUNK_SIZE), b''):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+    finally:
+        body.seek(0)
+
+
+def decode_body(body, enc, errors='strict'):
+    """Decode the body (binary file object, eg. a spooled temporary file) without reading it into memory at once"""
+    return ''.join(_decode_chunks(body, enc, errors))
+
+
+def _is_utf8(enc):
+    """Whether the encoding is UTF-8 (False if it is unknown)"""
+    try:
+        return lookup(enc).name == 'utf-8'
+    except LookupError:
+        return False
+
+
+def _try_decode(body, enc):
+    """Decode the body with the encoding or return None if it can not be decoded with it"""
+    try:
+        return decode_body(body, enc)
+    except (UnicodeDecodeError, LookupError):
+        return None
+
+
+def detect_encoding(body, host_encoding=None):
+    """
+        Detect the encoding of the response body if the HTTP headers did not specify it in tiers from the fastest:
+         1) BOM, 2) declared in the beginning of the page (meta charset, http-equiv or XML declaration),
+         3) valid UTF-8, 4) the encoding learned for the host if the page can be decoded with it
+         (see HostEncodings), 5) the statistical detector (chardet) on the beginning of the page.
+        The body is a binary file object (see decode_body()).
+        Return the encoding, the method (bom, meta, host, utf-8, detector) to be recorded in the WARC record
+         and the decoded text if the body was decoded to verify the encoding (host, utf-8) else None
+    """
+    body.seek(0)
+    prefix = body.read(DETECTOR_PREFIX_SIZE)
+    body.seek(0)
+    for bom, enc in BOMS:
+        if prefix.startswith(bom):
+            return enc, 'bom', None
+
+    enc = _declared_encoding(prefix)
+    if enc is not None:
+        return enc, 'meta', None
+
+    # Valid UTF-8 is checked first: the single-byte encodings (eg. learned for the host) decode almost anything
+    text = _try_decode(body, 'UTF-8')
+    if text is not None:
+        return 'UTF-8', 'utf-8', text
+
+    # The pages of the host mostly share their encoding: one decode verifies it and gives the text
+    if host_encoding is not None and not _is_utf8(host_encoding):
+        text = _try_decode(body, host_encoding)
+        if text is not None:
+            return host_encoding, 'host', text
+
+    enc = detect(prefix)['encoding']
+    if enc is None:  # Could not detect (eg. binary data), it will be decoded in 'ignore' mode
+        enc = 'UTF-8'
+    return enc, 'detector', None
+
+
+class HostEncodings:
+    """
+        The encodings learned from the pages of each host (the pages of a portal mostly share their encoding):
+         the last one declared in the HTTP headers or in the page or detected by the statistical detector is tried
+         for the pages of the host which are not valid UTF-8 before the statistical detector (see detect_encoding()).
+        The state can be saved and restored (eg. in the checkpoint of WarcDownloader) and if filename is given,
+         it is loaded from the JSON file (if it exists) and the learned encodings are written to it on change,
+         so they can be reused by later crawls (state overrides the file)
+    """
+    def __init__(self, state=None, filename=None):
+        self._filename = filename
+        self._encodings = {}  # host -> encoding
+        if filename is not None and os.path.exists(filename):
+            with open(filename, encoding='UTF-8') as fh:
+                self._encodings.update(json.load(fh))
+        self._encodings.update(state or {})
+        self._learned = {}  # The encodings learned since the start to be merged to the file (see _save())
+        self._lock = Lock()  # Downloads can run in multiple threads
+
+    def learn(self, host, enc):
+        with self._lock:
+            if self._encodings.get(host) == enc:
+                return
+            self._encodings[host] = enc
+            if self._filename is not None:
+                self._learned[host] = enc
+                self._save()
+
+    def _save(self):
+        """Merge the learned encodings into the file (it may be shared with other downloaders) atomically"""
+        encodings = {}
+        if os.path.exists(self._filename):
+            with open(self._filename, encoding='UTF-8') as fh:
+                encodings = json.load(fh)
+        encodings.update(self._learned)
+        tmp_filename = '{0}.tmp{1}'.format(self._filename, os.getpid())
+        try:
+            with open(tmp_filename, 'w', encoding='UTF-8') as fh:
+                json.dump(encodings, fh, ensure_ascii=False, indent=0, sort_keys=True)
+            os.replace(tmp_filename, self._filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def detect_encoding(self, host, body):
+        with self._lock:
+            host_encoding = self._encodings.get(host)
+        enc, method, text = detect_encoding(body, host_encoding)
+        if method in {'meta', 'detector'}:
+            self.learn(host, enc)
+        return enc, method, text
+
+    def state(self):
+        with self._lock:
+            return dict(self._encodings)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import json
+from time import monotonic
+from threading import Lock
+
+from .enhanced_downloader import resume_warc_file
+
+
+class Checkpoint:
+    """
+        The state of a crawl saved periodically to a JSON file to be able to resume the crawl after it died
+         (eg. on too many errors, OOM, reboot) without fetching or scanning the finished work again.
+        The parts of the state (archive, articles) are collected at the same time from the registered functions,
+         so save_if_due() must be called only when the crawl is in a consistent state (between two URLs).
+        The ever-growing sets of URLs are not saved at each checkpoint, but appended to a log next to the checkpoint
+         as they are added (see log_added()) and the checkpoint records the size of the log.
+        The state is collected holding the lock of the log (see save()), so the registered functions must not log.
+        The WARC files written before the checkpoint are truncated to the checkpointed state and they are used
+         as source WARC files when resuming with the index of their records logged as they were written
+         (see resume_warc_files())
+        An existing checkpoint (or its log) is not overwritten by a new crawl unless overwrite is True
+    """
+    def __init__(self, filename, interval=300, resume=False, overwrite=False):
+        self.filename = filename
+        self._interval = interval  # Seconds between two checkpoints
+        self._last_save = monotonic()
+        self._state_funs = {}
+        self.state = {}
+        self._log_filename = '{0}.log'.format(filename)
+        self._log_lock = Lock()  # URLs can be added from multiple threads (also while the state is collected)
+        if not resume and not overwrite and (os.path.exists(filename) or os.path.exists(self._log_filename)):
+            raise FileExistsError('The checkpoint already exists (resume or overwrite it): {0}'.format(filename))
+        if resume:
+            with open(filename, encoding='UTF-8') as fh:
+                self.state = json.load(fh)
+            self._log_fh = self._read_log(self.state.pop('log_size'))
+        else:
+            self._log_fh = open(self._log_filename, 'wb')
+
+    def _read_log(self, log_size):
+        """Add the elements logged until the checkpoint to the state of their parts and reopen the log for appending"""
+        # Drop the elements logged after the checkpoint (the last line may be incomplete)
+        os.truncate(self._log_filename, log_size)
+        with open(self._log_filename, encoding='UTF-8') as fh:
+            for line in fh:
+                part, key, elem = json.loads(line)
+                self.state.setdefault(part, {}).setdefault(key, []).append(elem)
+        return open(self._log_filename, 'ab')
+
+    def get(self, part):
+        """The state of a part (archive, articles) saved by the previous crawl or an empty dict"""
+        return self.state.get(part, {})
+
+    def register(self, part, state_fun):
+        self._state_funs[part] = state_fun
+
+    def log_added(self, part, key, add_fun):
+        """Wrap add_fun (eg. set.add) to also append the added elements to the log (see log())"""
+        def add_and_log(elem):
+            add_fun(elem)
+            self.log(part, key, elem)
+        return add_and_log
+
+    def log(self, part, key, elem):
+        """Append the element to the log, it is in the list of the state of the part under key when resuming"""
+        line = '{0}\n'.format(json.dumps([part, key, elem], ensure_ascii=False)).encode('UTF-8')
+        with self._log_lock:
+            self._log_fh.write(line)
+
+    def resume_warc_files(self, part, _logger):
+        """Prepare the WARC files of a part written by the previous crawls and return them to be used as source"""
+        part_state = self.get(part)
+        sources = list(part_state.get('sources', []))
+        if part_state.get('warc') is not None:
+            filename = resume_warc_file(part_state['warc'], _logger)
+            if filename is not None:
+                sources.append(filename)
+        return sources
+
+    def save_if_due(self):
+        if monotonic() - self._last_save >= self._interval:
+            self.save()
+
+    def save(self):
+        # The state (eg. the size of the WARC files) and the size of the log are recorded at once: the threads of
+        #  the crawl log the URLs after writing their records, so the log contains only URLs written before the sizes
+        with self._log_lock:
+            state = {part: state_fun() for part, state_fun in self._state_funs.items()}
+            self._log_fh.flush()
+            state['log_size'] = self._log_fh.tell()
+        os.fsync(self._log_fh.fileno())
+        tmp_filename = '{0}.tmp{1}'.format(self.filename, os.getpid())
+        try:
+            with open(tmp_filename, 'w', encoding='UTF-8') as fh:
+                json.dump(state, fh, ensure_ascii=False)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_filename, self.filename)  # The previous checkpoint is kept until the new one is complete
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+        self._last_save = monotonic()
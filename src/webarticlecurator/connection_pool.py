@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Tunable connection pools for the requests Session with statistics of the connections (keep-alive, DNS, TLS)
+
+from time import monotonic
+from threading import Lock
+from ipaddress import ip_address
+from types import SimpleNamespace
+
+from requests.adapters import HTTPAdapter
+from urllib3.poolmanager import PoolManager
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class ConnectionStats:
+    """
+        Counters of the HTTP requests and of the connections opened for them (thread-safe):
+         the requests which did not need a new connection reused a kept-alive one,
+         a DNS lookup is counted for each new connection to a host name (not an IP address) as urllib3 does not cache
+         them (aiohttp does, so only its cache misses are counted there) and the time of opening the connections
+         (DNS lookup, TCP and TLS handshake) is summed
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.dns_lookups = 0
+        self.connect_time = 0.0
+
+    def __str__(self):
+        return 'requests: {0}, new connections: {1}, reused connections: {2}, TLS handshakes: {3}, DNS lookups: {4},' \
+               ' time of connecting: {5:.2f} seconds'.\
+            format(self.requests, self.new_connections, self.reused_connections, self.tls_handshakes, self.dns_lookups,
+                   self.connect_time)
+
+    @property
+    def reused_connections(self):
+        return max(0, self.requests - self.new_connections)
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_connection(self, tls_handshake, dns_lookup, connect_time):
+        with self._lock:
+            self.new_connections += 1
+            self.tls_handshakes += tls_handshake
+            self.dns_lookups += dns_lookup
+            self.connect_time += connect_time
+
+
+def _is_host_name(host):
+    try:
+        ip_address(host.strip('[]'))
+    except ValueError:
+        return True
+    return False
+
+
+class _CountingConnectionMixin:
+    """Count the requests and the (re)connections of an urllib3 connection (the pool sets connection_stats)"""
+    connection_stats = None
+    is_tls = False
+
+    def connect(self):
+        start = monotonic()
+        super().connect()
+        self.connection_stats.count_connection(self.is_tls, _is_host_name(self._dns_host), monotonic() - start)
+
+    def request(self, *args, **kwargs):
+        self.connection_stats.count_request()
+        return super().request(*args, **kwargs)
+
+
+class _CountingHTTPConnection(_CountingConnectionMixin, HTTPConnection):
+    pass
+
+
+class _CountingHTTPSConnection(_CountingConnectionMixin, HTTPSConnection):
+    is_tls = True
+
+
+class _CountingPoolMixin:
+    """Hand connection_stats (set by _CountingPoolManager) over to the new connections of the pool"""
+    connection_stats = None
+
+    def _new_conn(self):
+        conn = super()._new_conn()
+        conn.connection_stats = self.connection_stats
+        return conn
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class _CountingPoolManager(PoolManager):
+    def __init__(self, connection_stats, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connection_stats = connection_stats
+        self.pool_classes_by_scheme = {'http': _CountingHTTPConnectionPool, 'https': _CountingHTTPSConnectionPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context)
+        pool.connection_stats = self.connection_stats
+        return pool
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+        HTTPAdapter counting the requests and the connections in connection_stats (see ConnectionStats)
+         to be mounted on a requests Session with the pool settings of HTTPAdapter (see setup_session_pools()).
+        The connections through a (SOCKS) proxy are not counted
+    """
+    def __init__(self, connection_stats, **kwargs):
+        self._connection_stats = connection_stats  # init_poolmanager() is called by HTTPAdapter.__init__()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _CountingPoolManager(self._connection_stats, num_pools=connections, maxsize=maxsize,
+                                                block=block, **pool_kwargs)
+
+
+def setup_session_pools(session, connection_stats, pool_connections=10, pool_maxsize=10, pool_maxsize_by_host=None,
+                        connection_retries=0):
+    """
+        Mount CountingHTTPAdapters on the session: pool_connections is the number of hosts whose connections are
+         kept alive, pool_maxsize is the number of connections kept alive per host (it should be at least the number
+         of threads downloading from the same host, the extra connections are closed after use),
+         pool_maxsize_by_host overrides it for the hosts given (host -> maxsize) and connection_retries is the number
+         of retries on connection errors (eg. failed DNS lookup, refused connection)
+    """
+    adapter = CountingHTTPAdapter(connection_stats, pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                  max_retries=connection_retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    for host, maxsize in (pool_maxsize_by_host or {}).items():
+        host_adapter = CountingHTTPAdapter(connection_stats, pool_connections=1, pool_maxsize=maxsize,
+                                           max_retries=connection_retries)
+        session.mount('http://{0}/'.format(host), host_adapter)
+        session.mount('https://{0}/'.format(host), host_adapter)
+
+
+def aiohttp_trace_config(aiohttp, connection_stats):
+    """The counterpart of CountingHTTPAdapter for the aiohttp downloader backend (counted by request tracing)"""
+    async def on_request_start(_, ctx, params):
+        ctx.is_tls = params.url.scheme == 'https'
+        ctx.dns_lookup = False
+        connection_stats.count_request()
+
+    async def on_request_redirect(_, ctx, params):
+        ctx.is_tls = params.url.scheme == 'https'
+        connection_stats.count_request()
+
+    async def on_dns_cache_miss(_, ctx, __):
+        ctx.dns_lookup = True
+
+    async def on_connection_create_start(_, ctx, __):
+        ctx.connect_start = monotonic()
+
+    async def on_connection_create_end(_, ctx, __):
+        connection_stats.count_connection(ctx.is_tls, ctx.dns_lookup, monotonic() - ctx.connect_start)
+        ctx.dns_lookup = False
+
+    trace_config = aiohttp.TraceConfig(trace_config_ctx_factory=SimpleNamespace)
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_redirect.append(on_request_redirect)
+    trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
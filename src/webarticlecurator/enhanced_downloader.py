@@ -5,24 +5,42 @@
 
 import os
 import sys
+import errno
+import atexit
+import asyncio
 from io import BytesIO
-from collections import Counter
+from weakref import ref
+from tempfile import SpooledTemporaryFile, TemporaryFile
+from time import monotonic, sleep
+from threading import Lock, Thread
+from itertools import repeat
+from multiprocessing import Pool, Manager
+from collections import OrderedDict
 from urllib.parse import urlparse, quote, urlunparse
 
+from warcio.utils import Digester
 from warcio.warcwriter import WARCWriter
 from warcio.exceptions import ArchiveLoadFailed
 from warcio.archiveiterator import ArchiveIterator
 from warcio.statusandheaders import StatusAndHeaders
 
 from requests import Session
+from requests.utils import default_headers
+from requests.sessions import merge_setting
+from requests.structures import CaseInsensitiveDict
 from requests.exceptions import RequestException
 
 from urllib3 import disable_warnings
-from urllib3.exceptions import ProtocolError, InsecureRequestWarning, LocationParseError
+from urllib3.exceptions import ProtocolError, ReadTimeoutError, SSLError, InsecureRequestWarning, LocationParseError
 
-from chardet import detect
 from ratelimit import limits, sleep_and_retry
 
+from .rate_limiter import get_token_bucket
+from .connection_pool import ConnectionStats, setup_session_pools, aiohttp_trace_config
+from .charset_detection import HostEncodings, decode_body
+from .warc_index import CDXJIndex, HashedUrlIndex, HashedIndexWriter, merge_url_indices, write_hashed_index, \
+    read_hashed_index_header, append_record_offsets, read_record_offsets
+
 respv_str = {10: '1.0', 11: '1.1'}
 
 # Patch get_encoding_from_headers in requests
@@ -80,6 +98,34 @@ def patched_get_encoding_from_headers(headers):
         return 'utf-8'
 
 
+def _content_length(headers):
+    """The Content-Length of the response or None if it is missing or invalid (it is checked against max_body_size)"""
+    try:
+        return int(headers.get('content-length'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _no_op():
+    pass
+
+
+def _iter_body_chunks(raw, chunk_size):
+    """
+        Iterate the body of the urllib3 response in chunks of at most chunk_size bytes. read1() (urllib3 >= 2.3)
+         returns as soon as some data arrived, so a slowly sent body does not block until a whole chunk is filled
+         and the time limit can be checked between the reads (see _check_limits)
+    """
+    if not hasattr(raw, 'read1'):  # Older urllib3
+        yield from raw.stream(chunk_size)
+        return
+    while True:
+        chunk = raw.read1(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
 class WarcCachingDownloader:
     """
         This class optionally applies the supplied existing warc archive to retrieve the downloaded pages from cache
@@ -93,31 +139,94 @@ class WarcCachingDownloader:
     def __init__(self, existing_warc_filenames, new_warc_filename, _logger, just_cache=False, download_params=None):
         self._logger = _logger
         if download_params is not None:
+            download_params = dict(download_params)  # The caller's parameters can be shared between downloaders
             strict_mode = download_params.pop('strict_mode', False)
             check_digest = download_params.pop('check_digest', False)
+            index_sidecar = download_params.pop('index_sidecar', False)
+            index_workers = download_params.pop('index_workers', 1)
+            reader_cache_size = download_params.pop('reader_cache_size', 0)
+            reader_cache_policy = download_params.pop('reader_cache_policy', 'lru')
+            downloader_backend = download_params.pop('downloader_backend', 'requests')
         else:
             strict_mode = False
             check_digest = False
+            index_sidecar = False
+            index_workers = 1
+            reader_cache_size = 0
+            reader_cache_policy = 'lru'
+            downloader_backend = 'requests'
             download_params = {}
 
-        self.url_index = set()
+        # Decoded content of the cached pages shared between the source WARC files (size is given in MiB)
+        self._content_cache = None
+        if reader_cache_size > 0:
+            self._content_cache = DecodedContentCache(reader_cache_size * 1024 * 1024, reader_cache_policy)
+
+        self._cached_downloads = []
         info_record_data = None
         if existing_warc_filenames is not None:  # Setup the supplied existing warc archive file as cache
             if isinstance(existing_warc_filenames, str):  # Transform it to list
                 existing_warc_filenames = [existing_warc_filenames]
-            self._cached_downloads = []
+            if index_workers > 1 and len(existing_warc_filenames) > 1:
+                if index_sidecar:
+                    self._create_index_sidecars(existing_warc_filenames, index_workers, strict_mode, check_digest)
+                    check_digest = False  # Already checked in the worker processes, the sidecars can be used
+                else:
+                    self._logger.log('WARNING', 'Parallel indexing requires index sidecars! Indexing sequentially...')
             for ex_warc_filename in existing_warc_filenames:
-                cached_downloads = WarcReader(ex_warc_filename, _logger, strict_mode, check_digest)
+                cached_downloads = WarcReader(ex_warc_filename, _logger, strict_mode, check_digest, index_sidecar,
+                                              self._content_cache)
                 self._cached_downloads.append(cached_downloads)
-                self.url_index |= cached_downloads.url_index
                 info_record_data = cached_downloads.info_record_data
+        # URL -> (number of the source WARC file, request and response offsets) where the last source file wins
+        self._merged_url_index = self._merge_url_indices(index_sidecar)
+        self.url_index = self._merged_url_index.keys()  # Set-like view of the URLs in the source WARC files
 
         if just_cache:
             self._new_downloads = WarcDummyDownloader()
         else:
-            self._new_downloads = WarcDownloader(new_warc_filename, _logger, info_record_data, **download_params)
+            self._new_downloads = downloader_backends[downloader_backend](new_warc_filename, _logger, info_record_data,
+                                                                          **download_params)
+
+    def _create_index_sidecars(self, warc_filenames, index_workers, strict_mode, check_digest):
+        """
+            Scan the WARC files in a process pool (this is CPU-bound) and write their index sidecars,
+             so the WarcReaders of the parent process only need to load them
+        """
+        self._logger.log('INFO', 'Creating indices for {0} WARC files with {1} processes...'.
+                         format(len(warc_filenames), index_workers))
+        with Manager() as man:
+            log_queue = man.Queue()
+            with self._logger.init_mp_logging_context(log_queue) as mplogger, \
+                    Pool(min(index_workers, len(warc_filenames))) as p:
+                p.map(_create_index_sidecar, zip(warc_filenames, repeat(mplogger), repeat(strict_mode),
+                                                 repeat(check_digest)), chunksize=1)
+
+    def _merge_url_indices(self, index_sidecar):
+        """
+            Merge the indices of more source WARC files once (see MergedUrlIndex). With index sidecars the merged index
+             is cached next to the sidecar of the last source WARC file (filename.merged.idx) while the sources
+             (their names, sizes and mtimes) do not change
+        """
+        url_indices = [cache.url_index_offsets for cache in self._cached_downloads]
+        if len(url_indices) < 2:
+            return merge_url_indices(url_indices)
+        cache_filename, header = None, None
+        if index_sidecar:
+            last_filename = self._cached_downloads[-1].filename
+            cache_filename = '{0}.merged{1}'.format(last_filename, WarcReader.sidecar_ext)
+            header = {'warc_files': [[os.path.abspath(cache.filename), *cache.warc_file_stamp()]
+                                     for cache in self._cached_downloads]}
+        self._logger.log('INFO', 'Merging the indices of {0} WARC files...'.format(len(url_indices)))
+        merged_url_index = merge_url_indices(url_indices, cache_filename, header)
+        if merged_url_index.from_cache:
+            self._logger.log('INFO', 'Merged index loaded from {0} .'.format(merged_url_index.filename))
+        elif merged_url_index.filename is not None:
+            self._logger.log('INFO', 'Merged index written to {0} .'.format(merged_url_index.filename))
+        return merged_url_index
 
     def download_url(self, url, ignore_cache=False, return_warc_records_wo_writing=False):
+        cached_rec = self._merged_url_index.get(url)  # A single lookup decides if the URL is cached and where
         # 1) Check if the URL is explicitly marked as bad...
         if url in self._new_downloads.bad_urls:
             self._logger.log('WARNING', url, 'Skipping URL explicitly marked as bad!', sep='\t')
@@ -128,11 +237,12 @@ class WarcCachingDownloader:
             self._logger.log('ERROR', 'Not processing URL, because it is already present in the WARC archive:', url)
             return None
         # 3) Check if the URL presents in the cached_content...
-        elif url in self.url_index:
+        elif cached_rec is not None:
             # 3a) ...retrieve it! (from the last source WARC where the URL is found in)
-            cache, reqv, resp = self.get_records_offset(url)
+            src, reqv, resp = cached_rec
+            cache = self._cached_downloads[src]
             # 3b) Get content even if the URL is a duplicate, because ignore_cache knows better what to do with it
-            cached_content = cache.download_url(url)
+            cached_content = cache.download_url(url, resp[0])
             # 3c) Decide to return the records with the content XOR write the records and return the content only
             if return_warc_records_wo_writing:
                 cached_content = ((cache, reqv, resp), cached_content)
@@ -157,20 +267,38 @@ class WarcCachingDownloader:
     def write_records_for_url(self, url, rec):
         self._new_downloads.write_records_for_url(url, rec)
 
+    def defer_errors(self, url):
+        self._new_downloads.defer_errors(url)
+
+    def count_deferred_errors(self, url):
+        self._new_downloads.count_deferred_errors(url)
+
+    def drop_deferred_errors(self, url):
+        self._new_downloads.drop_deferred_errors(url)
+
+    def checkpoint(self):
+        return self._new_downloads.checkpoint()
+
+    def log_stats(self):
+        if self._content_cache is not None:
+            self._logger.log('INFO', 'Decoded content cache statistics:', self._content_cache)
+        if self._new_downloads.truncated_count > 0:
+            self._logger.log('WARNING', 'Responses truncated by the size or time limits (not written):',
+                             self._new_downloads.truncated_count)
+        if self._new_downloads.connection_stats is not None and self._new_downloads.connection_stats.requests > 0:
+            self._logger.log('INFO', 'Connection statistics:', self._new_downloads.connection_stats)
+
     def get_records_offset(self, url):
-        for cache in reversed(self._cached_downloads):
-            if url in cache.url_index:
-                reqv, resp = cache.get_record_data(url)
-                break
-        else:
-            raise ValueError('INTERNAL ERROR: {0} not found in any supplied source WARC file,'
-                             ' but is in the URL index!'.format(url))
-        return cache, reqv, resp
+        cached_rec = self._merged_url_index.get(url)
+        if cached_rec is None:
+            raise ValueError('INTERNAL ERROR: {0} not found in any supplied source WARC file!'.format(url))
+        src, reqv, resp = cached_rec
+        return self._cached_downloads[src], reqv, resp
 
     def get_records(self, url):
         cache, reqv, resp = self.get_records_offset(url)
-        reqv_rec = cache.get_record(reqv[0])
-        resp_rec = cache.get_record(resp[0])
+        reqv_rec = cache.get_record(*reqv)
+        resp_rec = cache.get_record(*resp)
         return cache, reqv_rec, resp_rec
 
     @property
@@ -202,20 +330,106 @@ class WarcDummyDownloader:
     def write_record(*_, **__):
         return None
 
+    @staticmethod
+    def checkpoint(*_, **__):
+        return None
+
+    @staticmethod
+    def defer_errors(*_, **__):
+        return None
+
+    @staticmethod
+    def count_deferred_errors(*_, **__):
+        return None
+
+    @staticmethod
+    def drop_deferred_errors(*_, **__):
+        return None
+
+    truncated_count = 0
+    connection_stats = None
+
+
+class SpooledBody:
+    """
+        The body of a response written chunk by chunk to a temporary file which is kept in memory only up to
+         max_size bytes, while its payload digest is computed for the WARC record, so the whole body is never held
+        The trailing whitespace is dropped if the body ends with CRLF as warcio would split it
+         as the record separator and the digest would fail
+    """
+    def __init__(self, max_size):
+        self.file = SpooledTemporaryFile(max_size)
+        self._digester = Digester('sha1')  # The default of WARCWriter
+        self._trailing_whitespace = bytearray()  # Held back until the rest of the body decides whether it is trailing
+        self.raw_length = 0  # As received
+        self.length = 0  # As written (without the dropped trailing whitespace)
+
+    def _write(self, data):
+        self.file.write(data)
+        self._digester.update(data)
+        self.length += len(data)
+
+    def write(self, chunk):
+        self.raw_length += len(chunk)
+        stripped_chunk = chunk.rstrip()
+        if len(stripped_chunk) > 0:  # The whitespace held back is not trailing
+            self._write(self._trailing_whitespace)
+            self._trailing_whitespace.clear()
+            self._write(stripped_chunk)
+        self._trailing_whitespace += chunk[len(stripped_chunk):]
+
+    def finish(self):
+        """Write the whitespace held back (unless it is dropped) and rewind the file for reading"""
+        # The trailing whitespace ending in CRLF is dropped: warcio would strip it as the record separator
+        if not self._trailing_whitespace.endswith(b'\r\n'):
+            self._write(self._trailing_whitespace)
+        self._trailing_whitespace.clear()
+        self.file.seek(0)
+
+    @property
+    def payload_digest(self):
+        return str(self._digester)
+
 
 class WarcDownloader:
     """
         Download URL with HTTP GET, save to a WARC file and return the decoded text
     """
+    adaptive_max_tries = 3  # Number of tries on 429 or 503 (with backing off) when the rate limiter is adaptive
+    body_chunk_size = 65536  # The response body is read in chunks (see SpooledBody)
+    body_spool_max_size = 4 * 1024 * 1024  # The response body is spilled to disk above this size (see SpooledBody)
+    record_offsets_ext = '.offsets'  # The record offsets log next to the WARC file (see track_record_offsets)
+
     def __init__(self, expected_filename, _logger, warcinfo_record_data=None, program_name='WebArticleCurator',
                  user_agent=None, overwrite_warc=True, err_threshold=10, known_bad_urls=None,
                  max_no_of_calls_in_period=2, limit_period=1, proxy_url=None, allow_cookies=False, verify_request=True,
-                 stay_offline=False):
+                 stay_offline=False, raw_record_copy=True, rate_limiter='fixed-window', rate_limit_burst=None,
+                 rate_limit_state_dir=None, host_encodings=None, connect_timeout=None, read_timeout=None,
+                 max_body_size=0, max_download_time=None, pool_connections=10, pool_maxsize=10,
+                 pool_maxsize_by_host=None, connection_retries=0, max_no_of_calls_in_period_per_host=None,
+                 host_encodings_file=None, track_record_offsets=False):
         # Store variables
         self._logger = _logger
+        self._raw_record_copy = raw_record_copy  # Copy cached records verbatim if possible (see write_records_for_url)
         self._req_headers = {'Accept-Encoding': 'identity', 'User-agent': user_agent}
         self._error_count = 0
         self._error_threshold = err_threshold  # Set the error threshold which cause aborting to prevent denial
+        self._error_count_lock = Lock()  # Downloads can run in multiple threads (see NewsArticleCrawler)
+        self._deferred_errors = {}  # Speculatively downloaded URL -> the number of its errors not counted yet
+        self._write_lock = Lock()  # The records of one URL must be written together
+        # The encodings learned for each host (saved in the checkpoints and in host_encodings_file if it is given,
+        #  see _create_warc_records)
+        self._host_encodings = HostEncodings(host_encodings, host_encodings_file)
+        # Limits of a download (None or 0 means no limit): the timeouts apply to connecting and to each read
+        #  (in seconds), the responses exceeding the size (in MiB) or the time of downloading (in seconds) are
+        #  truncated, logged, counted separately from the errors and dropped (see _check_limits)
+        self._connect_timeout = connect_timeout or None
+        self._read_timeout = read_timeout or None
+        self._max_body_size = (max_body_size or 0) * 1024 * 1024
+        self._max_download_time = max_download_time or None
+        if self._max_download_time is not None:  # A single read must not block past the time limit either
+            self._read_timeout = min(self._read_timeout or self._max_download_time, self._max_download_time)
+        self.truncated_count = 0
 
         # Setup download function
         if not stay_offline:
@@ -234,21 +448,46 @@ class WarcDownloader:
         # Setup target file handle
         filename = self._set_target_filename(expected_filename, overwrite_warc)
         self._logger.log('INFO', 'Creating archivefile:', filename)
+        self.filename = filename
         self._output_file = open(filename, 'wb')
-
-        self._session = Session()  # Setup session for speeding up downloads
-        if proxy_url is not None:  # Set socks proxy if provided
-            self._session.proxies['http'] = proxy_url
-            self._session.proxies['https'] = proxy_url
+        # URL -> ((request offset, request length), (response offset, response length)) appended as the records are
+        #  written for the checkpoints (see checkpoint() and resume_warc_file())
+        self._record_offsets_file = None
+        if track_record_offsets:
+            self._record_offsets_file = open('{0}{1}'.format(filename, self.record_offsets_ext), 'wb')
 
         self._allow_cookies = allow_cookies
         self._verify_request = verify_request
         if not self._verify_request:
             disable_warnings(InsecureRequestWarning)
 
+        # Keep-alive connections are pooled per host (see setup_session_pools()), their statistics are logged
+        self._pool_params = {'pool_connections': pool_connections, 'pool_maxsize': pool_maxsize,
+                             'pool_maxsize_by_host': pool_maxsize_by_host, 'connection_retries': connection_retries}
+        self.connection_stats = ConnectionStats()
+        self._setup_session(proxy_url)  # Setup session for speeding up downloads
+
         # Setup rate limiting to prevent hammering the server
-        self._requests_get = sleep_and_retry(limits(calls=max_no_of_calls_in_period,
-                                                    period=limit_period)(self._http_get_w_cookie_handling))
+        #  fixed-window: ratelimit's limiter for all requests of this downloader only
+        #  token-bucket: token bucket per host shared by all downloaders of the process (or processes,
+        #   see rate_limiter.py)
+        #  adaptive: token bucket per host shared by all downloaders of the process with a rate adjusted to the server
+        #  max_no_of_calls_in_period_per_host (optional): an extra fixed-window limit on each host (in limit_period)
+        if rate_limiter not in {'fixed-window', 'token-bucket', 'adaptive'}:
+            raise ValueError('Unknown rate limiter (fixed-window, token-bucket, adaptive): {0}'.format(rate_limiter))
+        if rate_limiter == 'adaptive' and rate_limit_state_dir is not None:
+            raise ValueError('The adaptive rate limiter can not be shared between processes!')
+        self._token_bucket = rate_limiter != 'fixed-window'
+        self._adaptive = rate_limiter == 'adaptive'
+        self._max_no_of_calls_in_period = max_no_of_calls_in_period
+        self._limit_period = limit_period
+        self._rate_limit_burst = rate_limit_burst
+        self._rate_limit_state_dir = rate_limit_state_dir
+        self._max_no_of_calls_in_period_per_host = max_no_of_calls_in_period_per_host
+        self._requests_get_limited = sleep_and_retry(limits(calls=max_no_of_calls_in_period,
+                                                            period=limit_period)(self._http_get_w_cookie_handling))
+        self._wait_for_host_by_host = {}  # Host -> waits for the per-host limit (created on demand)
+        self._wait_for_host_by_host_lock = Lock()
 
         self._writer = WARCWriter(self._output_file, gzip=True, warc_version='WARC/1.1')
         if warcinfo_record_data is None:  # Or use the parsed else custom headers will not be copied
@@ -257,8 +496,10 @@ class WarcDownloader:
             warcinfo_record_data = {'software': program_name, 'arguments': ' '.join(sys.argv[1:]),
                                     'format': 'WARC File Format 1.1',
                                     'conformsTo': 'http://bibnum.bnf.fr/WARC/WARC_ISO_28500_version1-1_latestdraft.pdf'}
+        self._warcinfo_record_data = warcinfo_record_data
         info_record = self._writer.create_warcinfo_record(filename, warcinfo_record_data)
         self._writer.write_record(info_record)
+        self._records_end = self._output_file.tell()  # The end of the last completely written record
 
     @staticmethod
     def _set_target_filename(filename, overwrite_warc):
@@ -277,6 +518,15 @@ class WarcDownloader:
     def __del__(self):
         if hasattr(self, '_output_file'):  # If the program opened a file, then it should gracefully close it on exit!
             self._output_file.close()
+        if getattr(self, '_record_offsets_file', None) is not None:
+            self._record_offsets_file.close()
+
+    def _setup_session(self, proxy_url):
+        self._session = Session()
+        setup_session_pools(self._session, self.connection_stats, **self._pool_params)
+        if proxy_url is not None:  # Set socks proxy if provided
+            self._session.proxies['http'] = proxy_url
+            self._session.proxies['https'] = proxy_url
 
     def _http_get_w_cookie_handling(self, *args, **kwargs):
         """
@@ -286,13 +536,110 @@ class WarcDownloader:
             self._session.cookies.clear()
         return self._session.get(*args, **kwargs)
 
+    def _requests_get(self, url, *args, **kwargs):
+        """
+            Rate limited requests.get: the limits are shared between threads, the fixed-window limit applies to
+             all hosts together, the token buckets and the optional per-host limit apply to each host separately
+        """
+        host = urlparse(url).netloc
+        if self._max_no_of_calls_in_period_per_host is not None:
+            self._get_wait_for_host(host)()
+        if self._token_bucket:
+            bucket = self._get_token_bucket(host)
+            tries_left = self.adaptive_max_tries if self._adaptive else 1
+            while True:
+                tries_left -= 1
+                sleep(bucket.reserve())
+                start = monotonic()
+                resp = self._http_get_w_cookie_handling(url, *args, **kwargs)
+                if tries_left == 0 or not self._adaptive or \
+                        not self._adaptive_feedback(url, bucket, resp.status_code, monotonic() - start,
+                                                    resp.headers.get('Retry-After')):
+                    return resp
+                resp.close()  # Retry after backing off
+
+        return self._requests_get_limited(url, *args, **kwargs)
+
+    def _get_wait_for_host(self, host):
+        """The function which waits until the per-host limit allows the next request to the host"""
+        with self._wait_for_host_by_host_lock:
+            wait_for_host = self._wait_for_host_by_host.get(host)
+            if wait_for_host is None:
+                wait_for_host = sleep_and_retry(limits(calls=self._max_no_of_calls_in_period_per_host,
+                                                       period=self._limit_period)(_no_op))
+                self._wait_for_host_by_host[host] = wait_for_host
+        return wait_for_host
+
+    def _get_token_bucket(self, host):
+        return get_token_bucket(host, self._max_no_of_calls_in_period, self._limit_period, self._rate_limit_burst,
+                                self._rate_limit_state_dir, self._adaptive)
+
+    def _adaptive_feedback(self, url, bucket, status_code, latency, retry_after):
+        """Adjust the rate of the adaptive token bucket and return True if the request should be retried"""
+        change = bucket.feedback(status_code, latency, retry_after)
+        if change is not None:
+            level, msg = change
+            self._logger.log(level, url, msg, sep='\t')
+        return status_code in bucket.backoff_status_codes
+
+    def _check_limits(self, url, body, content_length, deadline):
+        """
+            Return True if the response is truncated: its Content-Length (if it is known) or its body read so far
+             exceeds the size limit or its download exceeds the time limit (the deadline counts from sending the
+             request and it is checked after every read, a read can not block longer than the read timeout)
+        """
+        if self._max_body_size > 0 and max(body.raw_length, content_length or 0) > self._max_body_size:
+            limit = 'size'
+        elif deadline is not None and monotonic() > deadline:
+            limit = 'time'
+        else:
+            return False
+        self._logger.log('WARNING', url, 'Response truncated as it exceeds the {0} limit ({1} bytes read),'
+                                         ' the program ignores it!'.format(limit, body.raw_length), sep='\t')
+        with self._error_count_lock:
+            self.truncated_count += 1
+        return True
+
+    def _deadline(self, request_start):
+        """The time (monotonic()) when the download of the response sent at request_start is over or None"""
+        if self._max_download_time is None:
+            return None
+        return request_start + self._max_download_time
+
     def _handle_request_exception(self, url, msg):
         self._logger.log('WARNING', url, msg, sep='\t')
 
-        self._error_count += 1
-        if self._error_count >= self._error_threshold:
+        with self._error_count_lock:
+            if url in self._deferred_errors:  # Counted later if the download is used (see defer_errors)
+                self._deferred_errors[url] += 1
+                return
+        self._count_errors(1)
+
+    def _count_errors(self, num):
+        with self._error_count_lock:
+            self._error_count += num
+            error_count = self._error_count
+        if error_count >= self._error_threshold:
             raise NameError('Too many error happened! Threshold exceeded! See log for details!')
 
+    def defer_errors(self, url):
+        """
+            The errors of the URL downloaded speculatively are logged, but they count toward the error threshold only
+             when the download is used (see count_deferred_errors and drop_deferred_errors)
+        """
+        with self._error_count_lock:
+            self._deferred_errors[url] = 0
+
+    def count_deferred_errors(self, url):
+        with self._error_count_lock:
+            num = self._deferred_errors.pop(url, 0)
+        if num > 0:
+            self._count_errors(num)
+
+    def drop_deferred_errors(self, url):
+        with self._error_count_lock:
+            self._deferred_errors.pop(url, None)
+
     @staticmethod
     def _get_peer_name(resp):
         # Must get peer_name before the content is read
@@ -314,7 +661,8 @@ class WarcDownloader:
     def _dummy_download_url(self, *_, **__):
         raise NotImplementedError
 
-    def _download_url(self, url, return_warc_records_wo_writing=False):
+    def _prepare_url(self, url):
+        """Check the URL before downloading and return it reparsed (urlencoded) and split or None if it is skipped"""
         if url in self.bad_urls:
             self._logger.log('DEBUG', 'Not downloading known bad URL:', url)
             return None
@@ -327,70 +675,116 @@ class WarcDownloader:
         # For safety urlencode the generated URL... (The URL might be modified in this step.)
         path = quote(path, safe='/%')
         url_reparsed = urlunparse((scheme, netloc, path, params, query, fragment))
+        return url_reparsed, (scheme, netloc, path, params, query, fragment)
 
-        try:  # The actual request (on the reparsed URL, everything else is made on the original URL)
-            resp = self._requests_get(url_reparsed, headers=self._req_headers, stream=True, verify=self._verify_request)
-        # UnicodeError is originated from idna codec error, LocationParseError is originated from URLlib3 error
-        except (UnicodeError, RequestException, LocationParseError) as err:
-            self._handle_request_exception(url, 'RequestException happened during downloading: {0} \n\n'
-                                                ' The program ignores it and jumps to the next one.'.format(err))
-            return None
-
-        if resp.status_code != 200:  # Not HTTP 200 OK
-            self._handle_request_exception(url, 'Downloading failed with status code: {0} {1}'.format(resp.status_code,
-                                                                                                      resp.reason))
-            return None
-
+    def _create_warc_records(self, url, url_parts, reqv_headers, http_version, status_code, reason,
+                             resp_headers_list, resp_headers, peer_name, body):
+        """
+            Create the request and response WARC records from the parts of the HTTP transaction
+             independently of the HTTP client used (the records of the same transaction are identical)
+             and return them with the decoded text or None if the response data is empty.
+            The body (SpooledBody) is finished here and its file becomes the payload of the response record
+        """
+        _, netloc, path, params, query, fragment = url_parts
         # REQUEST (build headers for warc)
-        reqv_headers = resp.request.headers
         reqv_headers['Host'] = netloc
 
-        proto = 'HTTP/{0}'.format(respv_str[resp.raw.version])  # Friendly protocol name
+        proto = 'HTTP/{0}'.format(http_version)  # Friendly protocol name
         reqv_http_headers = StatusAndHeaders('GET {0} {1}'.format(urlunparse(('', '', path, params, query, fragment)),
                                                                   proto), reqv_headers.items(), is_http_request=True)
         reqv_record = self._writer.create_warc_record(url, 'request', http_headers=reqv_http_headers)
 
         # RESPONSE
         # resp_status need to be stripped else warcio strips the spaces and digest verification will fail!
-        resp_status = '{0} {1}'.format(resp.status_code, resp.reason).strip()
-        resp_headers_list = resp.raw.headers.items()  # get raw headers from urllib3
-        # Must get peer_name before the content is read
-        peer_name = self._get_peer_name(resp)
+        resp_status = '{0} {1}'.format(status_code, reason).strip()
 
-        try:
-            data = resp.raw.read()  # To be able to return decoded and also write warc
-        except ProtocolError as err:
-            self._handle_request_exception(url, 'RequestException happened during downloading: {0} \n\n'
-                                                ' The program ignores it and jumps to the next one.'.format(err))
-            return None
-
-        if len(data) == 0:
+        if body.raw_length == 0:
             err = 'Response data has zero length!'
             self._handle_request_exception(url, 'RequestException happened during downloading: {0} \n\n'
                                                 ' The program ignores it and jumps to the next one.'.format(err))
             return None
 
         # warcio hack as \r\n is the record separator and trailing ones will be split and digest will eventually fail!
-        if data.endswith(b'\r\n'):  # TODO: Warcio bugreport!
-            data = data.rstrip()
+        body.finish()
 
         # Get or detect encoding to decode the bytes of the text to str
-        enc = patched_get_encoding_from_headers(resp.headers)
-        if enc is None:
-            enc = detect(data)['encoding']
-        try:
-            text = data.decode(enc)  # Normal decode process
-        except UnicodeDecodeError:
-            self._logger.log('WARNING', 'DECODE ERROR RETRYING IN \'IGNORE\' MODE:', url, enc, sep='\t')
-            text = data.decode(enc, 'ignore')
-        data_stream = BytesIO(data)  # Need the original byte stream to write the payload to the warc file
+        enc, enc_method, text = patched_get_encoding_from_headers(resp_headers), 'http-header', None
+        if enc is None:  # The text is already decoded if the detection verified the encoding by decoding
+            enc, enc_method, text = self._host_encodings.detect_encoding(netloc, body.file)
+        elif 'text' in resp_headers.get('content-type', ''):
+            self._host_encodings.learn(netloc, enc)
+        if text is None:
+            try:
+                text = decode_body(body.file, enc)  # Normal decode process
+            except UnicodeDecodeError:
+                self._logger.log('WARNING', 'DECODE ERROR RETRYING IN \'IGNORE\' MODE:', url, enc, sep='\t')
+                text = decode_body(body.file, enc, 'ignore')
 
         resp_http_headers = StatusAndHeaders(resp_status, resp_headers_list, protocol=proto)
         # Add extra headers like encoding because it is not stored any other way...
-        resp_record = self._writer.create_warc_record(url, 'response', payload=data_stream,
+        # The length and the payload digest are known, so warcio does not copy the payload to compute them
+        resp_record = self._writer.create_warc_record(url, 'response', payload=body.file, length=body.length,
                                                       http_headers=resp_http_headers,
                                                       warc_headers_dict={'WARC-IP-Address': peer_name,
-                                                                         'WARC-X-Detected-Encoding': enc})
+                                                                         'WARC-X-Detected-Encoding': enc,
+                                                                         'WARC-X-Detected-Encoding-Method':
+                                                                             enc_method,
+                                                                         'WARC-Payload-Digest': body.payload_digest})
+        return reqv_record, resp_record, text
+
+    def _download_url(self, url, return_warc_records_wo_writing=False):
+        prepared_url = self._prepare_url(url)
+        if prepared_url is None:
+            return None
+        url_reparsed, url_parts = prepared_url
+
+        try:  # The actual request (on the reparsed URL, everything else is made on the original URL)
+            resp = self._requests_get(url_reparsed, headers=self._req_headers, stream=True, verify=self._verify_request,
+                                      timeout=(self._connect_timeout, self._read_timeout))
+        # UnicodeError is originated from idna codec error, LocationParseError is originated from URLlib3 error
+        except (UnicodeError, RequestException, LocationParseError) as err:
+            self._handle_request_exception(url, 'RequestException happened during downloading: {0} \n\n'
+                                                ' The program ignores it and jumps to the next one.'.format(err))
+            return None
+
+        if resp.status_code != 200:  # Not HTTP 200 OK
+            self._handle_request_exception(url, 'Downloading failed with status code: {0} {1}'.format(resp.status_code,
+                                                                                                      resp.reason))
+            return None
+
+        resp_headers_list = resp.raw.headers.items()  # get raw headers from urllib3
+        # Must get peer_name before the content is read
+        peer_name = self._get_peer_name(resp)
+
+        body = SpooledBody(self.body_spool_max_size)  # To be able to return decoded and also write warc
+        # The time limit counts from sending the request (elapsed is the time until the headers arrived)
+        deadline = self._deadline(monotonic() - resp.elapsed.total_seconds())
+        content_length = _content_length(resp.headers)
+        try:
+            truncated = self._check_limits(url, body, content_length, deadline)
+            if not truncated:
+                for chunk in _iter_body_chunks(resp.raw, self.body_chunk_size):
+                    body.write(chunk)
+                    truncated = self._check_limits(url, body, content_length, deadline)
+                    if truncated:
+                        break
+        except (ProtocolError, ReadTimeoutError, SSLError) as err:
+            if not self._check_limits(url, body, content_length, deadline):  # Not timed out because of the time limit
+                self._handle_request_exception(url, 'RequestException happened during downloading: {0} \n\n'
+                                                    ' The program ignores it and jumps to the next one.'.format(err))
+                return None
+            truncated = True
+        if truncated:
+            resp.close()  # Drop the connection instead of reading the rest
+            return None
+
+        records = self._create_warc_records(url, url_parts, resp.request.headers, respv_str[resp.raw.version],
+                                            resp.status_code, resp.reason, resp_headers_list, resp.headers,
+                                            peer_name, body)
+        if records is None:
+            return None
+        reqv_record, resp_record, text = records
+
         # Everything is OK
         if return_warc_records_wo_writing:
             # Return the WARC records and the text content
@@ -402,22 +796,334 @@ class WarcDownloader:
             return text
 
     def write_records_for_url(self, url, rec):
-        self.good_urls.add(url)
+        with self._write_lock:
+            self.good_urls.add(url)
+            reqv_offset = self._records_end
+            resp_offset = self._write_records(rec)
+            self._records_end = self._output_file.tell()
+            if self._record_offsets_file is not None:
+                append_record_offsets(self._record_offsets_file, url,
+                                      ((reqv_offset, resp_offset - reqv_offset),
+                                       (resp_offset, self._records_end - resp_offset)))
+
+    def _write_records(self, rec):
+        """Write the request and the response record of an URL and return the offset of the response record"""
         if rec[0] is not None:
-            cache, (reqv_offset, _), (resp_offset, _) = rec
-            reqv_record = cache.get_record(reqv_offset)  # Seek to the appropriate pos in the WARC to retrive the record
-            self._writer.write_record(reqv_record)       # else random zlib errors happen when the payload is removed
-            resp_record = cache.get_record(resp_offset)  # from the cache
+            cache, (reqv_offset, reqv_length), (resp_offset, resp_length) = rec
+            if self._raw_record_copy and cache.raw_copy_possible:
+                # Both files contain one gzip member per record: copy the compressed bytes without parsing them
+                cache.copy_raw_record(reqv_offset, reqv_length, self._output_file)
+                new_resp_offset = self._output_file.tell()
+                cache.copy_raw_record(resp_offset, resp_length, self._output_file)
+                return new_resp_offset
+            # Seek to the appropriate pos in the WARC to retrive the record
+            reqv_record = cache.get_record(reqv_offset, reqv_length)
+            self._writer.write_record(reqv_record)  # else random zlib errors happen when the payload is removed
+            new_resp_offset = self._output_file.tell()
+            resp_record = cache.get_record(resp_offset, resp_length)  # from the cache
             self._writer.write_record(resp_record)
         else:
             _, reqv_record, resp_record = rec
             self._writer.write_record(reqv_record)
+            new_resp_offset = self._output_file.tell()
             self._writer.write_record(resp_record)
+        return new_resp_offset
+
+    def checkpoint(self):
+        """
+            Return the state of the WARC file for resuming it later (see resume_warc_file()) including the size of
+             the record offsets log (requires track_record_offsets), which covers the same records as the WARC size
+        """
+        with self._write_lock:
+            self._output_file.flush()
+            state = {'filename': self.filename, 'size': self._records_end, 'urls': len(self.good_urls),
+                     'host_encodings': self._host_encodings.state()}
+            if self._record_offsets_file is not None:
+                self._record_offsets_file.flush()
+                state['record_offsets_size'] = self._record_offsets_file.tell()
+                state['info_record_data'] = self._warcinfo_record_data
+            return state
+
+
+class AsyncWarcDownloader(WarcDownloader):
+    """
+        The same as WarcDownloader, but the downloads run on an asyncio event loop with a pooled aiohttp session,
+         so many downloads can be in flight without a thread per connection (requires the aiohttp extra).
+        download_url() can be called from any thread (it blocks until the download is finished),
+         download_url_async() can be awaited from any event loop.
+        The WARC records are created by the same code as in WarcDownloader with the headers requests would send
+    """
+    def _setup_session(self, proxy_url):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('The aiohttp downloader backend requires the aiohttp package'
+                              ' (eg. pip install webarticlecurator[aiohttp])!')
+        self._aiohttp = aiohttp
+
+        if proxy_url is not None and not proxy_url.startswith('http'):
+            raise ValueError('The aiohttp downloader backend supports only HTTP proxies: {0}'.format(proxy_url))
+        self._proxy_url = proxy_url
+
+        # Send exactly the headers requests would send (User-agent: None means no User-agent header)
+        self._req_headers = merge_setting(self._req_headers, default_headers(), dict_class=CaseInsensitiveDict)
+        self._skip_auto_headers = () if 'User-agent' in self._req_headers else ('User-Agent',)
+        # The fixed-window limit and the per-host limits (created on demand and only used from the event loop)
+        self._async_limiter = None
+        self._async_limiters = {}  # Host -> _AsyncRateLimiter
+
+        # The event loop runs in its own thread, so the synchronous API works from any thread
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = Thread(target=self._loop.run_forever, name='AsyncWarcDownloader', daemon=True)
+        self._loop_thread.start()
+        self._session = asyncio.run_coroutine_threadsafe(self._create_session(), self._loop).result()
+        # The daemon thread of the loop is frozen before the garbage collector would call __del__ on exit
+        self_ref = ref(self)
+        atexit.register(lambda: self_ref() is not None and self_ref()._close_session())
+
+    async def _create_session(self):
+        if self._allow_cookies:
+            cookie_jar = self._aiohttp.CookieJar()
+        else:
+            cookie_jar = self._aiohttp.DummyCookieJar()
+        # The raw (possibly compressed) payload is written to the WARC file as with requests
+        # The total timeout is the time limit of the downloads (from sending the request, see _download_url_coro)
+        timeout = self._aiohttp.ClientTimeout(total=self._max_download_time,
+                                              sock_connect=self._connect_timeout, sock_read=self._read_timeout)
+        # The pool settings are not used, aiohttp keeps the connections alive in its own pool
+        return self._aiohttp.ClientSession(cookie_jar=cookie_jar, auto_decompress=False, timeout=timeout,
+                                           trace_configs=[aiohttp_trace_config(self._aiohttp, self.connection_stats)])
+
+    def _close_session(self):
+        if hasattr(self, '_loop_thread') and self._loop_thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+
+    def __del__(self):
+        self._close_session()
+        super().__del__()
+
+    @staticmethod
+    def _get_peer_name(resp):
+        # Must get peer_name before the content is read
+        # The connection is released as soon as the whole payload arrived (even before it is read),
+        #  then the peer name can not be determined
+        try:
+            peer_name = resp.connection.transport.get_extra_info('peername')[0]
+        except (AttributeError, TypeError):
+            peer_name = 'None'  # Connection released or socket closed and could not determine peername...
+        return peer_name
+
+    async def _wait_for_rate_limit(self, host):
+        if self._max_no_of_calls_in_period_per_host is not None:
+            host_limiter = self._async_limiters.get(host)
+            if host_limiter is None:
+                host_limiter = _AsyncRateLimiter(self._max_no_of_calls_in_period_per_host, self._limit_period)
+                self._async_limiters[host] = host_limiter
+            await host_limiter.wait()
+
+        if self._token_bucket:  # The reservation does not block, only the waiting
+            await asyncio.sleep(self._get_token_bucket(host).reserve())
+            return
+
+        if self._async_limiter is None:  # Created on the event loop
+            self._async_limiter = _AsyncRateLimiter(self._max_no_of_calls_in_period, self._limit_period)
+        await self._async_limiter.wait()
+
+    async def _rate_limited_get(self, url, url_reparsed, host):
+        """
+            The counterpart of WarcDownloader._requests_get (the response must be released by the caller)
+             returning the response with the time of sending the request
+        """
+        tries_left = self.adaptive_max_tries if self._adaptive else 1
+        while True:
+            tries_left -= 1
+            await self._wait_for_rate_limit(host)
+            start = monotonic()
+            resp = await self._session.get(url_reparsed, headers=self._req_headers, proxy=self._proxy_url,
+                                           skip_auto_headers=self._skip_auto_headers, ssl=self._verify_request)
+            if tries_left == 0 or not self._adaptive or \
+                    not self._adaptive_feedback(url, self._get_token_bucket(host), resp.status, monotonic() - start,
+                                                resp.headers.get('Retry-After')):
+                return resp, start
+            resp.release()  # Retry after backing off
+
+    async def _download_url_coro(self, url):
+        """Download the URL on the event loop and return the WARC records with the text content or None"""
+        prepared_url = self._prepare_url(url)
+        if prepared_url is None:
+            return None
+        url_reparsed, url_parts = prepared_url
+
+        try:  # The actual request (on the reparsed URL, everything else is made on the original URL)
+            resp, request_start = await self._rate_limited_get(url, url_reparsed, url_parts[1])
+            async with resp:
+                if resp.status != 200:  # Not HTTP 200 OK
+                    self._handle_request_exception(url, 'Downloading failed with status code: {0} {1}'.
+                                                   format(resp.status, resp.reason))
+                    return None
+
+                # Raw headers are decoded as urllib3 does it
+                resp_headers_list = [(k.decode('ISO-8859-1'), v.decode('ISO-8859-1')) for k, v in resp.raw_headers]
+                # Must get peer_name before the content is read
+                peer_name = self._get_peer_name(resp)
+                body = SpooledBody(self.body_spool_max_size)  # To be able to return decoded and also write warc
+                deadline = self._deadline(request_start)
+                content_length = _content_length(resp.headers)
+                if self._check_limits(url, body, content_length, deadline):
+                    return None  # The connection is closed on release as the body is not read
+                try:
+                    async for chunk in resp.content.iter_chunked(self.body_chunk_size):
+                        body.write(chunk)
+                        if self._check_limits(url, body, content_length, deadline):
+                            return None
+                except asyncio.TimeoutError:  # The total timeout of the session is the time limit
+                    if self._check_limits(url, body, content_length, deadline):
+                        return None
+                    raise
+        # UnicodeError is originated from idna codec error, ValueError is originated from yarl (invalid URL)
+        except (UnicodeError, ValueError, asyncio.TimeoutError, self._aiohttp.ClientError) as err:
+            self._handle_request_exception(url, 'RequestException happened during downloading: {0} \n\n'
+                                                ' The program ignores it and jumps to the next one.'.format(err))
+            return None
+
+        reqv_headers = CaseInsensitiveDict(self._req_headers)
+        cookie = resp.request_info.headers.get('Cookie')
+        if cookie is not None:  # requests adds the cookies after the other headers
+            reqv_headers['Cookie'] = cookie
+        records = self._create_warc_records(url, url_parts, reqv_headers, '{0}.{1}'.format(*resp.version),
+                                            resp.status, resp.reason, resp_headers_list, resp.headers,
+                                            peer_name, body)
+        if records is None:
+            return None
+        reqv_record, resp_record, text = records
+
+        # Everything is OK
+        return (None, reqv_record, resp_record), text
+
+    def _return_or_write(self, url, ret, return_warc_records_wo_writing):
+        if ret is None or return_warc_records_wo_writing:
+            # Return the WARC records and the text content
+            return ret
+        else:
+            # Write the two WARC records and return the text content only
+            rec, text = ret
+            self.write_records_for_url(url, rec)
+
+            return text
+
+    def _download_url(self, url, return_warc_records_wo_writing=False):
+        ret = asyncio.run_coroutine_threadsafe(self._download_url_coro(url), self._loop).result()
+        return self._return_or_write(url, ret, return_warc_records_wo_writing)
+
+    async def download_url_async(self, url, return_warc_records_wo_writing=False):
+        ret = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._download_url_coro(url), self._loop))
+        return self._return_or_write(url, ret, return_warc_records_wo_writing)
+
+
+class _AsyncRateLimiter:
+    """
+        The asyncio counterpart of ratelimit's sleep_and_retry(limits(calls, period)):
+         at most calls number of calls are allowed in each period (in seconds), the rest waits without blocking
+    """
+    def __init__(self, calls, period):
+        self._calls = calls
+        self._period = period
+        self._num_calls = 0
+        self._last_reset = monotonic()
+        self._lock = asyncio.Lock()  # Waiting calls are served in FIFO order
+
+    async def wait(self):
+        async with self._lock:
+            while True:
+                period_remaining = self._period - (monotonic() - self._last_reset)
+                if period_remaining <= 0:
+                    self._num_calls = 0
+                    self._last_reset = monotonic()
+                self._num_calls += 1
+                if self._num_calls <= self._calls:
+                    return
+                await asyncio.sleep(period_remaining)
+
+
+downloader_backends = {'requests': WarcDownloader, 'aiohttp': AsyncWarcDownloader}
+
+
+class DecodedContentCache:
+    """
+        Size-bounded cache (max_size is in bytes) for the decoded content of the records read by WarcReader
+         with LRU (least recently used) or FIFO (first in, first out) eviction policy. The size of a text is the
+         memory used by the str object (1, 2 or 4 bytes per character depending on the widest character in it)
+    """
+    policies = {'lru', 'fifo'}
+
+    def __init__(self, max_size, policy='lru'):
+        if policy not in self.policies:
+            raise ValueError('Unknown eviction policy ({0}): {1}'.format(', '.join(sorted(self.policies)), policy))
+        self._max_size = max_size
+        self._move_to_end_on_hit = policy == 'lru'
+        self._cache = OrderedDict()  # From the oldest (first to evict) to the newest
+        self._lock = Lock()  # WarcReaders can be used from multiple threads
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return 'hits: {0}, misses: {1}, evictions: {2}, entries: {3}, size: {4} bytes'.\
+            format(self.hits, self.misses, self.evictions, len(self._cache), self._size)
+
+    def get(self, key):
+        with self._lock:
+            text = self._cache.get(key)
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if self._move_to_end_on_hit:
+                    self._cache.move_to_end(key)
+        return text
+
+    def put(self, key, text):
+        text_size = sys.getsizeof(text)
+        if text_size > self._max_size:  # Do not flush the whole cache for one huge page
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = text
+            self._size += text_size
+            while self._size > self._max_size:
+                _, evicted_text = self._cache.popitem(last=False)
+                self._size -= sys.getsizeof(evicted_text)
+                self.evictions += 1
 
 
 class WarcReader:
-    def __init__(self, filename, _logger, strict_mode=False, check_digest=False):
+    """
+        Read the request-response pairs from a WARC file (created by this program) by URL
+
+        The index (URL -> request and response offsets and lengths, plus the parsed warcinfo record) is stored
+         in a sidecar file next to the WARC file (filename.idx) when index_sidecar is True (crawl mode), the other
+         modes do not write next to the WARC files of the user. It is skipped if the directory is not writable.
+         An existing sidecar is reused as long as the size and the mtime of the WARC file does not change,
+         else (or when check_digest is True) the whole WARC file is scanned (and the sidecar is rebuilt).
+         The sidecar is queried memory-mapped (see HashedUrlIndex), the URLs are not loaded into memory.
+         The index is built by an external sort (see HashedIndexWriter) into an anonymous temporary file
+         which is used without the sidecar.
+
+        If an up-to-date CDXJ index (filename.cdxj, see the index command) is present, it is used instead
+         through binary search on the memory-mapped file without loading the URLs into memory.
+    """
+    sidecar_ext = '.idx'
+    cdxj_ext = '.cdxj'
+
+    def __init__(self, filename, _logger, strict_mode=False, check_digest=False, index_sidecar=False,
+                 content_cache=None):
         self.filename = filename
+        self._content_cache = content_cache  # Optional DecodedContentCache (can be shared between WarcReaders)
+        self._stream_lock = Lock()  # Seeking and reading the stream must not interleave between threads
         self._stream = open(filename, 'rb')
         self._internal_url_index = {}
         self._logger = _logger
@@ -426,8 +1132,16 @@ class WarcReader:
         if check_digest:
             check_digest = 'raise'
         self._check_digest = check_digest
+        self._index_sidecar = index_sidecar
+        self._sidecar_filename = '{0}{1}'.format(filename, self.sidecar_ext)
+        self._cdxj_filename = '{0}{1}'.format(filename, self.cdxj_ext)
+        self._is_gzipped = self._stream.read(2) == b'\x1f\x8b'  # Every record is a separate gzip member then
+        self._stream.seek(0)
         try:
-            self._create_index()
+            # Digests can only be checked by reading through the whole file, so the indices are not used then
+            if self._check_digest or \
+                    (not self._load_cdxj_index() and not self._load_index_sidecar()):
+                self._create_index()
         except KeyError as e:
             if self._strict_mode:
                 raise e
@@ -441,33 +1155,22 @@ class WarcReader:
     def url_index(self):  # Ready-only property for shortcut
         return self._internal_url_index.keys()
 
+    @property
+    def raw_copy_possible(self):  # Records can be copied verbatim into a gzipped WARC file if digests are not checked
+        return self._is_gzipped and not self._check_digest
+
+    @property
+    def url_index_offsets(self):  # Ready-only property for shortcut: URL -> ((offset, length), (offset, length))
+        return self._internal_url_index
+
     def _create_index(self):
         self._logger.log('INFO', 'Creating index for {0}...'.format(self.filename))
         archive_it = ArchiveIterator(self._stream, check_digests=self._check_digest)
-        info_rec = next(archive_it)
-        # First record should be an info record, then it should be followed by the request-response pairs
-        assert info_rec.rec_type == 'warcinfo'
-        try:
-            # Read out custom headers for later use
-            custom_headers_raw = info_rec.content_stream().read()  # Parse custom headers
-            if len(custom_headers_raw) == 0:
-                raise ValueError('WARCINFO record payload length is 0!')
-            # Read and parse the warcinfo record for writing it back unchanged into a warc file
-            # else due to warcio problems it will not be copied properly!
-            # See: https://github.com/webrecorder/warcio/issues/90
-            # and https://github.com/webrecorder/warcio/issues/91
-            self.info_record_data = dict(r.split(': ', maxsplit=1) for r in custom_headers_raw.decode('UTF-8')
-                                         .strip().split('\r\n') if len(r) > 0)
-        except ValueError as e:
-            if self._strict_mode:
-                raise e
-            self._logger.log('WARNING', 'WARCINFO record in', self._stream.name,
-                             'is corrupt! Continuing with a fresh one!')
-            self.info_record_data = None
+        self._read_info_record(archive_it)
 
         archive_load_failed = False
         count = 0
-        double_urls = Counter()
+        index_writer = HashedIndexWriter()  # The index is sorted on disk, so it is not held in memory
         reqv_data = (None, (None, None))  # To be able to handle the request-response pairs together
         for i, record in enumerate(archive_it):
             if record.rec_type == 'request':
@@ -482,18 +1185,19 @@ class WarcReader:
                 assert i % 2 == 1
                 resp_url = record.rec_headers.get_header('WARC-Target-URI')
                 assert resp_url == reqv_data[0]
-                double_urls[resp_url] += 1
                 try:
-                    self._internal_url_index[resp_url] = (reqv_data[1],  # Request-response pair
-                                                          (archive_it.get_record_offset(),
-                                                           archive_it.get_record_length()))
+                    index_writer.add(resp_url, (reqv_data[1],  # Request-response pair
+                                                (archive_it.get_record_offset(), archive_it.get_record_length())))
                 except ArchiveLoadFailed as e:
                     self._logger.log('ERROR', 'RESPONSE:', e.msg, 'for', resp_url)
                     archive_load_failed = True
                 count += 1
-        if count != len(self._internal_url_index):
-            double_urls_str = '\n'.join('{0}\t{1}'.format(url, freq) for url, freq in double_urls.most_common()
-                                        if freq > 1)
+        index_fh = TemporaryFile()
+        index_writer.write(index_fh, {})
+        self._internal_url_index = HashedUrlIndex(fh=index_fh)  # The sidecar is written from it (see below)
+        if len(index_writer.double_urls) > 0:
+            double_urls_str = '\n'.join('{0}\t{1}'.format(url, freq)
+                                        for url, freq in index_writer.double_urls.most_common())
             raise KeyError('The following double URLs detected in the WARC file:{0}'.format(double_urls_str))
         if count == 0:
             raise IndexError('No index created or no response records in the WARC file!')
@@ -501,6 +1205,81 @@ class WarcReader:
             raise ArchiveLoadFailed('Archive loading failed! See logs for details!')
         self._stream.seek(0)
         self._logger.log('INFO', 'Index successfully created.')
+        # Only save complete indices, else the errors would be silenced on the next run
+        if self._index_sidecar and not archive_load_failed:
+            self._write_index_sidecar()
+
+    def _read_info_record(self, archive_it):
+        info_rec = next(archive_it)
+        # First record should be an info record, then it should be followed by the request-response pairs
+        assert info_rec.rec_type == 'warcinfo'
+        try:
+            # Read out custom headers for later use
+            custom_headers_raw = info_rec.content_stream().read()  # Parse custom headers
+            if len(custom_headers_raw) == 0:
+                raise ValueError('WARCINFO record payload length is 0!')
+            # Read and parse the warcinfo record for writing it back unchanged into a warc file
+            # else due to warcio problems it will not be copied properly!
+            # See: https://github.com/webrecorder/warcio/issues/90
+            # and https://github.com/webrecorder/warcio/issues/91
+            self.info_record_data = dict(r.split(': ', maxsplit=1) for r in custom_headers_raw.decode('UTF-8')
+                                         .strip().split('\r\n') if len(r) > 0)
+        except ValueError as e:
+            if self._strict_mode:
+                raise e
+            self._logger.log('WARNING', 'WARCINFO record in', self._stream.name,
+                             'is corrupt! Continuing with a fresh one!')
+            self.info_record_data = None
+
+    def _load_cdxj_index(self):
+        """Use the CDXJ index (without loading it into memory) if it exists and newer than the WARC file"""
+        if not os.path.exists(self._cdxj_filename) or \
+                os.stat(self._cdxj_filename).st_mtime_ns < os.stat(self.filename).st_mtime_ns:
+            return False
+        # The CDXJ index does not contain the warcinfo record, but it is cheap to read as it is the first one
+        self._stream.seek(0)
+        self._read_info_record(iter(ArchiveIterator(self._stream)))
+        self._internal_url_index = CDXJIndex(self._cdxj_filename)
+        self._logger.log('INFO', 'Using CDXJ index {0} .'.format(self._cdxj_filename))
+        return True
+
+    def warc_file_stamp(self):
+        stat = os.stat(self.filename)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _load_index_sidecar(self):
+        """Use the sidecar index (memory-mapped) if it exists and belongs to the current state of the WARC file"""
+        if not os.path.exists(self._sidecar_filename):
+            return False
+        try:
+            with open(self._sidecar_filename, 'rb') as fh:
+                header, _ = read_hashed_index_header(fh)
+        except (OSError, ValueError) as e:
+            self._logger.log('WARNING', 'Could not read index sidecar', self._sidecar_filename, e, sep='\t')
+            return False
+
+        if (header.get('warc_size'), header.get('warc_mtime_ns')) != self.warc_file_stamp():
+            self._logger.log('INFO', 'Index sidecar {0} is outdated, indexing the WARC file...'.
+                             format(self._sidecar_filename))
+            return False
+
+        self.info_record_data = header['info_record_data']
+        self._internal_url_index = HashedUrlIndex(self._sidecar_filename)
+        self._logger.log('INFO', 'Index loaded from {0} .'.format(self._sidecar_filename))
+        return True
+
+    def _write_index_sidecar(self):
+        """Write the index to the sidecar file and use it (memory-mapped) instead of the temporary one"""
+        if not os.access(os.path.dirname(os.path.abspath(self._sidecar_filename)), os.W_OK):
+            return  # E.g. read-only directory: the temporary index is used for this session
+        warc_size, warc_mtime_ns = self.warc_file_stamp()
+        header = {'warc_size': warc_size, 'warc_mtime_ns': warc_mtime_ns, 'info_record_data': self.info_record_data}
+        try:
+            write_hashed_index(self._sidecar_filename, self._internal_url_index, header)
+        except OSError as e:  # E.g. read-only directory: the temporary index is still usable for this session
+            self._logger.log('WARNING', 'Could not write index sidecar', self._sidecar_filename, e, sep='\t')
+            return
+        self._internal_url_index = HashedUrlIndex(self._sidecar_filename)
 
     def get_record_data(self, url):
         reqv_resp_pair = self._internal_url_index.get(url)
@@ -509,23 +1288,122 @@ class WarcReader:
         else:
             raise KeyError('The request or response is missing from the archive for URL: {0}'.format(url))
 
-    def get_record(self, offset):
-        self._stream.seek(offset)
-        rec = next(iter(ArchiveIterator(self._stream, check_digests=self._check_digest)))
+    def get_record(self, offset, length=None):
+        """
+            Return the (lazily read) record at offset. If the length of the record is also supplied,
+             the record is read into memory, so it does not depend on the shared stream (safe between threads)
+        """
+        if length is None:
+            self._stream.seek(offset)
+            rec = next(iter(ArchiveIterator(self._stream, check_digests=self._check_digest)))
+        else:
+            with self._stream_lock:
+                self._stream.seek(offset)
+                raw_record = self._stream.read(length)
+            rec = next(iter(ArchiveIterator(BytesIO(raw_record), check_digests=self._check_digest)))
         return rec
 
-    def download_url(self, url):
+    def copy_raw_record(self, offset, length, target_fh):
+        """
+            Append the compressed bytes of the record (offset, length) verbatim to target_fh
+             with in-kernel copying (copy_file_range, sendfile) where the OS supports it
+        """
+        target_fh.flush()  # The buffered content must precede the copied bytes
+        src_fd, dst_fd = self._stream.fileno(), target_fh.fileno()
+        copied = 0
+        while copied < length:
+            n = _copy_file_range(src_fd, dst_fd, offset + copied, length - copied)
+            if n is None:  # No in-kernel copy available: fall back to buffered copy
+                with self._stream_lock:
+                    self._stream.seek(offset + copied)
+                    buf = self._stream.read(min(length - copied, 1024 * 1024))
+                target_fh.write(buf)
+                n = len(buf)
+            if n == 0:
+                raise ArchiveLoadFailed('Unexpected end of file in {0} at {1}!'.format(self.filename, offset + copied))
+            copied += n
+        target_fh.seek(0, os.SEEK_END)  # Let the file object know about the bytes written through its descriptor
+
+    def download_url(self, url, offset=None):
+        """Return the decoded content for the URL (the offset of the response record can be supplied if known)"""
         text = None
-        reqv_resp_pair = self._internal_url_index.get(url)
-        if reqv_resp_pair is not None:
-            offset = reqv_resp_pair[1][0]  # Only need the offset of the response part
-            self._stream.seek(offset)  # Can not be cached as we also want to write it out to the new archive!
-            record = next(iter(ArchiveIterator(self._stream, check_digests=self._check_digest)))
-            data = record.content_stream().read()
+        if offset is None:
+            reqv_resp_pair = self._internal_url_index.get(url)
+            if reqv_resp_pair is not None:
+                offset = reqv_resp_pair[1][0]  # Only need the offset of the response part
+        if offset is not None:
+            if self._content_cache is not None:
+                text = self._content_cache.get((self.filename, offset))
+                if text is not None:
+                    return text
+            with self._stream_lock:
+                self._stream.seek(offset)  # Records are not cached as we also want to write them out to the new WARC!
+                record = next(iter(ArchiveIterator(self._stream, check_digests=self._check_digest)))
+                data = record.content_stream().read()
             assert len(data) > 0
             enc = record.rec_headers.get_header('WARC-X-Detected-Encoding', 'UTF-8')
             text = data.decode(enc, 'ignore')
+            if self._content_cache is not None:
+                self._content_cache.put((self.filename, offset), text)
         else:
             self._logger.log('CRITICAL', url, 'URL not found in WARC!', sep='\t')
 
         return text
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    """
+        Copy count bytes from offset of src_fd to the current position of dst_fd in-kernel if the OS supports it
+         and return the number of bytes copied (the position of src_fd is not changed) or None if not supported
+    """
+    if hasattr(os, 'copy_file_range'):  # Linux
+        try:
+            return os.copy_file_range(src_fd, dst_fd, count, offset)
+        except OSError as e:  # E.g. cross-filesystem copy on older kernels
+            if e.errno not in {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP}:
+                raise e
+    if sys.platform.startswith('linux'):  # sendfile() accepts regular files as target on Linux only
+        try:
+            return os.sendfile(dst_fd, src_fd, offset, count)
+        except OSError as e:
+            if e.errno not in {errno.EINVAL, errno.ENOSYS}:
+                raise e
+    return None
+
+
+def _create_index_sidecar(params):
+    """Worker function for WarcCachingDownloader._create_index_sidecars() (must be picklable)"""
+    filename, mp_logger, strict_mode, check_digest = params
+    WarcReader(filename, mp_logger, strict_mode, check_digest, index_sidecar=True)
+
+
+def resume_warc_file(warc_state, _logger):
+    """
+        Truncate the WARC file written by an interrupted crawl and its record offsets log to their last checkpoint
+         (see WarcDownloader.checkpoint()) and turn the log into the index sidecar of the WARC file,
+         so it can be used as a source WARC file without scanning it. Return the name of the WARC file
+         or None if there were no URLs written before the checkpoint
+    """
+    filename, size = warc_state['filename'], warc_state['size']
+    record_offsets_filename = '{0}{1}'.format(filename, WarcDownloader.record_offsets_ext)
+    record_offsets_size = warc_state['record_offsets_size']
+    if os.path.getsize(filename) < size:
+        raise ValueError('{0} is shorter than at the checkpoint ({1} bytes)!'.format(filename, size))
+    if os.path.getsize(record_offsets_filename) < record_offsets_size:
+        raise ValueError('{0} is shorter than at the checkpoint ({1} bytes)!'.
+                         format(record_offsets_filename, record_offsets_size))
+    _logger.log('INFO', 'Resuming {0} from the checkpoint ({1} bytes)...'.format(filename, size))
+    os.truncate(filename, size)  # Drop the records written after the checkpoint (the last one may be incomplete)
+    os.truncate(record_offsets_filename, record_offsets_size)  # The offsets of the same records are kept
+    if warc_state['urls'] == 0:  # Only the warcinfo record, which can not be used as a source WARC file
+        return None
+
+    index_writer = HashedIndexWriter()  # The log is sorted on disk, so it is not held in memory
+    with open(record_offsets_filename, 'rb') as fh:
+        for url, value in read_record_offsets(fh):
+            index_writer.add(url, value)
+    stat = os.stat(filename)
+    header = {'warc_size': stat.st_size, 'warc_mtime_ns': stat.st_mtime_ns,
+              'info_record_data': warc_state['info_record_data']}
+    write_hashed_index('{0}{1}'.format(filename, WarcReader.sidecar_ext), index_writer, header)
+    return filename
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from threading import Lock
+from collections import OrderedDict, deque
+from multiprocessing import Pool
+
+_worker_module = None  # The portal specific extractor functions imported in the worker process
+
+
+def _init_worker(module_name, file_path):
+    """Initializer of the worker processes: import the extractor functions from their file (as in the parent)"""
+    global _worker_module
+    from .utils import import_python_file
+    _worker_module = import_python_file(module_name, file_path)
+
+
+def _call_in_worker(params):
+    fun_name, args = params
+    return getattr(_worker_module, fun_name)(*args)
+
+
+class ExtractionPool:
+    """
+        Run the portal specific extractor functions (eg. extract_article_urls_from_page_fun) in a process pool
+         as parsing HTML is CPU-bound. The workers import the extractor functions from the same file,
+         so only the name of the function, its arguments and its result are passed between the processes.
+        See PooledFunction for using the pool. The worker processes run until close() is called
+         (or the pool is used as a context manager)
+    """
+    def __init__(self, module_name, file_path, workers):
+        self._pool = Pool(workers, _init_worker, (module_name, file_path))
+        self._workers = workers
+
+    def function(self, fun_name):
+        return PooledFunction(self._pool, fun_name, self._workers)
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+class PooledFunction:
+    """
+        A drop-in replacement of an extractor function running in ExtractionPool:
+         the call blocks until the result is ready, so many threads (eg. --archive-date-workers, --download-workers)
+         can keep the workers busy and the results are returned to each caller in its order.
+        prefetch() starts the computation ahead (eg. right after the download) and the next call with the same
+         arguments returns its result (the least recently prefetched results are dropped when there are too many)
+    """
+    def __init__(self, pool, fun_name, workers):
+        self._pool = pool
+        self.__name__ = fun_name
+        self.window = 2 * workers  # Enough pages extracted ahead to keep the workers busy (see extract_ahead())
+        self._max_prefetched = 64 * workers  # Results computed ahead which are waiting to be used
+        self._prefetched = OrderedDict()  # args -> AsyncResult
+        self._lock = Lock()
+
+    def prefetch(self, *args):
+        with self._lock:
+            if args not in self._prefetched:
+                self._prefetched[args] = self._pool.apply_async(_call_in_worker, ((self.__name__, args),))
+                if len(self._prefetched) > self._max_prefetched:
+                    self._prefetched.popitem(last=False)
+
+    def __call__(self, *args):
+        with self._lock:
+            result = self._prefetched.pop(args, None)
+        if result is None:
+            result = self._pool.apply_async(_call_in_worker, ((self.__name__, args),))
+        return result.get()  # Exceptions of the function are raised here
+
+
+def extract_ahead(extract_fun, pages):
+    """
+        Yield (url, raw_html, extract_fun(raw_html)) for the (url, raw_html) pairs in their order
+         (the result is None when raw_html is None) while the next pages are extracted in advance
+         when extract_fun is a PooledFunction (it is called in place otherwise)
+    """
+    window = getattr(extract_fun, 'window', 0)
+    pending = deque()
+    for url, raw_html in pages:
+        if window > 0 and raw_html is not None:
+            extract_fun.prefetch(raw_html)
+        pending.append((url, raw_html))
+        if len(pending) > window:
+            url, raw_html = pending.popleft()
+            yield url, raw_html, extract_fun(raw_html) if raw_html is not None else None
+    for url, raw_html in pending:
+        yield url, raw_html, extract_fun(raw_html) if raw_html is not None else None
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
+from threading import Lock, Event
+from queue import Queue, Full, Empty
 from datetime import timedelta
+from itertools import chain
+from contextlib import closing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from calendar import monthrange, isleap
+from collections.abc import Set as AbstractSet
 
-from webarticlecurator import WarcCachingDownloader, Logger
+from webarticlecurator import WarcCachingDownloader, Logger, ParsedPage
 
 
 def add_and_write_factory(attr, fname):
@@ -13,14 +20,26 @@ def add_and_write_factory(attr, fname):
         return None, attr.add
     else:
         fh = open(fname, 'w', encoding='UTF-8')  # To store FH (for closing it)
+        lock = Lock()  # URLs can be added from multiple threads
 
         def add_fun(elem):
-            attr.add(elem)
-            print(elem, file=fh, flush=True)
+            with lock:
+                attr.add(elem)
+                print(elem, file=fh, flush=True)
 
         return fh, add_fun
 
 
+def add_resumed_warc_filenames(filenames, checkpoint, part, logger):
+    """Extend the list of source WARC filenames with the ones written by the resumed crawl (see Checkpoint)"""
+    if filenames is None:
+        filenames = []
+    elif isinstance(filenames, str):
+        filenames = [filenames]
+    resumed_filenames = checkpoint.resume_warc_files(part, logger)
+    return list(filenames) + resumed_filenames, resumed_filenames
+
+
 class NewsArchiveCrawler:
     """
         Using the provided regexes
@@ -28,21 +47,15 @@ class NewsArchiveCrawler:
         2) Extracts URLs of articles from these lists (with helper functions and config)
     """
     def __init__(self, settings, existing_archive_filenames, new_archive_filename, archive_just_cache=False,
-                 known_article_urls=None, debug_params=None, downloader_params=None):
-
-        # List the used properties
-        self._archive_page_urls_by_date = None
-        self._archive_url_format = None
-        self._date_from = None
-        self._date_until = None
-        self._go_reverse_in_archive = None
-        self._min_pagenum = None
-        self._initial_page_num = None
-        self._ignore_archive_cache = None
-        self._infinite_scrolling = None
-        self._extract_article_urls_from_page_fun = None
-        self._find_next_page_url = None
-        self._max_tries = None
+                 known_article_urls=None, debug_params=None, downloader_params=None, archive_params=None,
+                 checkpoint=None):
+
+        # Parameters of the archive crawling (see the CLI)
+        if archive_params is None:
+            archive_params = {}
+        self._prefetch_window = archive_params.get('prefetch_window', 0)
+        self._date_workers = archive_params.get('date_workers', 1)
+        self._column_workers = archive_params.get('column_workers', 1)
 
         # Save the original settings for using it with all columns
         self._settings = settings
@@ -69,9 +82,35 @@ class NewsArchiveCrawler:
             if isinstance(known_article_urls, str):
                 with open(known_article_urls, encoding='UTF-8') as fh:
                     self.known_article_urls = {line.strip() for line in fh}
-            elif isinstance(known_article_urls, set):
+            elif isinstance(known_article_urls, AbstractSet):
                 self.known_article_urls = known_article_urls
 
+        # Resume the previous crawl from the checkpoint (if any): its WARC files are used as source WARC files,
+        #  the finished archive page URLs are skipped and the rest is continued from the saved position
+        self._checkpoint = checkpoint
+        self._column_contexts = []
+        self._resumed_columns = {}
+        self._resumed_done_archive_page_urls = {}  # Column name -> the archive page URLs finished before
+        self._resumed_warc_filenames = []
+        if checkpoint is not None:
+            archive_state = checkpoint.get('archive')
+            existing_archive_filenames, self._resumed_warc_filenames = \
+                add_resumed_warc_filenames(existing_archive_filenames, checkpoint, 'archive', self._logger)
+            self.good_urls.update(archive_state.get('good_urls', ()))
+            self.problematic_urls.update(archive_state.get('problematic_urls', ()))
+            self._resumed_columns = archive_state.get('columns', {})
+            for column_name, archive_page_url in archive_state.get('done_archive_page_urls', ()):
+                self._resumed_done_archive_page_urls.setdefault(column_name, set()).add(archive_page_url)
+            downloader_params = dict(downloader_params or {}, track_record_offsets=True,
+                                     host_encodings=(archive_state.get('warc') or {}).get('host_encodings'))
+            if len(self._resumed_warc_filenames) > 0:  # They must not be overwritten as they are read
+                downloader_params['overwrite_warc'] = False
+            # The URLs are logged as they are added instead of saving all of them at each checkpoint
+            self._good_urls_add = checkpoint.log_added('archive', 'good_urls', self._good_urls_add)
+            self._problematic_urls_add = checkpoint.log_added('archive', 'problematic_urls',
+                                                              self._problematic_urls_add)
+            checkpoint.register('archive', self._checkpoint_state)
+
         # Create new archive while downloading, or simulate download and read the archive
         self._downloader = WarcCachingDownloader(existing_archive_filenames, new_archive_filename, self._logger,
                                                  archive_just_cache, downloader_params)
@@ -80,31 +119,42 @@ class NewsArchiveCrawler:
         # Known good URLs (read-only, available at __init__ time from cache)
         self.url_index = self._downloader.url_index
 
-    def _store_settings(self, column_spec_settings):
+    def _create_column_context(self, column_name, column_spec_settings):
+        """The settings of a column are stored separately, so columns can be crawled independently (or concurrently)"""
+        ctx = _ColumnContext(column_name)
+        ctx.checkpoint = self._checkpoint
+        ctx.done_archive_page_urls = self._resumed_done_archive_page_urls.get(column_name, set())
+        ctx.resumed_position = self._resumed_columns.get(column_name, {}).get('position')
         # Settings for URL iterator
-        self._archive_page_urls_by_date = self._settings['archive_page_urls_by_date']
-        self._archive_url_format = column_spec_settings['archive_url_format']
-        self._max_tries = column_spec_settings.get('max_tries', 1)
-        if self._archive_page_urls_by_date:
-            self._date_from = column_spec_settings['DATE_FROM']
-            self._date_until = column_spec_settings['DATE_UNTIL']
-            self._go_reverse_in_archive = self._settings['go_reverse_in_archive']
+        ctx.archive_page_urls_by_date = self._settings['archive_page_urls_by_date']
+        ctx.archive_url_format = column_spec_settings['archive_url_format']
+        ctx.max_tries = column_spec_settings.get('max_tries', 1)
+        if ctx.archive_page_urls_by_date:
+            ctx.date_from = column_spec_settings['DATE_FROM']
+            ctx.date_until = column_spec_settings['DATE_UNTIL']
+            ctx.go_reverse_in_archive = self._settings['go_reverse_in_archive']
 
         # Settings for gen_article_urls_including_subpages()
-        self._min_pagenum = column_spec_settings['min_pagenum']
-        self._initial_page_num = column_spec_settings['INITIAL_PAGENUM']
-        self._ignore_archive_cache = self._settings['ignore_archive_cache']
-        self._infinite_scrolling = self._settings['infinite_scrolling']
-        self._extract_article_urls_from_page_fun = self._settings['EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN']
+        ctx.min_pagenum = column_spec_settings['min_pagenum']
+        ctx.initial_page_num = column_spec_settings['INITIAL_PAGENUM']
+        ctx.ignore_archive_cache = self._settings['ignore_archive_cache']
+        ctx.infinite_scrolling = self._settings['infinite_scrolling']
+        ctx.extract_article_urls_from_page_fun = self._settings['EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN']
 
         # Store the constant parameters for the actual function used later
-        self._find_next_page_url = \
+        ctx.find_next_page_url = \
             self._find_next_page_url_factory(self._settings['EXTRACT_NEXT_PAGE_URL_FUN'],
                                              self._settings['next_url_by_pagenum'],
                                              self._settings['infinite_scrolling'], column_spec_settings['max_pagenum'],
                                              self._settings['new_article_url_threshold'], self.known_article_urls,
                                              self._settings['stop_on_empty_archive_page'],
                                              self._settings['stop_on_taboo_set'], self._settings['TABOO_ARTICLE_URLS'])
+        # The URLs of the next pages are predictable (only the stop condition is not) with page numbering up to a
+        #  known max_pagenum when no function is needed to find them
+        if self._settings['next_url_by_pagenum'] and self._settings['EXTRACT_NEXT_PAGE_URL_FUN'] is None and \
+                column_spec_settings['max_pagenum'] is not None:
+            ctx.predicted_page_urls = self._predicted_page_urls_factory(column_spec_settings['max_pagenum'])
+        return ctx
 
     def __del__(self):  # Write newly found URLs to files when output files supplied...
         # Save the good URLs...
@@ -115,6 +165,12 @@ class NewsArchiveCrawler:
         if hasattr(self, '_new_problematic_archive_urls_fh') and hasattr(self, 'close'):
             self._new_problematic_archive_urls_fh.close()
 
+    def _checkpoint_state(self):
+        columns = dict(self._resumed_columns)
+        columns.update((ctx.column_name, ctx.checkpoint_state()) for ctx in self._column_contexts)
+        # The finished archive page URLs, the good and the problematic URLs are in the log of the checkpoint
+        return {'sources': self._resumed_warc_filenames, 'warc': self._downloader.checkpoint(), 'columns': columns}
+
     def url_iterator(self):
         """
             The URL generation logic. We have one or more base URL to the archive (or column archives if there is more)
@@ -125,25 +181,141 @@ class NewsArchiveCrawler:
         :return: Every page of the archive contain multiple URL to the actual articles, which are extracted and
          then returned as an iterator based on URLs.
         """
-        for column_name, params in self._columns.items():
-            self._logger.log('INFO', 'Starting column:', column_name)
-            # 1) Set params for the actual column
-            self._store_settings(params)
-            # 2) By date with optional pagination (that is handled separately)
-            if self._archive_page_urls_by_date:
-                # a) Unique the generated archive page URLs using every day from date_from to the end of date_until
-                archive_page_urls = list(set(self._gen_url_from_date(self._date_from + timedelta(days=curr_day),
-                                                                     self._archive_url_format)
-                                             for curr_day in range((self._date_until - self._date_from).days + 1)))
-                # b) Sort the generated archive page URLs
-                archive_page_urls.sort(reverse=self._go_reverse_in_archive)
-            # 3) Stored in groups represented by pagination only which will be handled separately
-            else:
-                archive_page_urls = [self._archive_url_format]  # Only the base URL is added
+        self._column_contexts = [self._create_column_context(column_name, params)
+                                 for column_name, params in self._columns.items()]
+        column_workers = self._column_workers
+        if column_workers > 1 and self._checkpoint is not None:
+            self._logger.log('WARNING', 'Crawling the columns sequentially as checkpoints require it!')
+            column_workers = 1
+        if column_workers > 1 and len(self._column_contexts) > 1:
+            urls = self._gen_article_urls_from_columns_concurrently(self._column_contexts)
+        else:
+            urls = chain.from_iterable(self._gen_column_article_urls(ctx) for ctx in self._column_contexts)
 
-            # 4) Iterate the archive URLs and process them, while generating the required page URLs on demand
+        if self._checkpoint is None:
+            yield from urls
+        else:
+            self._checkpoint.save()
+            try:
+                for url in urls:
+                    yield url
+                    self._checkpoint.save_if_due()  # The consumer has finished with the URLs yielded so far
+            except (Exception, KeyboardInterrupt):  # Save the state before dying to be able to resume from it
+                self._checkpoint.save()
+                raise
+            self._checkpoint.save()
+        self._downloader.log_stats()
+
+    def _gen_column_article_urls(self, ctx):
+        self._logger.log('INFO', 'Starting column:', ctx.column_name)
+        # 1) By date with optional pagination (that is handled separately)
+        if ctx.archive_page_urls_by_date:
+            # Generate the archive page URLs lazily: one for each day, month or year (as in archive_url_format)
+            #  from date_from to the end of date_until in the order of the crawl
+            archive_page_urls = (self._gen_url_from_date(curr_date, ctx.archive_url_format)
+                                 for curr_date in self._gen_dates(ctx.date_from, ctx.date_until,
+                                                                  ctx.archive_url_format, ctx.go_reverse_in_archive))
+        # 2) Stored in groups represented by pagination only which will be handled separately
+        else:
+            archive_page_urls = [ctx.archive_url_format]  # Only the base URL is added
+
+        # 3) Skip the archive page URLs finished before the checkpoint of the resumed crawl
+        archive_page_urls = (archive_page_url for archive_page_url in archive_page_urls
+                             if archive_page_url not in ctx.done_archive_page_urls)
+
+        # 4) Iterate the archive URLs and process them, while generating the required page URLs on demand
+        if self._date_workers > 1 and ctx.archive_page_urls_by_date:
+            yield from self._gen_article_urls_from_shards(ctx, archive_page_urls)
+        else:
             for archive_page_url in archive_page_urls:
-                yield from self._gen_article_urls_including_subpages(archive_page_url)
+                urls_left, start = ctx.resume_position(archive_page_url)
+                yield from self._gen_tracked_article_urls(ctx, archive_page_url,
+                                                          self._gen_archive_pages(ctx, archive_page_url, start),
+                                                          urls_left, start)
+
+    def _gen_article_urls_from_columns_concurrently(self, column_contexts):
+        """
+            Crawl the columns in separate threads (the rate limits of the host are shared)
+             and yield their article URLs interleaved in the order they are found
+        """
+        queue = Queue(maxsize=1000)  # Backpressure: the columns do not run far ahead of the consumer
+        stop = Event()
+        done = object()  # Sentinel for the finished columns
+
+        def crawl_column(ctx):
+            try:
+                for url in self._gen_column_article_urls(ctx):
+                    while not stop.is_set():
+                        try:
+                            queue.put((url, None), timeout=1)
+                            break
+                        except Full:
+                            pass
+                    if stop.is_set():  # The consumer is gone
+                        break
+                queue.put((done, None))
+            except BaseException as e:  # Forward the error to the consumer
+                queue.put((done, e))
+
+        with ThreadPoolExecutor(min(self._column_workers, len(column_contexts))) as executor:
+            for ctx in column_contexts:
+                executor.submit(crawl_column, ctx)
+            try:
+                columns_left = len(column_contexts)
+                while columns_left > 0:
+                    url, error = queue.get()
+                    if url is done:
+                        if error is not None:
+                            raise error
+                        columns_left -= 1
+                    else:
+                        yield url
+            finally:
+                stop.set()  # Stop the remaining columns (on error or when the generator is closed)
+                while True:  # Unblock the waiting columns
+                    try:
+                        queue.get_nowait()
+                    except Empty:
+                        break
+
+    @staticmethod
+    def _gen_dates(date_from, date_until, url_format, reverse=False):
+        """
+            Walk the calendar from date_from to date_until (or backwards) and generate one date for every period
+             (day, month or year) according to the finest date placeholder of url_format, so _gen_url_from_date()
+             generates every URL exactly once and in order without generating (and uniquing) the URL for every day
+        """
+        if '#day' in url_format or '#next-day' in url_format:
+            granularity = 'day'
+        elif '#month' in url_format or '#next-month' in url_format:
+            granularity = 'month'
+        elif '#year' in url_format or '#next-year' in url_format:
+            granularity = 'year'
+        else:  # No date in the URL: there is only one period
+            yield date_from
+            return
+
+        if not reverse:
+            curr_date = date_from
+            while curr_date <= date_until:
+                yield curr_date
+                curr_date = NewsArchiveCrawler._date_period(curr_date, granularity)[1]
+        else:
+            curr_date = date_until
+            while curr_date >= date_from:
+                yield curr_date
+                curr_date = NewsArchiveCrawler._date_period(curr_date, granularity)[0] - timedelta(days=1)
+
+    @staticmethod
+    def _date_period(curr_date, granularity):
+        """The first day of the period (day, month or year) containing curr_date and the first day of the next one"""
+        if granularity == 'day':
+            return curr_date, curr_date + timedelta(days=1)
+        elif granularity == 'month':
+            first_day = curr_date.replace(day=1)
+            return first_day, first_day + timedelta(days=monthrange(curr_date.year, curr_date.month)[1])
+        else:
+            return curr_date.replace(month=1, day=1), curr_date.replace(year=curr_date.year + 1, month=1, day=1)
 
     @staticmethod
     def _gen_url_from_date(curr_date, url_format):
@@ -176,50 +348,134 @@ class NewsArchiveCrawler:
             replace('#next-day', '{0:02d}'.format(next_date.day))
         return art_list_url
 
-    def _gen_article_urls_including_subpages(self, archive_page_url_base):
+    def _gen_article_urls_from_shards(self, ctx, archive_page_urls):
         """
-            Generates article URLs from a supplied URL including the on-demand sub-pages that contains article URLs
+            Crawl the archive page URLs (eg. days) independently from each other in a thread pool
+             and yield their article URLs merged in the original order of the archive page URLs
+             (at most two archive page URLs per thread are crawled ahead)
         """
-        page_num = self._min_pagenum
-        tries_left = self._max_tries
-        first_page = True
-        next_page_url = archive_page_url_base.replace('#pagenum', self._initial_page_num)
-        while next_page_url is not None or tries_left > 0:
-            article_urls = []
-            archive_page_raw_html = self._downloader.download_url(next_page_url, self._ignore_archive_cache)
-            tries_left -= 1
-            curr_page_url = next_page_url
-            next_page_url = None
-            if archive_page_raw_html is not None:  # Download succeeded
-                self._good_urls_add(curr_page_url)
-                # 1) We need article URLs here to reliably determine the end of pages in some cases
-                article_urls = self._extract_article_urls_from_page_fun(archive_page_raw_html)
-                if len(article_urls) == 0 and (not self._infinite_scrolling or first_page):
-                    self._logger.log('WARNING', curr_page_url, 'Could not extract URLs from the archive!', sep='\t')
-                # 2) Generate next-page URL or None if there should not be any
-                next_page_url = self._find_next_page_url(archive_page_url_base, page_num, archive_page_raw_html,
-                                                         article_urls)
-                tries_left = self._max_tries  # Restore tries_left
-                page_num += 1  # Bump pagenum for next round
-                first_page = False
-                self._logger.log('DEBUG', 'URLs/ARCHIVE PAGE', curr_page_url, len(article_urls), sep='\t')
-                yield from article_urls
-            elif tries_left == 0:  # Download failed
-                if curr_page_url not in self.bad_urls and curr_page_url not in self._downloader.good_urls and \
-                        curr_page_url not in self._downloader.url_index:  # URLs in url_index should not be a problem
-                    self._problematic_urls_add(curr_page_url)  # New possibly bad URL
-                    self._logger.log('ERROR', curr_page_url, f'There are no tries left for URL!', sep='\t')
-            else:  # Retry download
-                self._logger.log('WARNING',
-                                 curr_page_url, f'Retrying URL ({self._max_tries - tries_left})!', sep='\t')
-                next_page_url = curr_page_url  # Restore URL for retrying
+        stop = Event()
+
+        def crawl_archive_page_url(archive_page_url, start):
+            pages = []
+            with closing(self._gen_archive_pages(ctx, archive_page_url, start)) as gen_pages:
+                for page in gen_pages:
+                    pages.append(page)
+                    if stop.is_set():  # The consumer is gone: do not download the next page
+                        break
+            return pages
+
+        with ThreadPoolExecutor(self._date_workers) as executor:
+            pending = deque()
+            try:
+                for archive_page_url in archive_page_urls:
+                    urls_left, start = ctx.resume_position(archive_page_url)
+                    pages = executor.submit(crawl_archive_page_url, archive_page_url, start)
+                    pending.append((archive_page_url, pages, urls_left, start))
+                    if len(pending) >= 2 * self._date_workers:
+                        archive_page_url, pages, urls_left, start = pending.popleft()
+                        yield from self._gen_tracked_article_urls(ctx, archive_page_url, pages.result(), urls_left,
+                                                                  start)
+                while len(pending) > 0:
+                    archive_page_url, pages, urls_left, start = pending.popleft()
+                    yield from self._gen_tracked_article_urls(ctx, archive_page_url, pages.result(), urls_left, start)
+            finally:
+                # On error or when the generator is closed: the archive page URLs crawled ahead stop after
+                #  their current page and the ones not started yet are dropped, so the executor does not wait for them
+                stop.set()
+                for _, pages, _, _ in pending:
+                    pages.cancel()
+
+    @staticmethod
+    def _gen_tracked_article_urls(ctx, archive_page_url_base, pages, urls_left=(), start=None):
+        """
+            Yield the article URLs from the pages of an archive page URL (see _gen_archive_pages)
+             and keep track of the position in the column for the checkpoints (in the thread of the consumer)
+        """
+        if start is not None:  # Resumed from the checkpoint: the rest of the page comes first
+            pages = chain([(urls_left, start)], pages)
+        for article_urls, next_page in pages:
+            ctx.curr_archive_page_url_base = archive_page_url_base
+            ctx.curr_article_urls = list(article_urls)
+            ctx.curr_article_urls_yielded = 0
+            ctx.next_page = next_page
+            for ctx.curr_article_urls_yielded, article_url in enumerate(ctx.curr_article_urls, start=1):
+                yield article_url
+        ctx.curr_archive_page_url_base = None
+        ctx.add_done_archive_page_url(archive_page_url_base)
+
+    def _gen_archive_pages(self, ctx, archive_page_url_base, start=None):
+        """
+            Generates the article URLs of the pages from a supplied URL including the on-demand sub-pages
+             with the state needed to continue from the next page: (article URLs, (next page URL, page number, first))
+        """
+        if self._prefetch_window > 0 and ctx.predicted_page_urls is not None:
+            prefetcher = _ArchivePagePrefetcher(self._downloader, self._prefetch_window, ctx.ignore_archive_cache,
+                                                ctx.extract_article_urls_from_page_fun)
+        else:
+            prefetcher = None
+        if start is None:
+            start = (archive_page_url_base.replace('#pagenum', ctx.initial_page_num), ctx.min_pagenum, True)
+        next_page_url, page_num, first_page = start
+        tries_left = ctx.max_tries
+        try:
+            while next_page_url is not None and tries_left > 0:
+                article_urls = []
+                if prefetcher is not None:
+                    # Download the next pages speculatively (from the current one after the first page)
+                    prefetcher.prefetch(ctx.predicted_page_urls(archive_page_url_base,
+                                                                  page_num - int(not first_page),
+                                                                  self._prefetch_window))
+                    archive_page_raw_html = prefetcher.download_url(next_page_url)
+                else:
+                    archive_page_raw_html = self._downloader.download_url(next_page_url, ctx.ignore_archive_cache)
+                tries_left -= 1
+                curr_page_url = next_page_url
+                next_page_url = None
+                if archive_page_raw_html is not None:  # Download succeeded
+                    self._good_urls_add(curr_page_url)
+                    # The page is parsed (at most) once for the functions which get the parsed page
+                    archive_page = ParsedPage(archive_page_raw_html)
+                    # 1) We need article URLs here to reliably determine the end of pages in some cases
+                    article_urls = archive_page.apply(ctx.extract_article_urls_from_page_fun)
+                    if len(article_urls) == 0 and (not ctx.infinite_scrolling or first_page):
+                        self._logger.log('WARNING', curr_page_url, 'Could not extract URLs from the archive!',
+                                         sep='\t')
+                    # 2) Generate next-page URL or None if there should not be any
+                    next_page_url = ctx.find_next_page_url(archive_page_url_base, page_num, archive_page, article_urls)
+                    tries_left = ctx.max_tries  # Restore tries_left
+                    page_num += 1  # Bump pagenum for next round
+                    first_page = False
+                    self._logger.log('DEBUG', 'URLs/ARCHIVE PAGE', curr_page_url, len(article_urls), sep='\t')
+                    yield article_urls, (next_page_url, page_num, first_page)
+                elif tries_left == 0:  # Download failed
+                    if curr_page_url not in self.bad_urls and curr_page_url not in self._downloader.good_urls and \
+                            curr_page_url not in self._downloader.url_index:  # URLs in url_index are not a problem
+                        self._problematic_urls_add(curr_page_url)  # New possibly bad URL
+                        self._logger.log('ERROR', curr_page_url, f'There are no tries left for URL!', sep='\t')
+                else:  # Retry download
+                    self._logger.log('WARNING',
+                                     curr_page_url, f'Retrying URL ({ctx.max_tries - tries_left})!', sep='\t')
+                    next_page_url = curr_page_url  # Restore URL for retrying
+        finally:
+            if prefetcher is not None:  # Stop condition fired (or the generator is closed): drop speculative pages
+                prefetcher.discard()
+
+    @staticmethod
+    def _predicted_page_urls_factory(max_pagenum):
+
+        def predicted_page_urls(archive_page_url_base, page_num, window):
+            """The URLs of the next pages (at most window number of them) as find_nex_page_url_spec would generate"""
+            return [archive_page_url_base.replace('#pagenum', str(next_page_num))
+                    for next_page_num in range(page_num, min(page_num + window, max_pagenum + 1))]
+        return predicted_page_urls
 
     @staticmethod
     def _find_next_page_url_factory(extract_next_page_url_fun, next_url_by_pagenum, infinite_scrolling, max_pagenum,
                                     art_url_threshold, known_article_urls, stop_on_empty_archive_page,
                                     stop_on_taboo_set, taboo_article_urls):
 
-        def find_nex_page_url_spec(archive_page_url_base, page_num, raw_html, article_urls):
+        def find_nex_page_url_spec(archive_page_url_base, page_num, archive_page, article_urls):
             """
                 The next URL can be determined by various conditions (no matter how the pages are grouped):
                  1) If there is no pagination we return None
@@ -236,7 +492,7 @@ class NewsArchiveCrawler:
                 next_page_url = None
             # Method #3: Use special function to follow the link to the next page
             elif extract_next_page_url_fun is not None:
-                next_page_url = extract_next_page_url_fun(raw_html)
+                next_page_url = archive_page.apply(extract_next_page_url_fun)
             elif (next_url_by_pagenum and  # There are page numbering
                     # Method #4: No link, but infinite scrolling! (also good for inactive archive, without other clues)
                     ((infinite_scrolling and len(article_urls) > 0) or
@@ -253,6 +509,108 @@ class NewsArchiveCrawler:
         return find_nex_page_url_spec
 
 
+class _ColumnContext:
+    """
+        The settings of a column of the archive for NewsArchiveCrawler (see _create_column_context)
+    """
+    def __init__(self, column_name):
+        self.column_name = column_name
+        self.archive_page_urls_by_date = None
+        self.archive_url_format = None
+        self.date_from = None
+        self.date_until = None
+        self.go_reverse_in_archive = None
+        self.min_pagenum = None
+        self.initial_page_num = None
+        self.ignore_archive_cache = None
+        self.infinite_scrolling = None
+        self.extract_article_urls_from_page_fun = None
+        self.find_next_page_url = None
+        self.max_tries = None
+        self.predicted_page_urls = None
+
+        # The position of the crawl for the checkpoints (see NewsArchiveCrawler._gen_tracked_article_urls)
+        self.checkpoint = None
+        self.done_archive_page_urls = set()
+        self.resumed_position = None
+        self.curr_archive_page_url_base = None
+        self.curr_article_urls = []
+        self.curr_article_urls_yielded = 0
+        self.next_page = None
+
+    def checkpoint_state(self):
+        position = None
+        if self.curr_archive_page_url_base is not None:
+            next_page_url, page_num, first_page = self.next_page
+            position = {'archive_page_url_base': self.curr_archive_page_url_base,
+                        'urls_left': self.curr_article_urls[self.curr_article_urls_yielded:],
+                        'next_page_url': next_page_url, 'page_num': page_num, 'first_page': first_page}
+        return {'position': position}
+
+    def add_done_archive_page_url(self, archive_page_url_base):
+        self.done_archive_page_urls.add(archive_page_url_base)
+        if self.checkpoint is not None:  # Logged instead of being saved at each checkpoint
+            self.checkpoint.log('archive', 'done_archive_page_urls', (self.column_name, archive_page_url_base))
+
+    def resume_position(self, archive_page_url_base):
+        """The article URLs left and the next page to continue with if the crawl stopped at the supplied URL"""
+        position = self.resumed_position
+        if position is None or position['archive_page_url_base'] != archive_page_url_base:
+            return (), None
+        return position['urls_left'], (position['next_page_url'], position['page_num'], position['first_page'])
+
+
+class _ArchivePagePrefetcher:
+    """
+        Downloads the predicted next archive pages speculatively in a thread pool (see NewsArchiveCrawler).
+        The WARC records of a page are written only when the page is consumed (in order),
+         the rest is discarded when the crawling of the archive page stops.
+        Likewise, the errors of a speculative download count toward the error threshold only when the page is consumed
+        The extraction of the article URLs is also started ahead when it runs in an ExtractionPool
+    """
+    def __init__(self, downloader, window, ignore_cache, extract_article_urls_from_page_fun=None):
+        self._downloader = downloader
+        self._window = window
+        self._ignore_cache = ignore_cache
+        self._prefetch_extraction = getattr(extract_article_urls_from_page_fun, 'prefetch', None)
+        self._executor = ThreadPoolExecutor(window)
+        self._pending = OrderedDict()  # URL -> Future in the order of the pages
+
+    def prefetch(self, urls):
+        for url in urls:
+            if len(self._pending) >= self._window:
+                break
+            if url not in self._pending:
+                self._pending[url] = self._executor.submit(self._download_url_ahead, url)
+
+    def _download_url_ahead(self, url):
+        self._downloader.defer_errors(url)
+        ret = self._downloader.download_url(url, self._ignore_cache, return_warc_records_wo_writing=True)
+        if ret is not None and self._prefetch_extraction is not None:
+            self._prefetch_extraction(ret[1])
+        return ret
+
+    def download_url(self, url):
+        future = self._pending.pop(url, None)
+        if future is None:  # Not predicted (eg. the first page or retrying)
+            return self._downloader.download_url(url, self._ignore_cache)
+        ret = future.result()
+        self._downloader.count_deferred_errors(url)
+        if ret is None:
+            return None
+        rec, text = ret
+        self._downloader.write_records_for_url(url, rec)
+        return text
+
+    def discard(self):
+        for future in self._pending.values():
+            future.cancel()
+        self._executor.shutdown(wait=True)  # The already running downloads are finished and thrown away
+        for url in self._pending.keys():
+            self._downloader.drop_deferred_errors(url)
+        self._pending.clear()
+
+
 class NewsArchiveDummyCrawler:
     def __init__(self, url_index_keys, *_, **__):
         self._url_index_keys = url_index_keys
@@ -273,7 +631,8 @@ class NewsArticleCrawler:
 
     def __init__(self, settings, articles_existing_warc_filenames, articles_new_warc_filename,
                  archive_existing_warc_filenames, archive_new_warc_filename, articles_just_cache=False,
-                 archive_just_cache=False, known_article_urls=None, debug_params=None, download_params=None):
+                 archive_just_cache=False, known_article_urls=None, debug_params=None, download_params=None,
+                 download_workers=1, archive_params=None, checkpoint=None):
 
         # Initialise the logger
         self._logger = Logger(settings['log_file_articles'])
@@ -293,13 +652,42 @@ class NewsArticleCrawler:
             self._date_from = settings['date_from']
             self._date_until = settings['date_from']
 
+        # The number of article downloads in flight (see process_urls)
+        self._download_workers = download_workers
+        # Started ahead in the download threads when it runs in an ExtractionPool (see _download_article_ahead)
+        self._prefetch_extraction = getattr(settings['NEXT_PAGE_OF_ARTICLE_FUN'], 'prefetch', None)
+
         # Get the initialised corpus converter (can be dummy) and set the appropriate logger
         self._converter = settings['CORPUS_CONVERTER']
         self._converter.logger = self._logger
 
+        # The URLs waiting to be processed (see process_urls) and the state of the resumed crawl (see Checkpoint)
+        self._pending_urls = set()
+        self._in_flight_urls = set()
+        self._resumed_urls = set()  # Processed before the checkpoint
+        self._resumed_warc_filenames = []
+        self._checkpoint = checkpoint
+        articles_download_params = download_params
+        if checkpoint is not None:
+            articles_state = checkpoint.get('articles')
+            articles_existing_warc_filenames, self._resumed_warc_filenames = \
+                add_resumed_warc_filenames(articles_existing_warc_filenames, checkpoint, 'articles', self._logger)
+            self._resumed_urls.update(articles_state.get('processed_urls', ()))
+            self.problematic_article_urls.update(articles_state.get('problematic_urls', ()))
+            self._pending_urls.update(articles_state.get('pending_urls', ()))
+            articles_download_params = dict(download_params or {}, track_record_offsets=True,
+                                            host_encodings=(articles_state.get('warc') or {}).get('host_encodings'))
+            if len(self._resumed_warc_filenames) > 0:  # They must not be overwritten as they are read
+                articles_download_params['overwrite_warc'] = False
+            # The URLs are logged as they are added instead of saving all of them at each checkpoint
+            self._new_urls_add = checkpoint.log_added('articles', 'processed_urls', self._new_urls_add)
+            self._problematic_article_urls_add = checkpoint.log_added('articles', 'problematic_urls',
+                                                                      self._problematic_article_urls_add)
+            checkpoint.register('articles', self._checkpoint_state)
+
         # Create new archive while downloading, or simulate download and read the archive
         self._downloader = WarcCachingDownloader(articles_existing_warc_filenames, articles_new_warc_filename,
-                                                 self._logger, articles_just_cache, download_params)
+                                                 self._logger, articles_just_cache, articles_download_params)
 
         if known_article_urls is None:  # If None is supplied copy the ones from the article archive
             known_article_urls = self._downloader.url_index  # All URLs in the archive are known good!
@@ -311,7 +699,8 @@ class NewsArticleCrawler:
             # For downloading the articles from a (possibly read-only) archive
             self._archive_downloader = NewsArchiveCrawler(settings, archive_existing_warc_filenames,
                                                           archive_new_warc_filename, archive_just_cache,
-                                                          known_article_urls, debug_params, download_params)
+                                                          known_article_urls, debug_params, download_params,
+                                                          archive_params, checkpoint)
 
     def __del__(self):
         if hasattr(self, '_archive_downloader'):  # Make sure that the previous files are closed...
@@ -333,62 +722,173 @@ class NewsArticleCrawler:
         # New good URL newly downloaded (either Article or Archive)
         # We do not count old good URLs (url_index) have taken from the cache WARC (either Article or Archive)
         #  as they are needed to be copied to the target WARC!
-        return url in self._downloader.good_urls or url in self._archive_downloader.good_urls
+        # The URLs processed before the checkpoint of the resumed crawl are in its WARC files (now in url_index)
+        return url in self._downloader.good_urls or url in self._archive_downloader.good_urls or \
+            url in self._resumed_urls
+
+    def _checkpoint_state(self):
+        # The processed and the problematic URLs are in the log of the checkpoint
+        return {'sources': self._resumed_warc_filenames, 'warc': self._downloader.checkpoint(),
+                'pending_urls': sorted(self._pending_urls | self._in_flight_urls)}
 
     def download_and_extract_all_articles(self):
         self.process_urls(self._archive_downloader.url_iterator())
+        self._downloader.log_stats()
 
     def process_urls(self, it):
-        urls = set()
-        for url in it:
-            urls.add(url)
-            while len(urls) > 0:
-                # This loop runs only one iteration if no URLs are extracted in step (6) else it consumes them first
+        """Process the URLs pending from the resumed crawl and then the URLs of the iterator"""
+        if self._checkpoint is None:
+            self._process_urls(it)
+            return
+
+        self._checkpoint.save()
+        try:
+            self._process_urls(it)
+        except (Exception, KeyboardInterrupt):  # Save the state before dying to be able to resume from it
+            self._checkpoint.save()
+            raise
+        self._checkpoint.save()
+
+    def _process_urls(self, it):
+        if self._download_workers > 1:
+            self._process_urls_concurrently(it)
+            return
+
+        urls = self._pending_urls
+        it = iter(it)
+        while True:
+            # Consume the URLs extracted in step (6) first and read the iterator only when there is none of them
+            if len(urls) == 0:
+                url = next(it, None)
+                if url is None:
+                    break
+            else:
                 url = urls.pop()
-                # 1) Check if the URL is
-                # 1a) Explicitly marked as bad URL (either Article or Archive) -> Skip it, only INFO log!
-                if url in self._downloader.bad_urls or url in self._archive_downloader.bad_urls:
-                    self._logger.log('DEBUG', url, 'Skipping URLs explicitly marked as bad!', sep='\t')
-                    continue
-                # 1b) Download succeeded in this session either Article or Archive (duplicate)
-                # 1c) Download failed in this session and requires manual check either Article or Archive (duplicate)
-                elif self._is_processed_good_url(url) or \
-                        url in self.problematic_article_urls or url in self._archive_downloader.problematic_urls:
-                    self._logger.log('WARNING', url, 'Not processing URL, because it is an URL already'
-                                                     ' encountered in this session (including the caches)'
-                                                     ' or it is known to point to the portal\'s archive!', sep='\t')
-                    continue
-
-                # 2) "Download" article
-                article_raw_html = self._downloader.download_url(url)
-                if article_raw_html is None:  # Download failed, must be investigated!
-                    self._logger.log('ERROR', url, 'Article was not processed because download failed!', sep='\t')
-                    self._problematic_article_urls_add(url)  # New problematic URL for manual checking
-                    continue
-                self._new_urls_add(url)  # New article URLs
-
-                # 3) Identify the site scheme of the article to be able to look up the appropriate extracting method
-                scheme = self._converter.identify_site_scheme(url, article_raw_html)
-
-                # 4) Filter: time filtering when archive page URLs are not generated by date if needed
-                if self._filter_by_date:
-                    # a) Retrieve the date
-                    article_date = self._converter.extract_article_date(url, article_raw_html, scheme)
-                    if article_date is None:
-                        self._logger.log('ERROR', url, 'DATE COULD NOT BE PARSED!', sep='\t')
-                        continue
-                    # b) Check date interval
-                    elif not self._date_from <= article_date <= self._date_until:
-                        self._logger.log('WARNING', url, 'Date ({0}) is not in the specified interval: {1}-{2}'
-                                                         ' didn\'t use it in the corpus'.
-                                         format(article_date, self._date_from, self._date_until), sep='\t')
-                        continue
-
-                # 5) Extract text to corpus
-                self._converter.article_to_corpus(url, article_raw_html, scheme)
-
-                # 6) Extract links to other articles and check for already extracted urls (also in the archive)?
-                urls_to_follow = self._converter.follow_links_on_page(url, article_raw_html, scheme)
-                # Only add those which has not been already handled to avoid loops!
-                urls |= {url for url in urls_to_follow
-                         if not self._is_processed_good_url(url) and not self._is_problematic_url(url)}
+            # 1) Check if the URL is to be processed
+            if not self._is_url_to_process(url):
+                continue
+
+            # 2) "Download" article
+            self._in_flight_urls.add(url)
+            article_raw_html = self._downloader.download_url(url)
+
+            # 3-6) Process the article and add the URLs to follow
+            urls |= self._process_article(url, article_raw_html)
+            self._in_flight_urls.remove(url)
+            if self._checkpoint is not None:
+                self._checkpoint.save_if_due()
+
+    def _process_urls_concurrently(self, it):
+        """
+            The same as process_urls, but with self._download_workers downloads in flight in a thread pool.
+            The rate limits of the downloader are shared by the threads, and the WARC records and the results are
+             written (and processed) in the main thread one URL at a time, in the order of completion
+        """
+        urls = self._pending_urls  # Waiting to be downloaded: followed links are consumed before reading the iterator
+        in_flight = {}  # Future -> URL
+        in_flight_urls = self._in_flight_urls
+        it = iter(it)
+        it_exhausted = False
+        with ThreadPoolExecutor(self._download_workers) as executor:
+            while True:
+                # Fill the pool from the followed links first, then from the iterator
+                while len(in_flight) < self._download_workers:
+                    if len(urls) == 0:
+                        if it_exhausted:
+                            break
+                        url = next(it, None)
+                        if url is None:
+                            it_exhausted = True
+                            break
+                    else:
+                        url = urls.pop()
+                    # 1) Check if the URL is to be processed (or it is already in flight)
+                    if url in in_flight_urls:
+                        self._logger.log('WARNING', url, 'Not processing URL, because it is an URL already'
+                                                         ' encountered in this session!', sep='\t')
+                    elif self._is_url_to_process(url):
+                        # 2) "Download" article (the records are returned to be written here)
+                        in_flight[executor.submit(self._download_article_ahead, url)] = url
+                        in_flight_urls.add(url)
+
+                if len(in_flight) == 0:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = in_flight.pop(future)
+                    ret = future.result()  # Exceptions (eg. error threshold exceeded) are raised here
+                    if ret is not None:
+                        rec, article_raw_html = ret
+                        self._downloader.write_records_for_url(url, rec)
+                    else:
+                        article_raw_html = None
+
+                    # 3-6) Process the article and add the URLs to follow
+                    urls |= {url_to_follow for url_to_follow in self._process_article(url, article_raw_html)
+                             if url_to_follow not in in_flight_urls}
+                    in_flight_urls.remove(url)  # Processed (it is pending for the checkpoints until this point)
+                if self._checkpoint is not None:
+                    self._checkpoint.save_if_due()
+
+    def _download_article_ahead(self, url):
+        """Download in a worker thread and start extracting the next page of the article if it runs in a pool"""
+        ret = self._downloader.download_url(url, return_warc_records_wo_writing=True)
+        if ret is not None and self._prefetch_extraction is not None:
+            self._prefetch_extraction(ret[1])
+        return ret
+
+    def _is_url_to_process(self, url):
+        # 1a) Explicitly marked as bad URL (either Article or Archive) -> Skip it, only INFO log!
+        if url in self._downloader.bad_urls or url in self._archive_downloader.bad_urls:
+            self._logger.log('DEBUG', url, 'Skipping URLs explicitly marked as bad!', sep='\t')
+            return False
+        # 1b) Download succeeded in this session either Article or Archive (duplicate)
+        # 1c) Download failed in this session and requires manual check either Article or Archive (duplicate)
+        elif self._is_processed_good_url(url) or \
+                url in self.problematic_article_urls or url in self._archive_downloader.problematic_urls:
+            self._logger.log('WARNING', url, 'Not processing URL, because it is an URL already'
+                                             ' encountered in this session (including the caches)'
+                                             ' or it is known to point to the portal\'s archive!', sep='\t')
+            return False
+        return True
+
+    def _process_article(self, url, article_raw_html):
+        """Process the downloaded article (steps 3-6) and return the set of new URLs to follow"""
+        if article_raw_html is None:  # Download failed, must be investigated!
+            self._logger.log('ERROR', url, 'Article was not processed because download failed!', sep='\t')
+            self._problematic_article_urls_add(url)  # New problematic URL for manual checking
+            return set()
+        urls_to_follow = self._process_downloaded_article(url, article_raw_html)
+        # New article URLs (added when finished, so the checkpoint of a crawl which died while processing the article
+        #  has it among the pending URLs only and it is processed again when resuming)
+        self._new_urls_add(url)
+        return urls_to_follow
+
+    def _process_downloaded_article(self, url, article_raw_html):
+        """Steps 3-6 of _process_article()"""
+        # 3) Identify the site scheme of the article to be able to look up the appropriate extracting method
+        scheme = self._converter.identify_site_scheme(url, article_raw_html)
+
+        # 4) Filter: time filtering when archive page URLs are not generated by date if needed
+        if self._filter_by_date:
+            # a) Retrieve the date
+            article_date = self._converter.extract_article_date(url, article_raw_html, scheme)
+            if article_date is None:
+                self._logger.log('ERROR', url, 'DATE COULD NOT BE PARSED!', sep='\t')
+                return set()
+            # b) Check date interval
+            elif not self._date_from <= article_date <= self._date_until:
+                self._logger.log('WARNING', url, 'Date ({0}) is not in the specified interval: {1}-{2}'
+                                                 ' didn\'t use it in the corpus'.
+                                 format(article_date, self._date_from, self._date_until), sep='\t')
+                return set()
+
+        # 5) Extract text to corpus
+        self._converter.article_to_corpus(url, article_raw_html, scheme)
+
+        # 6) Extract links to other articles and check for already extracted urls (also in the archive)?
+        urls_to_follow = self._converter.follow_links_on_page(url, article_raw_html, scheme)
+        # Only add those which has not been already handled to avoid loops!
+        return {url for url in urls_to_follow
+                if not self._is_processed_good_url(url) and not self._is_problematic_url(url)}
@@ -4,7 +4,9 @@
 from itertools import groupby
 from collections import defaultdict
 
-from . import WarcCachingDownloader, create_or_check_clean_dir, write_content_to_url_named_file
+from . import WarcCachingDownloader, WarcReader, create_or_check_clean_dir, write_content_to_url_named_file
+from .warc_index import write_cdxj_index
+from .extraction_pool import extract_ahead
 
 
 def validate_warc_file(source_warcfiles, validator_logger):
@@ -14,6 +16,12 @@ def validate_warc_file(source_warcfiles, validator_logger):
     return reader.url_index
 
 
+def create_cdxj_index(source_warcfiles, indexer_logger):
+    """ Write a SURT-sorted CDXJ index next to every supplied WARC file (filename.cdxj) to be used by WarcReader """
+    for warc_filename in source_warcfiles:
+        write_cdxj_index(warc_filename, '{0}{1}'.format(warc_filename, WarcReader.cdxj_ext), indexer_logger)
+
+
 def online_test(url='https://index.hu/belfold/2018/08/27/fidesz_media_helyreigazitas/', filename='example.warc.gz',
                 test_logger=None):
     w = WarcCachingDownloader(None, filename, test_logger)
@@ -73,21 +81,21 @@ def sample_warc_by_urls(source_warcfiles, new_urls, sampler_logger, target_warcf
 
 
 def archive_page_contains_article_url(extract_article_urls_from_page_plus_fun, source_warcfiles, checked_urls,
-                                      sampler_logger, out_dir):
+                                      sampler_logger, out_dir, reader_cache_size=0, reader_cache_policy='lru'):
     """Extract HTML content for archive URLs which contains checked_urls as article urls (for debugging the portal)"""
 
     checked_urls = {url.rstrip() for url in checked_urls}
     create_or_check_clean_dir(out_dir)
 
     w = WarcCachingDownloader(source_warcfiles, None, sampler_logger, just_cache=True,
-                              download_params={'stay_offline': True})
+                              download_params={'stay_offline': True, 'reader_cache_size': reader_cache_size,
+                                               'reader_cache_policy': reader_cache_policy})
 
     url_to_fname = {}
     archive_page_for_checked_urls = defaultdict(set)
-    for url in sorted(w.url_index):
-        raw_html = w.download_url(url)
+    pages = ((url, w.download_url(url)) for url in sorted(w.url_index))
+    for url, raw_html, article_urls_w_meta in extract_ahead(extract_article_urls_from_page_plus_fun, pages):
         if raw_html is not None:
-            article_urls_w_meta = extract_article_urls_from_page_plus_fun(raw_html)
             if len(article_urls_w_meta) > 0:
                 checked_urls_in_page = sorted((e for e in article_urls_w_meta if e[0] in checked_urls))
                 for checked_url, *checked_url_meta in checked_urls_in_page:
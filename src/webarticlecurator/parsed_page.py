@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from functools import wraps
+
+from bs4 import BeautifulSoup
+
+
+def parse_page(raw_html):
+    """The parsed page which is given to the portal specific functions marked with @parses_page"""
+    return BeautifulSoup(raw_html, 'lxml')
+
+
+def parses_page(fun):
+    """
+        Mark a portal specific function which gets the parsed page (see parse_page()) instead of the raw HTML,
+         so the crawler can parse each archive page only once for all functions (see ParsedPage).
+        The same tree is shared between the functions, so they must not modify it!
+        The function can still be called with the raw HTML (eg. by the corpus converters, the tests and in the
+         other modes) and it is parsed then
+    """
+    @wraps(fun)
+    def parses_page_wrapper(page):
+        if isinstance(page, str):
+            page = parse_page(page)
+        return fun(page)
+
+    parses_page_wrapper.page_parser = parse_page
+    return parses_page_wrapper
+
+
+class ParsedPage:
+    """
+        The raw HTML of a page parsed on demand only once for the functions which have the same page_parser
+         (eg. the ones marked with @parses_page or the selectors of SelectorExtractor),
+         the other functions (and the ones running in an ExtractionPool) get the raw HTML
+    """
+    def __init__(self, raw_html):
+        self.raw_html = raw_html
+        self._parsed = {}  # page_parser -> parsed page
+
+    def apply(self, fun):
+        page_parser = getattr(fun, 'page_parser', None)
+        if page_parser is None:
+            return fun(self.raw_html)
+        page = self._parsed.get(page_parser)
+        if page is None:
+            page = page_parser(self.raw_html)
+            self._parsed[page_parser] = page
+        return fun(page)
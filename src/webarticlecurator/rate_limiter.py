@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Token-bucket rate limiting shared by all downloaders of the process (or of many processes through files)
+
+import os
+from time import monotonic, time
+from email.utils import parsedate_to_datetime
+from struct import Struct
+from threading import Lock
+from urllib.parse import quote
+
+try:
+    import fcntl  # Only needed for FileTokenBucket (POSIX only)
+except ImportError:
+    fcntl = None
+
+
+class TokenBucket:
+    """
+        The bucket holds at most burst tokens and it is refilled with rate tokens per second.
+        Every call takes one token. When the bucket is empty the token is borrowed and the caller must wait
+         until it would have arrived, so waiting callers are served in the order of their reservation.
+        reserve() does not sleep, the caller sleeps (or awaits) for the returned number of seconds.
+        The time is measured by clock (it can be replaced, eg. in tests)
+    """
+    def __init__(self, rate, burst, clock=monotonic):
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._last_update = clock()
+        self._lock = Lock()
+
+    @staticmethod
+    def _take_token(tokens, last_update, now, rate, burst):
+        """Refill the tokens for the elapsed time, take one token and return the new state with the delay"""
+        tokens = min(burst, tokens + (now - last_update) * rate) - 1
+        if tokens >= 0:
+            delay = 0.0
+        else:
+            delay = -tokens / rate
+        return tokens, now, delay
+
+    def reserve(self):
+        with self._lock:
+            self._tokens, self._last_update, delay = \
+                self._take_token(self._tokens, self._last_update, self._clock(), self._rate, self._burst)
+        return delay
+
+
+class FileTokenBucket(TokenBucket):
+    """
+        The same as TokenBucket, but the state of the bucket is stored in a file under an exclusive lock,
+         so many processes (eg. crawling the same portal) can share it. The wall clock is used as it is common
+    """
+    _state = Struct('<dd')  # tokens, last_update
+
+    def __init__(self, filename, rate, burst, clock=time):
+        if fcntl is None:
+            raise NotImplementedError('Rate limiter state files require fcntl (POSIX) which is unavailable!')
+        super().__init__(rate, burst, clock)
+        self._filename = filename
+
+    def reserve(self):
+        # The file is opened for each reservation, because flock() does not exclude forked processes
+        #  which share the same file descriptor
+        fd = os.open(self._filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            state = os.pread(fd, self._state.size, 0)
+            now = self._clock()
+            if len(state) == self._state.size:
+                tokens, last_update = self._state.unpack(state)
+            else:  # New state file
+                tokens, last_update = self._burst, now
+            tokens, last_update, delay = self._take_token(tokens, last_update, now, self._rate, self._burst)
+            os.pwrite(fd, self._state.pack(tokens, last_update), 0)
+        finally:
+            os.close(fd)  # Releases the lock
+        return delay
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+        TokenBucket with AIMD (additive increase, multiplicative decrease) control over its rate:
+         the rate increases while the (smoothed) latency of the server stays flat and decreases when it grows.
+         On 429 Too Many Requests and 503 Service Unavailable the rate is halved and
+         no tokens are given out until the time in the Retry-After header (if any) elapses
+    """
+    increase_step = 0.05  # Of the initial rate after every response with flat latency
+    latency_decrease = 0.9
+    backoff_decrease = 0.5
+    latency_tolerance = 1.5  # Latency is flat until it is below the base latency multiplied by this
+    smoothing = 0.2  # Weight of the last latency in the smoothed latency (exponentially weighted moving average)
+    base_latency_drift = 0.01  # The base latency follows the slowly growing latency of the server
+    min_rate_factor = 1 / 16  # Of the initial rate
+    max_rate_factor = 8  # Of the initial rate
+    backoff_status_codes = {429, 503}
+
+    def __init__(self, rate, burst, clock=monotonic):
+        super().__init__(rate, burst, clock)
+        self._min_rate = rate * self.min_rate_factor
+        self._max_rate = rate * self.max_rate_factor
+        self._increase = rate * self.increase_step
+        self._latency = None
+        self._base_latency = None
+        self._blocked_until = 0.0
+
+    def reserve(self):
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._blocked_until)  # The token is taken when the backoff ends
+            self._tokens, self._last_update, delay = \
+                self._take_token(self._tokens, self._last_update, start, self._rate, self._burst)
+        return delay + start - now
+
+    def feedback(self, status_code, latency, retry_after=None):
+        """
+            Adjust the rate according to the response (status code, latency and Retry-After header)
+             and return the log level with the description of the change or None
+        """
+        with self._lock:
+            old_rate = self._rate
+            if status_code in self.backoff_status_codes:
+                self._rate = max(self._min_rate, self._rate * self.backoff_decrease)
+                retry_after = parse_retry_after(retry_after)
+                if retry_after is not None:
+                    self._blocked_until = max(self._blocked_until, self._clock() + retry_after)
+                return 'WARNING', 'Backing off on {0}: rate {1:.3f} -> {2:.3f} calls/s, Retry-After: {3} s'.\
+                    format(status_code, old_rate, self._rate, retry_after)
+
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency += self.smoothing * (latency - self._latency)
+            if self._base_latency is None or self._latency < self._base_latency:
+                self._base_latency = self._latency
+            else:
+                self._base_latency += self.base_latency_drift * (self._latency - self._base_latency)
+
+            if self._latency > self._base_latency * self.latency_tolerance:
+                self._rate = max(self._min_rate, self._rate * self.latency_decrease)
+                level, event = 'INFO', 'Latency grows'
+            else:
+                self._rate = min(self._max_rate, self._rate + self._increase)
+                level, event = 'DEBUG', 'Latency is flat'
+            if self._rate == old_rate:
+                return None
+            return level, '{0} ({1:.3f} s, base: {2:.3f} s): rate {3:.3f} -> {4:.3f} calls/s'.\
+                format(event, self._latency, self._base_latency, old_rate, self._rate)
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds from the value of the Retry-After header (delay-seconds or HTTP-date) or None"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError, IndexError):  # Invalid date, ignore the header
+        return None
+
+
+_token_buckets = {}
+_token_buckets_lock = Lock()
+
+
+def get_token_bucket(host, calls, period, burst=None, state_dir=None, adaptive=False):
+    """
+        Return the token bucket for the host (calls in period seconds with at most burst calls at once,
+         by default burst equals calls) which is shared by all downloaders in the process.
+        If state_dir is given the bucket is also shared with the other processes using the same directory.
+        If adaptive is True, the rate of the bucket is adjusted according to the responses (in-process only).
+        The first downloader which asks for the bucket of a host sets its parameters
+    """
+    key = (host, state_dir, adaptive)
+    with _token_buckets_lock:
+        bucket = _token_buckets.get(key)
+        if bucket is None:
+            if burst is None:
+                burst = calls
+            if adaptive:
+                if state_dir is not None:
+                    raise ValueError('The adaptive token bucket can not be shared between processes!')
+                bucket = AdaptiveTokenBucket(calls / period, burst)
+            elif state_dir is None:
+                bucket = TokenBucket(calls / period, burst)
+            else:
+                os.makedirs(state_dir, exist_ok=True)
+                filename = os.path.join(state_dir, '{0}.bucket'.format(quote(host, safe='')))
+                bucket = FileTokenBucket(filename, calls / period, burst)
+            _token_buckets[key] = bucket
+    return bucket
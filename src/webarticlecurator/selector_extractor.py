@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from lxml.etree import XPath, ParserError
+from lxml.html import HTMLParser, document_fromstring
+
+# The href of the selected element if it is a link or of the first link inside it (if it has any)
+_first_href = XPath('(descendant-or-self::a)[1]/@href', smart_strings=False)
+
+
+def parse_page_lxml(raw_html):
+    """The parsed page (lxml HTML tree) which is given to the selectors (see SelectorExtractor)"""
+    try:
+        # lxml does not accept str with encoding declaration (eg. <?xml ... encoding="..."?>)
+        return document_fromstring(raw_html.encode('UTF-8'), parser=HTMLParser(encoding='UTF-8'))
+    except ParserError:  # Empty document
+        return None
+
+
+class SelectorExtractor:
+    """
+        Extract URLs from a page with a CSS selector from the site schema (eg. article_url_selector) instead of
+         a portal specific function. The selector is compiled to XPath only once and the page is parsed by lxml
+         (shared between the selectors, see ParsedPage) without building a BeautifulSoup tree.
+        The URLs are the hrefs of the selected elements if they are links or of the first link inside them
+         (see safe_extract_hrefs_from_a_tags() in the example extractor functions) prefixed with url_prefix.
+        If first_only is True, the URL of the first selected element or None (also if the first selected element has
+         no link) is returned, the set of URLs otherwise
+    """
+    page_parser = staticmethod(parse_page_lxml)
+
+    def __init__(self, selector, url_prefix='', first_only=False):
+        try:
+            from lxml.cssselect import CSSSelector, SelectorError
+        except ImportError:
+            raise ImportError('The selectors in the site schema require the cssselect package'
+                              ' (eg. pip install webarticlecurator[selectors])!')
+        try:
+            self._select = CSSSelector(selector, translator='html')
+        except SelectorError as e:
+            raise ValueError('Invalid CSS selector \'{0}\': {1}'.format(selector, e))
+        self.__name__ = selector
+        self._url_prefix = url_prefix
+        self._first_only = first_only
+
+    def __call__(self, page):
+        if isinstance(page, str):
+            page = parse_page_lxml(page)
+        elems = [] if page is None else self._select(page)
+        if self._first_only:  # Like select_one(): only the first selected element counts, even if it has no link
+            elems = elems[:1]
+        urls = ('{0}{1}'.format(self._url_prefix, href) for elem in elems for href in _first_href(elem))
+        if self._first_only:
+            return next(urls, None)
+        return set(urls)
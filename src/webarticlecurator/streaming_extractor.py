@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from lxml.etree import HTMLParser, XMLSyntaxError
+
+from .charset_detection import META_CHARSET_RE, META_PRESCAN_SIZE
+
+
+class _LinkTarget:
+    """
+        The parser target of StreamingLinkExtractor: only the open matching containers are tracked (a stack as they
+         can be nested) and the href of the first link in each is collected, no tree is built
+    """
+    def __init__(self, tag, class_, first_only):
+        self._tag = tag
+        self._class = class_
+        self._first_only = first_only
+        self.done = False  # The first container has its link or it is closed without one (if first_only is True)
+        self._depth = 0
+        self._open_containers = []  # [depth, has_link] for the open matching containers (innermost last)
+        self.hrefs = []
+
+    def start(self, tag, attrib):
+        if self.done:
+            return
+        self._depth += 1
+        if (self._tag is None or tag == self._tag) and \
+                (self._class is None or self._class in attrib.get('class', '').split()):
+            self._open_containers.append([self._depth, False])
+        if tag == 'a' and len(self._open_containers) > 0:
+            has_new_link = False
+            for container in self._open_containers:
+                if not container[1]:  # The first link of the container (even if it has no href)
+                    container[1] = True
+                    has_new_link = True
+            if has_new_link and 'href' in attrib:
+                self.hrefs.append(attrib['href'])
+            self.done = self._first_only
+
+    def end(self, _):
+        if self.done:
+            return
+        if len(self._open_containers) > 0 and self._open_containers[-1][0] == self._depth:
+            self._open_containers.pop()
+            # Only the first (outermost) container counts, even if it has no link
+            self.done = self._first_only and len(self._open_containers) == 0
+        self._depth -= 1
+
+    def data(self, _):
+        pass
+
+    def close(self):
+        return self.hrefs
+
+
+def _utf8_charset(m):
+    """Replace the charset of the matched declaration (see META_CHARSET_RE) with UTF-8"""
+    return b''.join((m.string[m.start():m.start(1)], b'UTF-8'))
+
+
+class StreamingLinkExtractor:
+    """
+        Extract the links from the containers of an archive page in one pass without building a tree (neither
+         BeautifulSoup nor lxml) to be used in the portal specific functions (instead of BeautifulSoup.find_all()
+         and safe_extract_hrefs_from_a_tags() in the example extractor functions), eg.:
+            extract_links = StreamingLinkExtractor('h2', class_='post-lead')
+            def extract_article_urls_from_page_abcug(archive_page_raw_html):
+                return extract_links(archive_page_raw_html)
+        The containers are the elements with the tag name and/or the class (as BeautifulSoup.find_all(tag, class_=))
+         and the URL is the href of the first link in each of them (or of the container itself if it is a link)
+         prefixed with url_prefix. If first_only is True, the URL of the first container or None is returned,
+         the set of URLs otherwise.
+        The page is fed to lxml's HTML parser in chunks, so the memory needed does not depend on the page size
+    """
+    def __init__(self, tag=None, class_=None, url_prefix='', first_only=False, chunk_size=16384):
+        if tag is None and class_ is None:
+            raise ValueError('The tag or the class of the containers must be set!')
+        self._tag = tag
+        self._class = class_
+        self._url_prefix = url_prefix
+        self._first_only = first_only
+        self._chunk_size = chunk_size
+
+    def _chunks(self, raw_html):
+        """
+            Yield the page (str or UTF-8 bytes) in UTF-8 encoded chunks (only one chunk is encoded at a time).
+            The page is already decoded, but libxml2 switches to the charset declared in it (meta charset) when it
+             is fed in more chunks even if the encoding is set, so the declarations are rewritten to UTF-8 in the
+             beginning of the page where they can occur
+        """
+        prefix = raw_html[:META_PRESCAN_SIZE]
+        if isinstance(prefix, str):
+            prefix = prefix.encode('UTF-8')
+        prefix = META_CHARSET_RE.sub(_utf8_charset, prefix)
+        for start in range(0, len(prefix), self._chunk_size):
+            yield prefix[start:start + self._chunk_size]
+        for start in range(META_PRESCAN_SIZE, len(raw_html), self._chunk_size):
+            chunk = raw_html[start:start + self._chunk_size]
+            if isinstance(chunk, str):
+                chunk = chunk.encode('UTF-8')
+            yield chunk
+
+    def __call__(self, raw_html):
+        target = _LinkTarget(self._tag, self._class, self._first_only)
+        parser = HTMLParser(target=target, encoding='UTF-8')
+        try:
+            for chunk in self._chunks(raw_html):
+                parser.feed(chunk)
+                if target.done:  # The rest of the page is not needed (if first_only is True)
+                    break
+            hrefs = parser.close()
+        except XMLSyntaxError:  # Empty document
+            hrefs = target.hrefs
+        urls = ('{0}{1}'.format(self._url_prefix, href) for href in hrefs)
+        if self._first_only:
+            return next(urls, None)
+        return set(urls)
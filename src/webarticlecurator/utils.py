@@ -37,13 +37,14 @@ def import_python_file(module_name, file_path):
     return module
 
 
-def wrap_input_constants(current_task_config_filename):
+def wrap_input_constants(current_task_config_filename, extraction_workers=1):
     """
         Helper to store and process input data so that main function does not contain so many
          codelines of variable initialization
         Fields should be handled as constants after initialization
          CAPITALIZED KEYS are transformed runtime (e.g. Regular Expressions),
          lowercase keys are present in the config and will be used as is
+        If extraction_workers > 1 the portal specific functions run in a pool of processes (see ExtractionPool)
     """
     # Instructions to the current task
     settings = load_and_validate(crawl_schema, current_task_config_filename)
@@ -126,21 +127,34 @@ def wrap_input_constants(current_task_config_filename):
 
     settings['new_article_url_threshold'] = settings.get('new_article_url_threshold')
 
-    # Portal specific functions
-    file_path = settings['portal_specific_exctractor_functions_file']
-    module = import_python_file('portal_specific_exctractor_functions',
-                                os_path_join(settings['SITE_SCHEMA_DIR_NAME'], file_path))
-    for attr_name, attr_name_dest, mandatory in \
-            (('extract_next_page_url_fun', 'EXTRACT_NEXT_PAGE_URL_FUN', False),
-             ('extract_article_urls_from_page_fun', 'EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN', True),
-             ('extract_article_urls_from_page_plus_fun', 'EXTRACT_ARTICLE_URLS_FROM_PAGE_PLUS_FUN', False),
-             ('next_page_of_article_fun', 'NEXT_PAGE_OF_ARTICLE_FUN', False)):
+    # Portal specific functions (the file can be omitted if only selectors are used)
+    module = None
+    functions_file_path = None
+    pooled_functions = []  # Replaced by their PooledFunction at the end (see below)
+    if settings.get('portal_specific_exctractor_functions_file') is not None:
+        functions_file_path = os_path_join(settings['SITE_SCHEMA_DIR_NAME'],
+                                           settings['portal_specific_exctractor_functions_file'])
+        module = import_python_file('portal_specific_exctractor_functions', functions_file_path)
+    for attr_name, attr_name_dest, selector_name in \
+            (('extract_next_page_url_fun', 'EXTRACT_NEXT_PAGE_URL_FUN', 'next_page_selector'),
+             ('extract_article_urls_from_page_fun', 'EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN', 'article_url_selector'),
+             ('extract_article_urls_from_page_plus_fun', 'EXTRACT_ARTICLE_URLS_FROM_PAGE_PLUS_FUN', None),
+             ('next_page_of_article_fun', 'NEXT_PAGE_OF_ARTICLE_FUN', None)):
         settings[attr_name_dest] = getattr(module, settings.get(attr_name, ''), None)
-        if mandatory and settings[attr_name_dest] is None:
-            raise ValueError('{0} is unset!'.format(attr_name))
-        elif settings.get(attr_name, None) is not None and settings[attr_name_dest] is None:
+        if settings.get(attr_name, None) is not None and settings[attr_name_dest] is None:
             raise ValueError('Cannot find python function for {0} with value \'{1}\' !'.
                              format(attr_name, settings.get(attr_name, None)))
+        if settings[attr_name_dest] is not None:
+            pooled_functions.append((attr_name, attr_name_dest))
+        if selector_name is not None and selector_name in settings:
+            # The selectors are compiled only once here and they are fast enough without the ExtractionPool
+            if settings[attr_name_dest] is not None:
+                raise ValueError('{0} and {1} cannot be used at the same time!'.format(attr_name, selector_name))
+            from webarticlecurator.selector_extractor import SelectorExtractor
+            settings[attr_name_dest] = SelectorExtractor(settings[selector_name], settings.get('url_prefix', ''),
+                                                         first_only=selector_name == 'next_page_selector')
+    if settings['EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN'] is None:
+        raise ValueError('extract_article_urls_from_page_fun or article_url_selector is unset!')
 
     settings.setdefault('stop_on_empty_archive_page', False)
     if settings.setdefault('stop_on_taboo_set', False):
@@ -178,7 +192,25 @@ def wrap_input_constants(current_task_config_filename):
             raise ValueError('corpus_converter is {0}, but {1} is unset!'.format(corp_conv, file_path))
         module = import_python_file('corpus_converter', os_path_join(settings['SITE_SCHEMA_DIR_NAME'], file_path))
         corpus_converter_class = getattr(module, corp_conv)
-    settings['CORPUS_CONVERTER'] = corpus_converter_class(settings)
+
+    # The pool is started only after the settings are validated, so it is not left running on a ValueError
+    #  (the caller must close it, see ExtractionPool)
+    settings['EXTRACTION_POOL'] = None
+    if extraction_workers > 1 and len(pooled_functions) > 0:
+        from webarticlecurator.extraction_pool import ExtractionPool
+        extraction_pool = ExtractionPool('portal_specific_exctractor_functions', functions_file_path,
+                                         extraction_workers)
+        for attr_name, attr_name_dest in pooled_functions:
+            settings[attr_name_dest] = extraction_pool.function(settings[attr_name])
+        settings['EXTRACTION_POOL'] = extraction_pool
+
+    # The converter must be created after the pooled functions are set as it may store them (e.g. the next page fun.)
+    try:
+        settings['CORPUS_CONVERTER'] = corpus_converter_class(settings)
+    except ValueError as e:
+        if settings['EXTRACTION_POOL'] is not None:
+            settings['EXTRACTION_POOL'].close()
+        raise e
 
     return settings
 
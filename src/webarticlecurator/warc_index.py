@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# On-disk index formats for the WARC files created by this program
+
+import os
+import json
+from abc import abstractmethod
+from shutil import copyfileobj
+from heapq import merge as heapq_merge
+from tempfile import TemporaryFile
+from struct import Struct
+from hashlib import blake2b
+from mmap import mmap, ACCESS_READ
+from collections import Counter
+from collections.abc import Mapping
+from urllib.parse import urlsplit
+
+from warcio.timeutils import iso_date_to_timestamp
+from warcio.archiveiterator import ArchiveIterator
+
+default_ports = {'http': '80', 'https': '443'}
+
+hashed_index_magic = b'WACIDX\x00\x01'
+header_len_struct = Struct('<I')
+# URL hash, URL offset (in the URL area), URL length, request offset, request length, response offset, response length
+hashed_index_entry_struct = Struct('<QQIQIQI')
+# As hashed_index_entry_struct extended with the number of the source index (see MergedUrlIndex)
+merged_index_entry_struct = Struct('<QQIQIQII')
+# URL hash, negated insertion number, URL length, request offset, request length, response offset, response length
+#  followed by the URL (see HashedIndexWriter)
+sort_run_entry_struct = Struct('<QqIQIQI')
+# Request offset, request length, response offset, response length, URL length followed by the URL
+#  (see append_record_offsets())
+record_offsets_entry_struct = Struct('<QIQII')
+
+
+def surt(url):
+    """
+        Sort-friendly URI Reordering Transform (SURT) as used by CDX(J) indices (e.g. pywb, OpenWayback)
+         http://www.example.com:80/Path?b=2&a=1 -> com,example)/path?a=1&b=2
+        The transformation is lossy (lowercasing, dropping www. and default ports, sorting query arguments),
+         so the original URL must be stored alongside and checked on lookup
+    """
+    scheme, netloc, path, query, _ = urlsplit(url.strip())
+    scheme = scheme.lower()
+    host = netloc.rpartition('@')[2].lower()  # Drop userinfo
+    host, _, port = host.partition(':')
+    if port == default_ports.get(scheme):
+        port = ''
+    host_parts = host.strip('.').split('.')
+    if len(host_parts) > 1 and host_parts[0] == 'www':
+        host_parts = host_parts[1:]
+    key = ','.join(reversed(host_parts))
+    if len(port) > 0:
+        key = '{0}:{1}'.format(key, port)
+    if len(path) == 0:
+        path = '/'
+    key = '{0}){1}'.format(key, path.lower())
+    if len(query) > 0:
+        key = '{0}?{1}'.format(key, '&'.join(sorted(query.lower().split('&'))))
+    return key.replace(' ', '%20')  # Space is the field separator in CDXJ files
+
+
+def write_cdxj_index(warc_filename, cdxj_filename, _logger):
+    """
+        Create a SURT-sorted CDXJ index of the request-response pairs of a WARC file (created by this program)
+         One line for every response record: SURT TIMESTAMP {JSON} where the JSON block contains the standard fields
+         (url, mime, status, digest, length, offset, filename) extended with the position of the corresponding
+         request record (req_length, req_offset)
+    """
+    _logger.log('INFO', 'Creating CDXJ index for {0}...'.format(warc_filename))
+    lines = []
+    run_fhs = []  # The lines are sorted in runs spilled into temporary files and merged at the end (external sort)
+    count = 0
+    with open(warc_filename, 'rb') as stream:
+        archive_it = ArchiveIterator(stream)
+        reqv_data = (None, (None, None))  # To be able to handle the request-response pairs together
+        for record in archive_it:
+            if record.rec_type == 'request':
+                reqv_data = (record.rec_headers.get_header('WARC-Target-URI'),
+                             (archive_it.get_record_offset(), archive_it.get_record_length()))
+            elif record.rec_type == 'response':
+                url = record.rec_headers.get_header('WARC-Target-URI')
+                if url != reqv_data[0]:
+                    _logger.log('ERROR', 'RESPONSE without REQUEST:', url, 'ignoring it!', sep='\t')
+                    continue
+                offset, length = archive_it.get_record_offset(), archive_it.get_record_length()
+                mime = record.http_headers.get_header('Content-Type', '-').split(';', maxsplit=1)[0].strip()
+                fields = {'url': url, 'mime': mime, 'status': record.http_headers.get_statuscode(),
+                          'digest': record.rec_headers.get_header('WARC-Payload-Digest', '-').replace('sha1:', ''),
+                          'length': str(length), 'offset': str(offset),
+                          'req_length': str(reqv_data[1][1]), 'req_offset': str(reqv_data[1][0]),
+                          'filename': os.path.basename(warc_filename)}
+                timestamp = iso_date_to_timestamp(record.rec_headers.get_header('WARC-Date'))
+                lines.append('{0} {1} {2}\n'.format(surt(url), timestamp, json.dumps(fields, ensure_ascii=False))
+                             .encode('UTF-8'))
+                count += 1
+                if len(lines) >= HashedIndexWriter.run_size:
+                    run_fhs.append(_spill_sorted_lines(lines))
+                    lines = []
+    lines.sort()  # Bytewise sort (LC_ALL=C)
+
+    tmp_filename = '{0}.tmp{1}'.format(cdxj_filename, os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as fh:
+            for run_fh in run_fhs:
+                run_fh.seek(0)
+            fh.writelines(heapq_merge(lines, *run_fhs))
+        os.replace(tmp_filename, cdxj_filename)
+    finally:
+        for run_fh in run_fhs:
+            run_fh.close()
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    _logger.log('INFO', 'CDXJ index written to {0} ({1} URLs).'.format(cdxj_filename, count))
+    return count
+
+
+def _spill_sorted_lines(lines):
+    """Sort the lines and write them into an anonymous temporary file (a run of the external sort)"""
+    lines.sort()
+    run_fh = TemporaryFile()
+    run_fh.writelines(lines)
+    return run_fh
+
+
+class CDXJIndex(Mapping):
+    """
+        Read-only URL -> ((request offset, request length), (response offset, response length)) mapping
+         backed by a memory-mapped SURT-sorted CDXJ file created by write_cdxj_index()
+        Lookups are binary searches over the file, so no per-URL Python objects are held in memory
+    """
+    def __init__(self, cdxj_filename):
+        self.filename = cdxj_filename
+        self._fh = open(cdxj_filename, 'rb')
+        if os.fstat(self._fh.fileno()).st_size > 0:
+            self._mm = mmap(self._fh.fileno(), 0, access=ACCESS_READ)
+        else:
+            self._mm = b''  # Empty files can not be mmap'd
+        self._len = None
+
+    def __del__(self):
+        if hasattr(self, '_mm') and not isinstance(self._mm, bytes):
+            self._mm.close()
+        if hasattr(self, '_fh'):
+            self._fh.close()
+
+    def _lines_from(self, start):
+        mm = self._mm
+        size = len(mm)
+        while start < size:
+            end = mm.find(b'\n', start)
+            if end == -1:
+                end = size
+            yield mm[start:end]
+            start = end + 1
+
+    def _bisect_left(self, key):
+        """Return the position of the first line whose SURT key is not less than key (lo and hi are line starts)"""
+        mm = self._mm
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            nl = mm.rfind(b'\n', lo, mid)
+            start = lo if nl == -1 else nl + 1
+            end = mm.find(b'\n', start)
+            if end == -1:
+                end = len(mm)
+            if mm[start:end].split(b' ', maxsplit=1)[0] < key:
+                lo = end + 1
+            else:
+                hi = start
+        return lo
+
+    @staticmethod
+    def _parse_line(line):
+        return json.loads(line.split(b' ', maxsplit=2)[2])
+
+    def _find(self, url):
+        if not isinstance(url, str):  # Like dict lookups: other keys (eg. None) are simply not found
+            return None
+        key = surt(url).encode('UTF-8')
+        for line in self._lines_from(self._bisect_left(key)):
+            if line.split(b' ', maxsplit=1)[0] != key:
+                break
+            fields = self._parse_line(line)
+            if fields['url'] == url:  # SURT is lossy, check the original URL
+                return fields
+        return None
+
+    def __getitem__(self, url):
+        fields = self._find(url)
+        if fields is None:
+            raise KeyError(url)
+        return ((int(fields['req_offset']), int(fields['req_length'])),
+                (int(fields['offset']), int(fields['length'])))
+
+    def __contains__(self, url):
+        return self._find(url) is not None
+
+    def __iter__(self):
+        for line in self._lines_from(0):
+            yield self._parse_line(line)['url']
+
+    def __len__(self):
+        if self._len is None:
+            self._len = sum(1 for _ in self._lines_from(0))
+        return self._len
+
+
+def url_hash(url_bytes):
+    return int.from_bytes(blake2b(url_bytes, digest_size=8).digest(), 'little')
+
+
+def write_hashed_index(filename, url_index, header):
+    """
+        Write a URL -> ((request offset, request length), (response offset, response length)) mapping to a binary file:
+         magic, header length, JSON header (extended with the number of entries),
+         fixed-width entries sorted by the 64-bit hash of the URL (see hashed_index_entry_struct)
+         and the UTF-8 encoded URLs concatenated (the entries point into this area)
+        The entries are streamed in sorted order (see hashed_items()), so the index is not held in memory
+        The file is written to a temporary name first and moved to its place (readers never see partial files)
+    """
+    tmp_filename = '{0}.tmp{1}'.format(filename, os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as fh:
+            _write_table(fh, header, hashed_index_entry_struct, _hashed_rows(hashed_items(url_index)))
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def _hashed_rows(items):
+    for h, url_bytes, ((reqv_offset, reqv_length), (resp_offset, resp_length)) in items:
+        yield h, url_bytes, (reqv_offset, reqv_length, resp_offset, resp_length)
+
+
+def read_hashed_index_header(fh):
+    """Read the JSON header of a hashed index file (without reading the entries) and return it with its end offset"""
+    if fh.read(len(hashed_index_magic)) != hashed_index_magic:
+        raise ValueError('Not a hashed index file or unknown version!')
+    header_len, = header_len_struct.unpack(fh.read(header_len_struct.size))
+    header = json.loads(fh.read(header_len).decode('UTF-8'))
+    return header, len(hashed_index_magic) + header_len_struct.size + header_len
+
+
+class _SortedHashTable(Mapping):
+    """
+        Common lookup logic of the memory-mapped URL indices: fixed-width entries sorted by (URL hash, URL)
+         starting with the hash, the offset and the length of the URL in the URL area
+        The subclasses define the layout of the rest of the entry (entry_struct) and the value made of it (_value())
+        Lookups are binary searches on the entries (collisions are resolved by comparing the stored URL),
+         so no per-URL Python objects are held in memory
+    """
+    entry_struct = hashed_index_entry_struct
+
+    def __init__(self, entries_buf, entries_start, count, urls_buf, urls_start):
+        self._entries_buf = entries_buf
+        self._entries_start = entries_start
+        self._count = count
+        self._urls_buf = urls_buf
+        self._urls_start = urls_start
+
+    def _entry(self, i):
+        return self.entry_struct.unpack_from(self._entries_buf, self._entries_start + i * self.entry_struct.size)
+
+    def _hash_at(self, i):
+        entry_start = self._entries_start + i * self.entry_struct.size
+        return int.from_bytes(self._entries_buf[entry_start:entry_start + 8], 'little')
+
+    def _url_bytes(self, entry):
+        url_start = self._urls_start + entry[1]
+        return self._urls_buf[url_start:url_start + entry[2]]
+
+    def _find(self, url):
+        if not isinstance(url, str):  # Like dict lookups: other keys (eg. None) are simply not found
+            return None
+        url_bytes = url.encode('UTF-8')
+        h = url_hash(url_bytes)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._hash_at(mid) < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self._count and self._hash_at(lo) == h:
+            entry = self._entry(lo)
+            if self._url_bytes(entry) == url_bytes:  # Resolve hash collisions
+                return entry
+            lo += 1
+        return None
+
+    @staticmethod
+    @abstractmethod
+    def _value(entry):
+        """The value of the mapping from the unpacked entry"""
+
+    def __getitem__(self, url):
+        entry = self._find(url)
+        if entry is None:
+            raise KeyError(url)
+        return self._value(entry)
+
+    def __contains__(self, url):
+        return self._find(url) is not None
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._url_bytes(self._entry(i)).decode('UTF-8')
+
+    def __len__(self):
+        return self._count
+
+    def iter_hashed_items(self):
+        """Iterate (URL hash, URL bytes, value) triplets in the sort order of the entries"""
+        for i in range(self._count):
+            entry = self._entry(i)
+            yield entry[0], self._url_bytes(entry), self._value(entry)
+
+
+class HashedUrlIndex(_SortedHashTable):
+    """
+        Read-only URL -> ((request offset, request length), (response offset, response length)) mapping
+         backed by a memory-mapped file created by write_hashed_index() or HashedIndexWriter
+         which is opened by its name or supplied as an open binary file (eg. an anonymous temporary file)
+    """
+    def __init__(self, filename=None, fh=None):
+        self.filename = filename
+        if fh is None:
+            fh = open(filename, 'rb')
+        self._fh = fh
+        self._fh.seek(0)
+        self.header, entries_start = read_hashed_index_header(self._fh)
+        count = self.header['count']
+        self._mm = mmap(self._fh.fileno(), 0, access=ACCESS_READ)
+        super().__init__(self._mm, entries_start, count, self._mm, entries_start + count * self.entry_struct.size)
+
+    def __del__(self):
+        if hasattr(self, '_mm'):
+            self._mm.close()
+        if hasattr(self, '_fh'):
+            self._fh.close()
+
+    @staticmethod
+    def _value(entry):
+        return (entry[3], entry[4]), (entry[5], entry[6])
+
+
+class HashedIndexWriter:
+    """
+        Collect URL -> ((request offset, request length), (response offset, response length)) pairs in any order
+         and write them as a hashed index (see write_hashed_index()) with bounded memory (external sort):
+         every run_size pairs are sorted and spilled into an anonymous temporary file (a run)
+         and the runs are merged (heapq.merge) into the index at the end
+        The URLs added more than once are counted in double_urls and the last value wins (like in a dict)
+    """
+    run_size = 100000
+
+    def __init__(self):
+        self._run = []
+        self._run_fhs = []
+        self._added = 0
+        self.double_urls = Counter()
+
+    def __del__(self):
+        for run_fh in getattr(self, '_run_fhs', ()):
+            run_fh.close()
+
+    def add(self, url, value):
+        url_bytes = url.encode('UTF-8')
+        self._run.append((url_hash(url_bytes), url_bytes, -self._added, value))  # Later values come first
+        self._added += 1
+        if len(self._run) >= self.run_size:
+            self._spill()
+
+    def _spill(self):
+        self._run.sort()
+        run_fh = TemporaryFile()
+        for h, url_bytes, neg_added, ((reqv_offset, reqv_length), (resp_offset, resp_length)) in self._run:
+            run_fh.write(sort_run_entry_struct.pack(h, neg_added, len(url_bytes), reqv_offset, reqv_length,
+                                                    resp_offset, resp_length))
+            run_fh.write(url_bytes)
+        self._run_fhs.append(run_fh)
+        self._run = []
+
+    @staticmethod
+    def _read_run(run_fh):
+        run_fh.seek(0)
+        while True:
+            entry_bytes = run_fh.read(sort_run_entry_struct.size)
+            if len(entry_bytes) == 0:
+                break
+            h, neg_added, url_len, reqv_offset, reqv_length, resp_offset, resp_length = \
+                sort_run_entry_struct.unpack(entry_bytes)
+            yield h, run_fh.read(url_len), neg_added, ((reqv_offset, reqv_length), (resp_offset, resp_length))
+
+    def sorted_items(self):
+        """Iterate the (URL hash, URL bytes, value) triplets sorted by URL hash and URL (can be called only once)"""
+        self._run.sort()
+        runs = [self._read_run(run_fh) for run_fh in self._run_fhs]
+        runs.append(iter(self._run))
+        prev_key = None
+        for h, url_bytes, _, value in heapq_merge(*runs):
+            if (h, url_bytes) != prev_key:
+                prev_key = (h, url_bytes)
+                yield h, url_bytes, value
+            else:  # The same URL again: the last value is already yielded
+                url = url_bytes.decode('UTF-8')
+                self.double_urls[url] = self.double_urls.get(url, 1) + 1
+
+    def write(self, fh, header):
+        """Write the index to the open binary file (see write_hashed_index())"""
+        _write_table(fh, header, hashed_index_entry_struct, _hashed_rows(self.sorted_items()))
+
+
+def append_record_offsets(fh, url, value):
+    """
+        Append a URL -> ((request offset, request length), (response offset, response length)) pair
+         to an open binary file (a record offsets log) as the records are written, the log is turned into
+         a hashed index without reading the WARC file (see read_record_offsets() and HashedIndexWriter)
+    """
+    url_bytes = url.encode('UTF-8')
+    (reqv_offset, reqv_length), (resp_offset, resp_length) = value
+    fh.write(record_offsets_entry_struct.pack(reqv_offset, reqv_length, resp_offset, resp_length, len(url_bytes)))
+    fh.write(url_bytes)
+
+
+def read_record_offsets(fh):
+    """Iterate the (URL, value) pairs of a record offsets log (see append_record_offsets()) in the order of writing"""
+    while True:
+        entry_bytes = fh.read(record_offsets_entry_struct.size)
+        if len(entry_bytes) == 0:
+            break
+        reqv_offset, reqv_length, resp_offset, resp_length, url_len = record_offsets_entry_struct.unpack(entry_bytes)
+        yield fh.read(url_len).decode('UTF-8'), ((reqv_offset, reqv_length), (resp_offset, resp_length))
+
+
+def hashed_items(url_index):
+    """
+        Iterate the (URL hash, URL bytes, value) triplets of any URL index mapping
+         (or the pairs collected by a HashedIndexWriter) sorted by URL hash and URL
+    """
+    if isinstance(url_index, _SortedHashTable):  # Already sorted on disk
+        return url_index.iter_hashed_items()
+    if isinstance(url_index, HashedIndexWriter):  # Sorted with bounded memory
+        return url_index.sorted_items()
+    # In-memory or CDXJ indices must be sorted here
+    writer = HashedIndexWriter()
+    for url, value in url_index.items():
+        writer.add(url, value)
+    return writer.sorted_items()
+
+
+def _tag_with_source(src, url_index):
+    for h, url_bytes, value in hashed_items(url_index):
+        yield h, url_bytes, -src, value  # The last source comes first among the equal URLs
+
+
+def _write_table(fh, header, entry_struct, rows):
+    """
+        Write (URL hash, URL bytes, value fields) rows (sorted by URL hash and URL) to the open binary file
+         in the layout of write_hashed_index() where the entries consist of the hash, the offset and the length
+         of the URL followed by the value fields (see entry_struct)
+        The entries and the URLs are spooled into temporary files as the number of rows is only known at the end
+    """
+    with TemporaryFile() as entries_fh, TemporaryFile() as urls_fh:
+        count, url_offset = 0, 0
+        for h, url_bytes, fields in rows:
+            entries_fh.write(entry_struct.pack(h, url_offset, len(url_bytes), *fields))
+            urls_fh.write(url_bytes)
+            url_offset += len(url_bytes)
+            count += 1
+        header_bytes = json.dumps(dict(header, count=count), ensure_ascii=False).encode('UTF-8')
+        fh.write(hashed_index_magic)
+        fh.write(header_len_struct.pack(len(header_bytes)))
+        fh.write(header_bytes)
+        for spool_fh in (entries_fh, urls_fh):
+            spool_fh.seek(0)
+            copyfileobj(spool_fh, fh)
+
+
+class MergedUrlIndex(_SortedHashTable):
+    """
+        Read-only URL -> (source number, (request offset, request length), (response offset, response length))
+         mapping for more URL indices (sources) where the last source containing the URL wins
+        The hash-sorted sources are merged once into a file of the same layout as write_hashed_index() with the number
+         of the source in every entry, so a lookup is a single binary search and iterating does not touch the sources.
+         The file is stored as cache_filename (if given) and reused while its header (which should identify the state
+         of the sources) does not change, else (or when it can not be written) it is an anonymous temporary file
+    """
+    entry_struct = merged_index_entry_struct
+
+    def __init__(self, url_indices, cache_filename=None, header=None):
+        header = dict(header or {}, sources=len(url_indices))
+        self.filename = None
+        self.from_cache = False
+        self._fh = None
+        if cache_filename is not None:
+            self._fh = self._open_cached(cache_filename, header)
+            self.from_cache = self._fh is not None
+            if self._fh is None:
+                self._fh = self._write_cached(url_indices, cache_filename, header)
+            if self._fh is not None:
+                self.filename = cache_filename
+        if self._fh is None:
+            self._fh = TemporaryFile()
+            _write_table(self._fh, header, self.entry_struct, self._merge(url_indices))
+            self._fh.seek(0)
+
+        self.header, entries_start = read_hashed_index_header(self._fh)
+        count = self.header['count']
+        self._mm = mmap(self._fh.fileno(), 0, access=ACCESS_READ)
+        super().__init__(self._mm, entries_start, count, self._mm, entries_start + count * self.entry_struct.size)
+
+    def __del__(self):
+        if hasattr(self, '_mm'):
+            self._mm.close()
+        if getattr(self, '_fh', None) is not None:
+            self._fh.close()
+
+    @staticmethod
+    def _open_cached(cache_filename, header):
+        """Open the cached merged index if it exists and belongs to the same sources (else return None)"""
+        try:
+            fh = open(cache_filename, 'rb')
+        except OSError:
+            return None
+        try:
+            cached_header, _ = read_hashed_index_header(fh)
+        except (OSError, ValueError):
+            cached_header = None
+        if cached_header is None or dict(cached_header, count=None) != dict(header, count=None):
+            fh.close()
+            return None
+        fh.seek(0)
+        return fh
+
+    def _write_cached(self, url_indices, cache_filename, header):
+        """Write the merged index to cache_filename and open it (return None if the file can not be written)"""
+        tmp_filename = '{0}.tmp{1}'.format(cache_filename, os.getpid())
+        try:
+            with open(tmp_filename, 'wb') as fh:
+                _write_table(fh, header, self.entry_struct, self._merge(url_indices))
+            os.replace(tmp_filename, cache_filename)
+            return open(cache_filename, 'rb')
+        except OSError:  # E.g. read-only directory: an anonymous temporary file is used instead
+            return None
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    @staticmethod
+    def _merge(url_indices):
+        """
+            Merge the hash-sorted sources into (URL hash, URL bytes, value fields) rows where the last source wins:
+             the equal URLs are adjacent in the merged stream and the first one is kept (see _tag_with_source())
+        """
+        merged = heapq_merge(*(_tag_with_source(src, url_index) for src, url_index in enumerate(url_indices)))
+        prev_key = None
+        for h, url_bytes, neg_src, ((reqv_offset, reqv_length), (resp_offset, resp_length)) in merged:
+            if (h, url_bytes) != prev_key:
+                prev_key = (h, url_bytes)
+                yield h, url_bytes, (reqv_offset, reqv_length, resp_offset, resp_length, -neg_src)
+
+    @staticmethod
+    def _value(entry):
+        return entry[7], (entry[3], entry[4]), (entry[5], entry[6])
+
+
+class SingleSourceUrlIndex(Mapping):
+    """
+        The MergedUrlIndex mapping for a single URL index (source number 0) which is used as it is:
+         there is nothing to merge, so nothing is copied
+    """
+    def __init__(self, url_index):
+        self._url_index = url_index
+
+    def __getitem__(self, url):
+        reqv, resp = self._url_index[url]
+        return 0, reqv, resp
+
+    def __contains__(self, url):
+        return url in self._url_index
+
+    def __iter__(self):
+        return iter(self._url_index)
+
+    def __len__(self):
+        return len(self._url_index)
+
+
+def merge_url_indices(url_indices, cache_filename=None, header=None):
+    """Return the MergedUrlIndex of the URL indices (see there) without merging anything if there is only one"""
+    if len(url_indices) > 1:
+        return MergedUrlIndex(url_indices, cache_filename, header)
+    return SingleSourceUrlIndex(url_indices[0] if len(url_indices) > 0 else {})
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import json
+from io import BytesIO
+from time import sleep
+from itertools import chain
+from threading import Thread, Lock
+from collections import Counter
+from tempfile import TemporaryDirectory
+from os.path import abspath, dirname, join as os_path_join
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from warcio.archiveiterator import ArchiveIterator
+
+from webarticlecurator import Logger, WarcReader, WarcCachingDownloader, Checkpoint, NewsArticleCrawler, \
+    wrap_input_constants
+from webarticlecurator.utils import DummyConverter
+from webarticlecurator.warc_index import read_record_offsets
+
+# Two columns with three archive pages (linked by the next page link) with two articles on each page
+#  and each article links to two extra articles (followed by the converter)
+#  and a column with the same pages for each day (see DATE_SITE_SCHEMA)
+COLUMNS = ('first', 'second')
+DATE_COLUMN = 'daily'
+DAYS = 31
+NO_OF_ARCHIVE_PAGES = 3
+ARCHIVE_PAGE = '<html><body>{0}{1}</body></html>'
+ARTICLE_LINK = '<h2><a href="{0}/article/{1}-{2}-{3}">article</a></h2>'
+NEXT_PAGE_LINK = '<a class="next" href="{0}">next</a>'
+EXTRACTOR_FUNCTIONS = """
+import re
+
+
+def extract_article_urls_from_page_test(archive_page_raw_html):
+    return set(re.findall('<h2><a href="([^"]+)"', archive_page_raw_html))
+
+
+def extract_next_page_url_test(archive_page_raw_html):
+    m = re.search('<a class="next" href="([^"]+)"', archive_page_raw_html)
+    if m is not None:
+        return m.group(1)
+    return None
+"""
+SITE_SCHEMA = """
+"site_name": "test"
+"columns":
+    "first":
+        "archive_url_format": "{0}/first/page/#pagenum"
+        "initial_pagenum": 1
+    "second":
+        "archive_url_format": "{0}/second/page/#pagenum"
+        "initial_pagenum": 1
+"portal_specific_exctractor_functions_file": "extractors.py"
+"extract_next_page_url_fun": "extract_next_page_url_test"
+"extract_article_urls_from_page_fun": "extract_article_urls_from_page_test"
+"next_url_by_pagenum": false
+"infinite_scrolling": false
+"archive_page_urls_by_date": false
+"go_reverse_in_archive": false
+"verify_request": true
+"ignore_archive_cache": false
+"corpus_converter_file": "corpus_converters.py"
+"corpus_converter": "dummy-converter"
+"""
+DATE_SITE_SCHEMA = """
+"site_name": "test"
+"columns":
+    "daily":
+        "archive_url_format": "{0}/daily/#year-#month-#day/page/#pagenum"
+        "initial_pagenum": 1
+        "date_first_article": 2020-01-01
+        "date_last_article": 2020-01-31
+"portal_specific_exctractor_functions_file": "extractors.py"
+"extract_next_page_url_fun": "extract_next_page_url_test"
+"extract_article_urls_from_page_fun": "extract_article_urls_from_page_test"
+"next_url_by_pagenum": false
+"infinite_scrolling": false
+"archive_page_urls_by_date": true
+"go_reverse_in_archive": false
+"verify_request": true
+"ignore_archive_cache": false
+"corpus_converter_file": "corpus_converters.py"
+"corpus_converter": "dummy-converter"
+"""
+CRAWL_CONFIG = """
+"schema": "test_schema.yaml"
+"log_file_articles": "{0}"
+"log_file_archive": "{1}"
+"""
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    """The archive pages and the articles of the test site (the requested paths are counted)"""
+    requests = Counter()
+    requests_lock = Lock()
+
+    def do_GET(self):
+        with self.requests_lock:
+            self.requests[self.path] += 1
+        parts = self.path.strip('/').split('/')
+        if (len(parts) == 3 and parts[0] in COLUMNS or len(parts) == 4 and parts[0] == DATE_COLUMN) and \
+                parts[-2] == 'page' and 1 <= int(parts[-1]) <= NO_OF_ARCHIVE_PAGES:
+            base_url, column, page_num = 'http://{0}'.format(self.headers['Host']), '/'.join(parts[:-2]), \
+                int(parts[-1])
+            next_page = ''
+            if page_num < NO_OF_ARCHIVE_PAGES:
+                next_page = NEXT_PAGE_LINK.format('{0}/{1}/page/{2}'.format(base_url, column, page_num + 1))
+            body = ARCHIVE_PAGE.format(''.join(ARTICLE_LINK.format(base_url, column.replace('/', '-'), page_num, i)
+                                               for i in range(2)), next_page)
+        elif len(parts) == 2 and parts[0] in {'article', 'extra'}:
+            body = '<html><body><p>{0}</p></body></html>'.format(self.path)
+        else:
+            self.send_error(404)
+            return
+        body = body.encode('UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+class DyingConverter(DummyConverter):
+    """Follow the two extra articles of each article and die (like on Ctrl+C) at the die_at-th processed article"""
+    def __init__(self, settings, base_url, die_at=None):
+        super().__init__(settings)
+        self._base_url = base_url
+        self._die_at = die_at
+        self.processed = []
+
+    def article_to_corpus(self, url, article_raw_html, scheme):
+        self.processed.append(url)
+        if len(self.processed) == self._die_at:
+            raise KeyboardInterrupt
+
+    def follow_links_on_page(self, url, article_raw_html, scheme):
+        if '/article/' not in url:
+            return set()
+        return {url.replace('/article/', '/extra/') + '-{0}'.format(i) for i in range(2)}
+
+
+class CheckedCheckpoint(Checkpoint):
+    """
+        Check after each save that every URL logged as done (until the saved size of the log) is written
+         before the saved size of the WARC files: in the record offsets log until its saved size
+         (it covers the same records, reading the WARC files at each save would be too slow)
+    """
+    done_keys = {'archive': 'good_urls', 'articles': 'processed_urls'}
+
+    def save(self):
+        super().save()
+        with open(self.filename, encoding='UTF-8') as fh:
+            state = json.load(fh)
+        with open('{0}.log'.format(self.filename), 'rb') as fh:
+            logged = [json.loads(line) for line in fh.read(state['log_size']).splitlines()]
+        for part, key in self.done_keys.items():
+            part_state = state.get(part, {})
+            written_urls = set()
+            for filename in part_state.get('sources', []):  # Truncated when resuming
+                with open('{0}.offsets'.format(filename), 'rb') as fh:
+                    written_urls.update(url for url, _ in read_record_offsets(fh))
+            if part_state.get('warc') is not None:
+                with open('{0}.offsets'.format(part_state['warc']['filename']), 'rb') as fh:
+                    offsets = BytesIO(fh.read(part_state['warc']['record_offsets_size']))
+                written_urls.update(url for url, _ in read_record_offsets(offsets))
+            for logged_part, logged_key, url in logged:
+                assert logged_part != part or logged_key != key or url in written_urls, \
+                    'Logged as done, but not written before the checkpoint: {0}'.format(url)
+
+
+def read_urls(filename):
+    with open(filename, 'rb') as stream:
+        return [record.rec_headers.get_header('WARC-Target-URI') for record in ArchiveIterator(stream)
+                if record.rec_type == 'response']
+
+
+def write_test_site(tmp_dir, site_schema, base_url):
+    """Write the extractor functions, the site schema and the crawl config of the test site and return the config"""
+    with open(os_path_join(tmp_dir, 'extractors.py'), 'w', encoding='UTF-8') as fh:
+        fh.write(EXTRACTOR_FUNCTIONS)
+    with open(os_path_join(tmp_dir, 'test_schema.yaml'), 'w', encoding='UTF-8') as fh:
+        fh.write(site_schema.format(base_url))
+    config_filename = os_path_join(tmp_dir, 'test_config.yaml')
+    with open(config_filename, 'w', encoding='UTF-8') as fh:
+        fh.write(CRAWL_CONFIG.format(os_path_join(tmp_dir, 'articles.log'), os_path_join(tmp_dir, 'archive.log')))
+    return config_filename
+
+
+def checkpoint_resume_test(filename, test_logger):
+    """
+        The state saved at the checkpoint must be restored after the crawl died: the elements logged
+         and the WARC records written after the checkpoint are dropped, the rest is used as a source WARC file
+         with the index sidecar made of the record offsets logged while writing it (without scanning it)
+    """
+    urls = read_urls(filename)
+    k = len(urls) // 2
+    with TemporaryDirectory() as tmp_dir:
+        checkpoint_filename = os_path_join(tmp_dir, 'crawl.checkpoint')
+        new_warc_filename = os_path_join(tmp_dir, 'articles.warc.gz')
+
+        test_logger.log('INFO', 'Testing the checkpoint (crawling until it dies)')
+        checkpoint = Checkpoint(checkpoint_filename, interval=3600)
+        w = WarcCachingDownloader(filename, new_warc_filename, test_logger,
+                                  download_params={'stay_offline': True, 'track_record_offsets': True})
+        checkpoint.register('articles', lambda: {'warc': w.checkpoint(), 'pending_urls': urls[k:]})
+        for i, url in enumerate(urls):
+            assert w.download_url(url) is not None  # The records are copied from the source WARC file
+            checkpoint.log('articles', 'processed_urls', url)
+            if i == k - 1:
+                checkpoint.save()
+                checkpoint.save_if_due()  # Not due yet
+        del w, checkpoint
+        with open('{0}.log'.format(checkpoint_filename), 'ab') as fh:  # Died while logging
+            fh.write(b'["articles", "processed_urls", "http')
+        with open(new_warc_filename, 'ab') as fh:  # Died while writing a record
+            fh.write(b'\x1f\x8b\x08\x00')
+        with open('{0}.offsets'.format(new_warc_filename), 'ab') as fh:  # Died while logging the offsets
+            fh.write(b'\x00\x01')
+
+        test_logger.log('INFO', 'Testing the checkpoint (resuming)')
+        checkpoint = Checkpoint(checkpoint_filename, resume=True)
+        articles_state = checkpoint.get('articles')
+        assert articles_state['processed_urls'] == urls[:k]
+        assert articles_state['pending_urls'] == urls[k:]
+        assert articles_state['warc']['urls'] == k
+        assert checkpoint.get('archive') == {}
+        resumed_filenames = checkpoint.resume_warc_files('articles', test_logger)
+        assert resumed_filenames == [new_warc_filename]
+        assert os.path.getsize(new_warc_filename) == articles_state['warc']['size']
+        assert read_urls(new_warc_filename) == urls[:k]
+
+        source = WarcReader(filename, test_logger)
+        resumed = WarcReader(new_warc_filename, test_logger)
+        # The index is loaded from the sidecar written at resuming (a scanned index would be a temporary file)
+        assert resumed.url_index_offsets.filename == '{0}.idx'.format(new_warc_filename)
+        assert sorted(resumed.url_index) == sorted(urls[:k])
+        for url in urls[:k]:
+            assert resumed.download_url(url) == source.download_url(url)
+        del source, resumed
+
+        test_logger.log('INFO', 'Testing the checkpoint (logging after resuming)')
+        checkpoint.log('articles', 'processed_urls', urls[k])
+        checkpoint.register('articles', lambda: {'pending_urls': urls[k + 1:]})
+        checkpoint.save()
+        del checkpoint
+        checkpoint = Checkpoint(checkpoint_filename, resume=True)
+        assert checkpoint.get('articles') == {'processed_urls': urls[:k + 1], 'pending_urls': urls[k + 1:]}
+        del checkpoint
+
+        test_logger.log('INFO', 'Testing the checkpoint (not overwritten without resuming)')
+        log_size = os.path.getsize('{0}.log'.format(checkpoint_filename))
+        try:
+            Checkpoint(checkpoint_filename)
+            assert False, 'The existing checkpoint must not be overwritten!'
+        except FileExistsError:
+            pass
+        assert os.path.getsize('{0}.log'.format(checkpoint_filename)) == log_size
+        checkpoint = Checkpoint(checkpoint_filename, overwrite=True)
+        assert checkpoint.get('articles') == {} and os.path.getsize('{0}.log'.format(checkpoint_filename)) == 0
+        del checkpoint
+    test_logger.log('INFO', 'Test OK!')
+
+
+def crawler_resume_test(test_logger):
+    """
+        The crawl (NewsArticleCrawler with NewsArchiveCrawler) resumed from the checkpoint saved when it died
+         must continue where it stopped: the finished columns are skipped, the current column continues with the
+         article URLs left on its archive page and the next page, the pending URLs are downloaded, nothing is
+         downloaded twice and the new WARC files are written next to the WARC files of the died crawl
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    try:
+        with TemporaryDirectory() as tmp_dir:
+            config_filename = write_test_site(tmp_dir, SITE_SCHEMA, base_url)
+            checkpoint_filename = os_path_join(tmp_dir, 'crawl.checkpoint')
+            warc_filenames = {part: os_path_join(tmp_dir, '{0}.warc.gz'.format(part))
+                              for part in ('archive', 'articles')}
+            download_params = {'max_no_of_calls_in_period': 1000}
+
+            def create_crawler(resume, die_at=None):
+                settings = wrap_input_constants(config_filename)
+                converter = DyingConverter(settings, base_url, die_at)
+                settings['CORPUS_CONVERTER'] = converter
+                checkpoint = Checkpoint(checkpoint_filename, interval=3600, resume=resume)
+                crawler = NewsArticleCrawler(settings, None, warc_filenames['articles'], None,
+                                             warc_filenames['archive'], download_params=download_params,
+                                             checkpoint=checkpoint)
+                return crawler, converter, checkpoint
+
+            # The articles of the first column (with their extra articles) and the first article of the second
+            #  column are processed, the crawl dies at one of its extra articles, the other one is pending
+            die_at = NO_OF_ARCHIVE_PAGES * 2 * 3 + 2
+            test_logger.log('INFO', 'Testing the crawler checkpoint (crawling until it dies)')
+            crawler, converter, checkpoint = create_crawler(False, die_at)
+            try:
+                crawler.download_and_extract_all_articles()
+                assert False, 'The crawl must die!'
+            except KeyboardInterrupt:
+                pass
+            processed_before = converter.processed
+            del crawler, converter, checkpoint
+            requests_before = Counter(SiteHandler.requests)
+            assert requests_before['/first/page/{0}'.format(NO_OF_ARCHIVE_PAGES)] == 1
+            assert requests_before['/second/page/1'] == 1 and requests_before['/second/page/2'] == 0
+
+            test_logger.log('INFO', 'Testing the crawler checkpoint (the saved state)')
+            checkpoint = Checkpoint(checkpoint_filename, resume=True)
+            archive_state, articles_state = checkpoint.get('archive'), checkpoint.get('articles')
+            assert archive_state['done_archive_page_urls'] == [['first', '{0}/first/page/#pagenum'.format(base_url)]]
+            position = archive_state['columns']['second']['position']
+            assert position['archive_page_url_base'] == '{0}/second/page/#pagenum'.format(base_url)
+            assert len(position['urls_left']) == 1 and position['next_page_url'] == '{0}/second/page/2'.format(base_url)
+            assert position['first_page'] is False
+            # The died one is not finished (not logged), it is pending with the other extra article of the same article
+            dying_url = processed_before[-1]
+            pending_url = dying_url[:-1] + str(1 - int(dying_url[-1]))
+            assert dying_url not in articles_state['processed_urls']
+            assert set(articles_state['pending_urls']) == {dying_url, pending_url}
+            del checkpoint
+
+            test_logger.log('INFO', 'Testing the crawler checkpoint (resuming)')
+            crawler, converter, checkpoint = create_crawler(True)
+            crawler.download_and_extract_all_articles()
+            processed_after = converter.processed
+            del crawler, converter, checkpoint
+            requests_after = SiteHandler.requests - requests_before
+
+            # The finished column and the finished archive page are not downloaded again
+            assert all(not path.startswith('/first/') for path in requests_after)
+            assert requests_after['/second/page/1'] == 0
+            assert requests_after['/second/page/2'] == 1 and requests_after['/second/page/3'] == 1
+            # Every article is downloaded exactly once, the pending ones first (the died one is processed again from
+            #  the WARC file of the died crawl), then the one left on the page
+            article_paths = {'/{0}/{1}-{2}-{3}{4}'.format(kind, column, page_num, i, extra)
+                             for column in COLUMNS for page_num in range(1, NO_OF_ARCHIVE_PAGES + 1)
+                             for i in range(2)
+                             for kind, extra in (('article', ''), ('extra', '-0'), ('extra', '-1'))}
+            requests = requests_before + requests_after
+            assert {path for path in requests if path.startswith(('/article/', '/extra/'))} == article_paths
+            assert all(requests[path] == 1 for path in article_paths)
+            assert set(processed_after[:2]) == {dying_url, pending_url}
+            assert processed_after[2] == position['urls_left'][0]
+            assert len(processed_before) + len(processed_after) == len(article_paths) + 1
+
+            # The WARC files of the died crawl are kept (truncated to the checkpoint) and new ones are written
+            #  (only the died article processed again is copied from the old one to the new one)
+            resumed_warc_filenames = {part: os_path_join(tmp_dir, '{0}-00000.warc.gz'.format(part))
+                                      for part in warc_filenames.keys()}
+            for part, warc_filename in warc_filenames.items():
+                urls_before, urls_after = read_urls(warc_filename), read_urls(resumed_warc_filenames[part])
+                copied_urls = {dying_url} if part == 'articles' else set()
+                assert len(urls_before) > 0 and len(urls_after) > 0
+                assert set(urls_before) & set(urls_after) == copied_urls
+            assert {url[len(base_url):] for url in chain(read_urls(warc_filenames['articles']),
+                                                         read_urls(resumed_warc_filenames['articles']))} == \
+                article_paths
+    finally:
+        server.shutdown()
+        server.server_close()
+    test_logger.log('INFO', 'Test OK!')
+
+
+def threaded_crawler_resume_test(test_logger):
+    """
+        The crawl with the archive pages of the days crawled in threads (--archive-date-workers) and the articles
+         downloaded in threads (--download-workers) must be resumable from any checkpoint: every URL logged as done
+         must be in the WARC files truncated to the checkpoint (the threads write and log while the checkpoint is
+         saved, see CheckedCheckpoint) and the crawl dying twice and resumed must process every article
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    try:
+        with TemporaryDirectory() as tmp_dir:
+            config_filename = write_test_site(tmp_dir, DATE_SITE_SCHEMA, base_url)
+            checkpoint_filename = os_path_join(tmp_dir, 'crawl.checkpoint')
+            article_paths = {'/{0}/{1}-2020-01-{2:02d}-{3}-{4}{5}'.format(kind, DATE_COLUMN, day, page_num, i, extra)
+                             for day in range(1, DAYS + 1) for page_num in range(1, NO_OF_ARCHIVE_PAGES + 1)
+                             for i in range(2)
+                             for kind, extra in (('article', ''), ('extra', '-0'), ('extra', '-1'))}
+
+            def crawl(resume, die_at=None):
+                settings = wrap_input_constants(config_filename)
+                converter = DyingConverter(settings, base_url, die_at)
+                settings['CORPUS_CONVERTER'] = converter
+                checkpoint = CheckedCheckpoint(checkpoint_filename, interval=0, resume=resume)  # Saved after each URL
+                crawler = NewsArticleCrawler(settings, None, os_path_join(tmp_dir, 'articles.warc.gz'), None,
+                                             os_path_join(tmp_dir, 'archive.warc.gz'),
+                                             download_params={'max_no_of_calls_in_period': 1000}, download_workers=4,
+                                             archive_params={'date_workers': 4}, checkpoint=checkpoint)
+                # Collected last and slowly, so the threads write records and log URLs while the state is saved
+                checkpoint.register('slow', lambda: sleep(0.005))
+                try:
+                    crawler.download_and_extract_all_articles()
+                except KeyboardInterrupt:
+                    assert die_at is not None, 'The crawl must not die!'
+                else:
+                    assert die_at is None, 'The crawl must die!'
+                return converter.processed
+
+            def check_logged_urls():
+                checkpoint = Checkpoint(checkpoint_filename, resume=True)
+                for part, key in CheckedCheckpoint.done_keys.items():
+                    warc_urls = set(chain.from_iterable(read_urls(warc_filename) for warc_filename in
+                                                        checkpoint.resume_warc_files(part, test_logger)))
+                    logged_urls = checkpoint.get(part).get(key, ())
+                    assert len(logged_urls) > 0 and set(logged_urls) <= warc_urls
+                del checkpoint
+
+            processed = []
+            for resume, die_at in ((False, len(article_paths) // 3), (True, len(article_paths) // 3), (True, None)):
+                test_logger.log('INFO', 'Testing the threaded crawler checkpoint ({0}, dying at {1})'.
+                                format('resuming' if resume else 'crawling', die_at))
+                processed.extend(crawl(resume, die_at))
+                if die_at is not None:
+                    check_logged_urls()
+
+            # Every article is processed (the ones after the last checkpoint before dying are processed again)
+            #  and written to the WARC files
+            assert {url[len(base_url):] for url in processed} == article_paths
+            warc_urls = chain.from_iterable(read_urls(os_path_join(tmp_dir, filename))
+                                            for filename in os.listdir(tmp_dir)
+                                            if filename.startswith('articles') and filename.endswith('.warc.gz'))
+            assert {url[len(base_url):] for url in warc_urls} == article_paths
+    finally:
+        server.shutdown()
+        server.server_close()
+    test_logger.log('INFO', 'Test OK!')
+
+
+def main_test():
+    main_logger = Logger()
+
+    # Relative path from this directory to the files in the project's test directory
+    choices = {'archive': os_path_join(dirname(abspath(__file__)), 'extract_article_urls_from_page.warc.gz')}
+
+    checkpoint_resume_test(choices['archive'], main_logger)
+    crawler_resume_test(main_logger)
+    threaded_crawler_resume_test(main_logger)
+
+
+if __name__ == '__main__':
+    main_test()
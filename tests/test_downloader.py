@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from threading import Thread
+from tempfile import TemporaryDirectory
+from os.path import join as os_path_join
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from warcio.archiveiterator import ArchiveIterator
+
+from webarticlecurator import Logger, WarcCachingDownloader, WarcReader
+
+# Path -> (Content-Type header, body) of the test server
+PAGES = {'/utf8': ('text/html; charset=UTF-8', '<html><body><p>árvíztűrő tükörfúrógép</p></body></html>'
+                                               .encode('UTF-8')),
+         '/latin2': ('text/html', ('<html><body>' + 'árvíztűrő tükörfúrógép ' * 100 + '</body></html>')
+                     .encode('ISO-8859-2')),
+         '/crlf': ('text/html; charset=UTF-8', b'<html><body>trailing whitespace</body></html>\r\n\r\n'),
+         '/json': ('application/json', b'{"a": 1}')}
+# The host learns ISO-8859-2 from the first page, but the second page is UTF-8 without charset
+HOST_ENCODING_PAGES = {'/latin2-meta': ('text/html', ('<html><head><meta charset="iso-8859-2"></head><body>'
+                                                     'árvíztűrő tükörfúrógép</body></html>').encode('ISO-8859-2')),
+                       '/utf8-no-charset': ('text/html', '<html><body>árvíztűrő tükörfúrógép</body></html>'
+                                                         .encode('UTF-8'))}
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    pages = PAGES
+
+    def do_GET(self):
+        if self.path not in self.pages:
+            self.send_error(404)
+            return
+        content_type, body = self.pages[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+def read_responses(filename):
+    """URL -> (status, Content-Type, payload, detected encoding) of the response records of the WARC file"""
+    with open(filename, 'rb') as stream:
+        return {record.rec_headers.get_header('WARC-Target-URI'):
+                (record.http_headers.get_statuscode(), record.http_headers.get_header('Content-Type'),
+                 record.content_stream().read(), record.rec_headers.get_header('WARC-X-Detected-Encoding'))
+                for record in ArchiveIterator(stream) if record.rec_type == 'response'}
+
+
+def downloader_backends_test(test_logger):
+    """The aiohttp backend must download and write the same as the requests backend (readable with digest check)"""
+    try:
+        import aiohttp  # noqa: F401, only needed by the aiohttp backend
+        backends = ('requests', 'aiohttp')
+    except ImportError:
+        test_logger.log('WARNING', 'Testing only the requests backend as the aiohttp extra is not installed!')
+        backends = ('requests',)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    try:
+        with TemporaryDirectory() as tmp_dir:
+            responses = {}
+            for backend in backends:
+                test_logger.log('INFO', 'Testing the {0} downloader backend'.format(backend))
+                warc_filename = os_path_join(tmp_dir, '{0}.warc.gz'.format(backend))
+                w = WarcCachingDownloader(None, warc_filename, test_logger,
+                                          download_params={'downloader_backend': backend,
+                                                           'max_no_of_calls_in_period': 100})
+                texts = {}
+                for path, (_, body) in PAGES.items():
+                    texts[path] = w.download_url('{0}{1}'.format(base_url, path))
+                    if path == '/crlf':  # The trailing whitespace ending in CRLF is dropped (see SpooledBody)
+                        body = body.rstrip()
+                    if path != '/latin2':  # Without charset the detector may choose a compatible encoding
+                        assert texts[path] == body.decode('UTF-8'), path
+                assert w.download_url('{0}/not-found'.format(base_url)) is None
+                del w
+
+                reader = WarcReader(warc_filename, test_logger, strict_mode=True, check_digest=True)
+                assert set(reader.url_index) == {'{0}{1}'.format(base_url, path) for path in PAGES.keys()}
+                del reader
+                responses[backend] = read_responses(warc_filename)
+                _, _, payload, detected_encoding = responses[backend]['{0}/latin2'.format(base_url)]
+                assert detected_encoding is not None and payload == PAGES['/latin2'][1]
+                assert texts['/latin2'] == payload.decode(detected_encoding)
+                assert responses[backend]['{0}/crlf'.format(base_url)][2] == PAGES['/crlf'][1].rstrip()
+            assert all(backend_responses == responses['requests'] for backend_responses in responses.values())
+    finally:
+        server.shutdown()
+        server.server_close()
+    test_logger.log('INFO', 'Test OK!')
+
+
+class HostEncodingPageHandler(PageHandler):
+    pages = HOST_ENCODING_PAGES
+
+
+def host_encoding_test(test_logger):
+    """The encoding learned for the host must not be used for the valid UTF-8 pages of the host without charset"""
+    test_logger.log('INFO', 'Testing the encoding learned for the host on a UTF-8 page without charset')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), HostEncodingPageHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    try:
+        with TemporaryDirectory() as tmp_dir:
+            warc_filename = os_path_join(tmp_dir, 'host_encoding.warc.gz')
+            w = WarcCachingDownloader(None, warc_filename, test_logger,
+                                      download_params={'max_no_of_calls_in_period': 100})
+            for path, (_, body) in HOST_ENCODING_PAGES.items():
+                expected_encoding = 'ISO-8859-2' if path == '/latin2-meta' else 'UTF-8'
+                assert w.download_url('{0}{1}'.format(base_url, path)) == body.decode(expected_encoding), path
+            del w
+
+            responses = read_responses(warc_filename)
+            assert responses['{0}/latin2-meta'.format(base_url)][3] == 'iso-8859-2'
+            assert responses['{0}/utf8-no-charset'.format(base_url)][3] == 'UTF-8'
+            with open(warc_filename, 'rb') as stream:
+                methods = {record.rec_headers.get_header('WARC-Target-URI'):
+                           record.rec_headers.get_header('WARC-X-Detected-Encoding-Method')
+                           for record in ArchiveIterator(stream) if record.rec_type == 'response'}
+            assert methods == {'{0}/latin2-meta'.format(base_url): 'meta',
+                               '{0}/utf8-no-charset'.format(base_url): 'utf-8'}
+    finally:
+        server.shutdown()
+        server.server_close()
+    test_logger.log('INFO', 'Test OK!')
+
+
+def main_test():
+    main_logger = Logger()
+
+    downloader_backends_test(main_logger)
+    host_encoding_test(main_logger)
+
+
+if __name__ == '__main__':
+    main_test()
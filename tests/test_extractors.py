@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from glob import glob
+from tempfile import TemporaryDirectory
+from urllib.parse import urlsplit
+from os.path import abspath, dirname, join as os_path_join
+
+from bs4 import BeautifulSoup
+
+from webarticlecurator import Logger, WarcReader, ParsedPage, StreamingLinkExtractor, wrap_input_constants
+from webarticlecurator.extraction_pool import PooledFunction, extract_ahead
+
+
+def read_pages(filenames, test_logger):
+    """The decoded pages of the WARC files (URL -> raw HTML)"""
+    pages = {}
+    for filename in filenames:
+        reader = WarcReader(filename, test_logger)
+        for url in reader.url_index:
+            pages[url] = reader.download_url(url)
+    return pages
+
+
+def selector_extractors_test(config_filename, selectors_schema_filename, portal, pages, test_logger):
+    """
+        The selectors of the example schema must extract the same URLs as the extractor functions they replace
+         on the pages of the portal. The article URLs must be the same on every page, but the next page selector
+         also takes the link inside the selected element (the function takes the href of the element only)
+    """
+    try:
+        import cssselect  # noqa: F401, only needed by the selectors
+    except ImportError:
+        test_logger.log('WARNING', 'Skipping the selector tests as the selectors extra (cssselect) is not installed!')
+        return
+
+    with TemporaryDirectory() as tmp_dir:
+        with open(config_filename, encoding='UTF-8') as fh:
+            config = fh.read()
+        selectors_config_filename = os_path_join(tmp_dir, 'config_selectors.yaml')
+        with open(selectors_config_filename, 'w', encoding='UTF-8') as fh:
+            fh.write('"schema": "{0}"\n{1}'.format(selectors_schema_filename, config.split('\n', maxsplit=1)[1]))
+        fun_settings = wrap_input_constants(config_filename)
+        selector_settings = wrap_input_constants(selectors_config_filename)
+
+    portal_pages = {url: raw_html for url, raw_html in pages.items()
+                    if urlsplit(url).netloc == portal or urlsplit(url).netloc.endswith('.{0}'.format(portal))}
+    assert len(portal_pages) > 0
+    for fun_name, fun_pages in (('EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN', pages),
+                                ('EXTRACT_NEXT_PAGE_URL_FUN', portal_pages)):
+        test_logger.log('INFO', 'Testing the selector of {0} against the function ({1} pages)'.
+                        format(fun_name, len(fun_pages)))
+        fun, selector = fun_settings[fun_name], selector_settings[fun_name]
+        assert not hasattr(fun, 'page_parser') and hasattr(selector, 'page_parser')
+        extracted = 0
+        for url, raw_html in fun_pages.items():
+            expected = fun(raw_html)
+            assert ParsedPage(raw_html).apply(selector) == expected, url
+            assert selector(raw_html) == expected, url
+            extracted += url in portal_pages and expected is not None and len(expected) > 0
+        assert extracted > 0  # Not only the empty results are the same
+
+    test_logger.log('INFO', 'Testing the selectors on corner cases')
+    next_page_selector = selector_settings['EXTRACT_NEXT_PAGE_URL_FUN']
+    article_url_selector = selector_settings['EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN']
+    # Only the first selected element counts, even if it has no link (like BeautifulSoup.select_one())
+    assert next_page_selector('<p class="next">no link</p><a class="next" href="/p/2">next</a>') is None
+    assert next_page_selector('<span class="next"><a>no href</a><a href="/p/3">3</a></span>') is None
+    assert next_page_selector('<a class="next" href="/p/2">next</a><a class="next" href="/p/3">3</a>') == '/p/2'
+    assert next_page_selector('') is None
+    assert article_url_selector('<h2 class="entry-title"><a href="/a">a</a> <a href="/b">b</a></h2>'
+                                '<h2 class="entry-title">no link</h2>') == {'/a', '/b'}
+    assert article_url_selector('') == set()
+    test_logger.log('INFO', 'Test OK!')
+
+
+def first_link_href(container):
+    """The href of the container if it is a link or of the first link inside it (see StreamingLinkExtractor)"""
+    a_tag = container if container.name == 'a' else container.find('a')
+    if a_tag is not None and 'href' in a_tag.attrs:
+        return a_tag['href']
+    return None
+
+
+class SlicedPage(str):
+    """A page recording the start of the slices read from it"""
+    def __new__(cls, value):
+        page = super().__new__(cls, value)
+        page.slice_starts = []
+        return page
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            self.slice_starts.append(key.start or 0)
+        return super().__getitem__(key)
+
+
+def streaming_extractor_test(pages, test_logger):
+    """
+        The streaming link extractor must extract the same URLs as BeautifulSoup.find_all() with the first link
+         of each container (as in the extractor functions) from every page (also when it is fed in small chunks)
+    """
+    soups = {url: BeautifulSoup(raw_html, 'lxml') for url, raw_html in pages.items()}
+    for tag, class_ in (('h2', None), ('article', None), ('div', None), (None, 'title'), ('div', 'article'),
+                        ('li', None)):
+        test_logger.log('INFO', 'Testing the streaming link extractor (tag: {0}, class: {1}, {2} pages)'.
+                        format(tag, class_, len(pages)))
+        extract_links = StreamingLinkExtractor(tag, class_=class_, url_prefix='https://prefix')
+        extract_links_in_chunks = StreamingLinkExtractor(tag, class_=class_, url_prefix='https://prefix',
+                                                         chunk_size=1021)
+        extract_first_link = StreamingLinkExtractor(tag, class_=class_, url_prefix='https://prefix', first_only=True)
+        find_all_args = {} if class_ is None else {'class_': class_}  # class_=None would mean no class attribute
+        extracted = 0
+        for url, raw_html in pages.items():
+            containers = soups[url].find_all(tag, **find_all_args)
+            expected = {'https://prefix{0}'.format(href) for href in map(first_link_href, containers)
+                        if href is not None}
+            assert extract_links(raw_html) == expected, url
+            assert extract_links_in_chunks(raw_html) == expected, url
+            expected_first = None
+            if len(containers) > 0 and first_link_href(containers[0]) is not None:
+                expected_first = 'https://prefix{0}'.format(first_link_href(containers[0]))
+            assert extract_first_link(raw_html) == expected_first, url
+            extracted += len(expected) > 0
+        assert extracted > 0  # Not only the empty results are the same
+
+    test_logger.log('INFO', 'Testing the streaming link extractor on corner cases')
+    extract_first_link = StreamingLinkExtractor('div', class_='c', first_only=True)
+    # Only the first (outermost) container counts, even if it has no link
+    assert extract_first_link('<div class="c">no link</div><div class="c"><a href="/2">2</a></div>') is None
+    assert extract_first_link('<div class="c"><div class="c">nested</div><a href="/1">1</a></div>'
+                              '<div class="c"><a href="/2">2</a></div>') == '/1'
+    assert extract_first_link('<div class="c"><a>no href</a><a href="/1">1</a></div>') is None
+    assert extract_first_link('') is None
+    assert StreamingLinkExtractor('div', class_='c')('') == set()
+    # The charset declared in the (already decoded) page must not change the decoding between the chunks
+    page = '<meta charset="iso-8859-2">' + '<p>filler</p>' * 100 + '<div class="c"><a href="/Autó">1</a></div>'
+    assert StreamingLinkExtractor('div', class_='c', chunk_size=64)(page) == {'/Autó'}
+    # The first link is found in the first chunks, the rest of the page is not read
+    page = SlicedPage('<div class="c"><a href="/1">1</a></div>' + '<p>filler</p>' * 10000)
+    assert StreamingLinkExtractor('div', class_='c', first_only=True, chunk_size=1024)(page) == '/1'
+    assert max(page.slice_starts) < 10000
+    test_logger.log('INFO', 'Test OK!')
+
+
+def extraction_pool_test(config_filename, pages, test_logger):
+    """The extractor functions running in the ExtractionPool must return the same in the same order"""
+    fun_settings = wrap_input_constants(config_filename)
+    pooled_settings = wrap_input_constants(config_filename, extraction_workers=2)
+    with pooled_settings['EXTRACTION_POOL']:
+        for fun_name in ('EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN', 'EXTRACT_NEXT_PAGE_URL_FUN'):
+            test_logger.log('INFO', 'Testing the pooled {0} ({1} pages)'.format(fun_name, len(pages)))
+            fun, pooled_fun = fun_settings[fun_name], pooled_settings[fun_name]
+            assert isinstance(pooled_fun, PooledFunction)
+            pages_with_missing = list(pages.items()) + [('https://example.com/missing', None)]
+            results = [(url, result) for url, _, result in extract_ahead(pooled_fun, pages_with_missing)]
+            assert results == [(url, fun(raw_html) if raw_html is not None else None)
+                                for url, raw_html in pages_with_missing]
+            first_url, first_raw_html = next(iter(pages.items()))
+            assert pooled_fun(first_raw_html) == fun(first_raw_html), first_url  # Without prefetching
+    test_logger.log('INFO', 'Test OK!')
+
+
+def main_test():
+    main_logger = Logger()
+
+    # Relative path from this directory to the files in the project's test and configs directories
+    test_dir = dirname(abspath(__file__))
+    choices = {'warc_files': sorted(glob(os_path_join(test_dir, '*.warc.gz'))),
+               'bbeacon_config': os_path_join(test_dir, '../configs/config_bbeacon.yaml'),
+               'bbeacon_selectors_schema': os_path_join(test_dir, '../configs/site_schemas/'
+                                                                  'bbeacon_selectors_schema.yaml')}
+
+    pages = read_pages(choices['warc_files'], main_logger)
+    selector_extractors_test(choices['bbeacon_config'], abspath(choices['bbeacon_selectors_schema']),
+                             'budapestbeacon.com', pages, main_logger)
+    streaming_extractor_test(pages, main_logger)
+    extraction_pool_test(choices['bbeacon_config'], dict(list(pages.items())[:40]), main_logger)
+
+
+if __name__ == '__main__':
+    main_test()
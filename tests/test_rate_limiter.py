@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+from time import time
+from email.utils import formatdate
+from threading import Thread
+from tempfile import TemporaryDirectory
+from os.path import join as os_path_join
+
+from webarticlecurator import Logger
+from webarticlecurator.rate_limiter import TokenBucket, FileTokenBucket, AdaptiveTokenBucket, get_token_bucket, \
+    parse_retry_after
+
+
+class FakeClock:
+    """A clock for the token buckets which stands still until it is advanced, so the delays are exact"""
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def reserve_from_threads(buckets, calls_per_thread):
+    """Reserve the calls through the buckets (one thread for each) at the same time and return the sorted delays"""
+    delays = []
+
+    def worker(bucket):
+        thread_delays = [bucket.reserve() for _ in range(calls_per_thread)]
+        delays.extend(thread_delays)  # Atomic
+
+    threads = [Thread(target=worker, args=(bucket,)) for bucket in buckets]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(delays)
+
+
+def assert_delays(delays, expected_delays):
+    assert len(delays) == len(expected_delays) and \
+        all(abs(delay - expected) < 1e-9 for delay, expected in zip(delays, expected_delays)), delays
+
+
+def token_bucket_timing_test(test_logger):
+    """The first burst calls pass at once, the rest are spaced evenly at the rate (also between threads)"""
+    test_logger.log('INFO', 'Testing the reservations of the token bucket')
+    bucket = TokenBucket(10, 3, FakeClock())  # 10 calls/s, 3 at once
+    # The waiting callers are served in the order of reservation
+    assert_delays([bucket.reserve() for _ in range(6)], [0.0, 0.0, 0.0, 0.1, 0.2, 0.3])
+
+    test_logger.log('INFO', 'Testing the rate of the token bucket from more threads')
+    bucket = TokenBucket(20, 2, FakeClock())  # 20 calls/s, 2 at once: the 20th call waits (20 - 2) / 20 seconds
+    assert_delays(reserve_from_threads([bucket] * 4, 5), [0.0, 0.0] + [i / 20 for i in range(1, 19)])
+
+    test_logger.log('INFO', 'Testing the refill of the token bucket')
+    clock = FakeClock()
+    bucket = TokenBucket(10, 2, clock)
+    assert bucket.reserve() == 0.0 and bucket.reserve() == 0.0
+    clock.advance(0.25)  # Refilled to the burst, not above
+    assert_delays([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.1])
+    test_logger.log('INFO', 'Test OK!')
+
+
+def shared_token_bucket_test(test_logger):
+    """The buckets of the same host (and state file) are shared, the buckets of different hosts are independent"""
+    test_logger.log('INFO', 'Testing the token buckets shared in the process')
+    bucket = get_token_bucket('shared.example.com', 10, 1)
+    assert get_token_bucket('shared.example.com', 100, 1) is bucket  # The first one sets the parameters
+    assert get_token_bucket('other.example.com', 10, 1) is not bucket
+    delays = [bucket.reserve() for _ in range(11)]  # The burst defaults to the number of calls in the period
+    assert delays[:10] == [0.0] * 10 and abs(delays[10] - 0.1) < 0.02
+
+    test_logger.log('INFO', 'Testing the token buckets shared through a state file')
+    with TemporaryDirectory() as tmp_dir:
+        filename = os_path_join(tmp_dir, 'shared.bucket')
+        clock = FakeClock()
+        bucket1 = FileTokenBucket(filename, 10, 2, clock)  # E.g. in two processes
+        bucket2 = FileTokenBucket(filename, 10, 2, clock)
+        assert_delays([bucket1.reserve(), bucket2.reserve(), bucket1.reserve(), bucket2.reserve()],
+                      [0.0, 0.0, 0.1, 0.2])
+        filename = os_path_join(tmp_dir, 'threads.bucket')
+        buckets = [FileTokenBucket(filename, 20, 2, clock) for _ in range(2)]
+        assert_delays(reserve_from_threads(buckets, 5), [0.0, 0.0] + [i / 20 for i in range(1, 9)])
+        bucket = get_token_bucket('shared.example.com', 20, 1, 2, tmp_dir)
+        assert isinstance(bucket, FileTokenBucket) and bucket.reserve() == 0.0
+        assert os.path.exists(os_path_join(tmp_dir, 'shared.example.com.bucket'))
+    test_logger.log('INFO', 'Test OK!')
+
+
+def empty_bucket_delay(bucket, burst):
+    """Empty the bucket and return the delay of the next call (1 / rate)"""
+    for _ in range(burst):
+        bucket.reserve()
+    return bucket.reserve()
+
+
+def adaptive_token_bucket_test(test_logger):
+    """The rate grows while the latency is flat, decreases when it grows and backs off on 429/503 with Retry-After"""
+    test_logger.log('INFO', 'Testing the adaptive token bucket (flat latency)')
+    bucket = AdaptiveTokenBucket(10, 1)
+    for _ in range(20):
+        bucket.feedback(200, 0.1)
+    assert abs(bucket._rate - 10 * (1 + 20 * AdaptiveTokenBucket.increase_step)) < 1e-9
+    for _ in range(1000):  # Up to the maximal rate
+        bucket.feedback(200, 0.1)
+    assert bucket._rate == 10 * AdaptiveTokenBucket.max_rate_factor
+
+    test_logger.log('INFO', 'Testing the adaptive token bucket (growing latency)')
+    bucket = AdaptiveTokenBucket(10, 1)
+    bucket.feedback(200, 0.1)
+    rate = bucket._rate
+    assert bucket.feedback(200, 2.0)[0] == 'INFO'
+    assert abs(bucket._rate - rate * AdaptiveTokenBucket.latency_decrease) < 1e-9
+
+    test_logger.log('INFO', 'Testing the adaptive token bucket (backing off)')
+    bucket = AdaptiveTokenBucket(10, 1, FakeClock())
+    assert bucket.feedback(429, 0.1)[0] == 'WARNING'
+    assert bucket._rate == 5
+    assert_delays([empty_bucket_delay(bucket, 1)], [0.2])
+    for _ in range(10):  # Not below the minimal rate
+        bucket.feedback(503, 0.1)
+    assert bucket._rate == 10 * AdaptiveTokenBucket.min_rate_factor
+
+    test_logger.log('INFO', 'Testing the adaptive token bucket (Retry-After)')
+    clock = FakeClock()
+    bucket = AdaptiveTokenBucket(10, 5, clock)
+    bucket.feedback(503, 0.1, '2')
+    clock.advance(0.5)
+    # No tokens are given out until Retry-After elapses, even if the bucket is full
+    assert_delays([bucket.reserve()], [1.5])
+
+    test_logger.log('INFO', 'Testing the parsing of Retry-After')
+    assert parse_retry_after(None) is None
+    assert parse_retry_after(' 120 ') == 120
+    assert 55 < parse_retry_after(formatdate(time() + 60, usegmt=True)) <= 60
+    assert parse_retry_after(formatdate(time() - 60, usegmt=True)) == 0.0
+    assert parse_retry_after('soon') is None
+    test_logger.log('INFO', 'Test OK!')
+
+
+def main_test():
+    main_logger = Logger()
+
+    token_bucket_timing_test(main_logger)
+    shared_token_bucket_test(main_logger)
+    adaptive_token_bucket_test(main_logger)
+
+
+if __name__ == '__main__':
+    main_test()
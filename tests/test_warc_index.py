@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import sys
+from random import Random
+from shutil import copyfile
+from tempfile import TemporaryDirectory
+from os.path import abspath, dirname, join as os_path_join
+
+from warcio.archiveiterator import ArchiveIterator
+
+from webarticlecurator import Logger, WarcReader, WarcCachingDownloader
+from webarticlecurator.enhanced_downloader import DecodedContentCache
+from webarticlecurator.warc_index import HashedIndexWriter, HashedUrlIndex, CDXJIndex, MergedUrlIndex, \
+    write_cdxj_index, write_hashed_index, merge_url_indices
+
+
+def copy_warc_file(filename, target_dir, target_name=None):
+    """Copy the WARC file into the (temporary) directory, so the indices are not written next to the test files"""
+    target_filename = os_path_join(target_dir, target_name or os.path.basename(filename))
+    copyfile(filename, target_filename)
+    return target_filename
+
+
+def read_url_index(filename):
+    """The expected index of the WARC file: URL -> ((request offset, length), (response offset, length))"""
+    url_index = {}
+    with open(filename, 'rb') as stream:
+        archive_it = ArchiveIterator(stream)
+        reqv_data = None
+        for record in archive_it:
+            if record.rec_type == 'request':
+                reqv_data = (archive_it.get_record_offset(), archive_it.get_record_length())
+            elif record.rec_type == 'response':
+                url_index[record.rec_headers.get_header('WARC-Target-URI')] = \
+                    (reqv_data, (archive_it.get_record_offset(), archive_it.get_record_length()))
+    return url_index
+
+
+def index_sidecar_round_trip_test(filename, test_logger):
+    """The index sidecar written and loaded again must contain the same index as the WARC file"""
+    expected_url_index = read_url_index(filename)
+    with TemporaryDirectory() as tmp_dir:
+        warc_filename = copy_warc_file(filename, tmp_dir)
+        sidecar_filename = '{0}{1}'.format(warc_filename, WarcReader.sidecar_ext)
+
+        test_logger.log('INFO', 'Testing the index sidecar (written)')
+        reader = WarcReader(warc_filename, test_logger, index_sidecar=True)
+        assert os.path.exists(sidecar_filename)
+        assert dict(reader.url_index_offsets.items()) == expected_url_index
+        info_record_data = reader.info_record_data
+        del reader
+
+        test_logger.log('INFO', 'Testing the index sidecar (loaded)')
+        reader = WarcReader(warc_filename, test_logger)
+        assert isinstance(reader.url_index_offsets, HashedUrlIndex)
+        assert reader.url_index_offsets.filename == sidecar_filename
+        assert dict(reader.url_index_offsets.items()) == expected_url_index
+        assert set(reader.url_index) == set(expected_url_index.keys())
+        assert reader.info_record_data == info_record_data
+        assert 'http://example.com/not-in-the-archive' not in reader.url_index_offsets
+        del reader
+
+        test_logger.log('INFO', 'Testing the index sidecar (outdated)')
+        os.utime(warc_filename, ns=(0, 0))
+        reader = WarcReader(warc_filename, test_logger)  # The outdated sidecar is not used nor rewritten
+        assert reader.url_index_offsets.filename is None
+        assert dict(reader.url_index_offsets.items()) == expected_url_index
+        del reader
+    test_logger.log('INFO', 'Test OK!')
+
+
+def index_external_sort_test(filename, test_logger):
+    """The indices sorted in many runs (see HashedIndexWriter.run_size) must be the same as sorted in one run"""
+    expected_url_index = read_url_index(filename)
+    orig_run_size = HashedIndexWriter.run_size
+    with TemporaryDirectory() as tmp_dir:
+        warc_filename = copy_warc_file(filename, tmp_dir)
+        try:
+            test_logger.log('INFO', 'Testing the index sorted in runs')
+            HashedIndexWriter.run_size = 3
+            reader = WarcReader(warc_filename, test_logger)
+            assert dict(reader.url_index_offsets.items()) == expected_url_index
+
+            test_logger.log('INFO', 'Testing the hashed index written from a dict in runs')
+            index_filename = os_path_join(tmp_dir, 'from_dict.idx')
+            write_hashed_index(index_filename, expected_url_index, {'test': True})
+            url_index = HashedUrlIndex(index_filename)
+            assert url_index.header == {'test': True, 'count': len(expected_url_index)}
+            assert dict(url_index.items()) == expected_url_index
+            del url_index
+        finally:
+            HashedIndexWriter.run_size = orig_run_size
+    test_logger.log('INFO', 'Test OK!')
+
+
+def cdxj_index_round_trip_test(filename, test_logger):
+    """The CDXJ index (sorted in runs or in one run) must contain the same index as the WARC file"""
+    expected_url_index = read_url_index(filename)
+    orig_run_size = HashedIndexWriter.run_size
+    with TemporaryDirectory() as tmp_dir:
+        warc_filename = copy_warc_file(filename, tmp_dir)
+        cdxj_filename = '{0}{1}'.format(warc_filename, WarcReader.cdxj_ext)
+
+        test_logger.log('INFO', 'Testing the CDXJ index')
+        assert write_cdxj_index(warc_filename, cdxj_filename, test_logger) == len(expected_url_index)
+        with open(cdxj_filename, 'rb') as fh:
+            cdxj_lines = fh.readlines()
+        assert cdxj_lines == sorted(cdxj_lines)
+        cdxj_index = CDXJIndex(cdxj_filename)
+        assert len(cdxj_index) == len(expected_url_index)
+        assert dict(cdxj_index.items()) == expected_url_index
+        del cdxj_index
+
+        test_logger.log('INFO', 'Testing the CDXJ index sorted in runs')
+        try:
+            HashedIndexWriter.run_size = 3
+            runs_cdxj_filename = os_path_join(tmp_dir, 'runs.cdxj')
+            write_cdxj_index(warc_filename, runs_cdxj_filename, test_logger)
+        finally:
+            HashedIndexWriter.run_size = orig_run_size
+        with open(runs_cdxj_filename, 'rb') as fh:
+            assert fh.readlines() == cdxj_lines
+
+        test_logger.log('INFO', 'Testing the CDXJ index used by WarcReader')
+        reader = WarcReader(warc_filename, test_logger, index_sidecar=True)  # The CDXJ index is preferred
+        assert isinstance(reader.url_index_offsets, CDXJIndex)
+        assert dict(reader.url_index_offsets.items()) == expected_url_index
+        assert not os.path.exists('{0}{1}'.format(warc_filename, WarcReader.sidecar_ext))
+        del reader
+    test_logger.log('INFO', 'Test OK!')
+
+
+def parallel_indexing_test(filenames, test_logger):
+    """The index sidecars created in a process pool must contain the same indices as the WARC files"""
+    with TemporaryDirectory() as tmp_dir:
+        warc_filenames = [copy_warc_file(filename, tmp_dir) for filename in filenames]
+        test_logger.log('INFO', 'Testing the indexing in a process pool')
+        w = WarcCachingDownloader(warc_filenames, None, test_logger, just_cache=True,
+                                  download_params={'stay_offline': True, 'index_sidecar': True, 'index_workers': 2})
+        del w
+        for warc_filename in warc_filenames:
+            sidecar_filename = '{0}{1}'.format(warc_filename, WarcReader.sidecar_ext)
+            assert os.path.exists(sidecar_filename)
+            assert dict(HashedUrlIndex(sidecar_filename).items()) == read_url_index(warc_filename)
+    test_logger.log('INFO', 'Test OK!')
+
+
+def merged_index_last_file_wins_test(test_logger):
+    """The merged index must point to the last source containing the URL (like updating a dict source by source)"""
+    rnd = Random(42)
+    urls = ['https://example.com/article/{0}'.format(i) for i in range(1000)]
+    url_indices = [{url: ((rnd.randrange(10 ** 9), i + 1), (rnd.randrange(10 ** 9), i + 2))
+                    for url in rnd.sample(urls, 400)} for i in range(4)]
+    expected_merged_index = {}
+    for src, url_index in enumerate(url_indices):
+        expected_merged_index.update((url, (src, reqv, resp)) for url, (reqv, resp) in url_index.items())
+
+    orig_run_size = HashedIndexWriter.run_size
+    with TemporaryDirectory() as tmp_dir:
+        index_filename = os_path_join(tmp_dir, 'source.idx')
+        write_hashed_index(index_filename, url_indices[1], {})
+        try:
+            test_logger.log('INFO', 'Testing the merged index')
+            HashedIndexWriter.run_size = 7
+            # The sources can be in-memory, CDXJ or hashed indices
+            merged_index = merge_url_indices([url_indices[0], HashedUrlIndex(index_filename), *url_indices[2:]])
+            assert len(merged_index) == len(expected_merged_index)
+            assert dict(merged_index.items()) == expected_merged_index
+            assert all(merged_index[url] == value for url, value in expected_merged_index.items())
+            assert merged_index.get('https://example.com/article/not-found') is None
+            del merged_index
+        finally:
+            HashedIndexWriter.run_size = orig_run_size
+
+        test_logger.log('INFO', 'Testing the cached merged index')
+        cache_filename = os_path_join(tmp_dir, 'merged.idx')
+        merged_index = MergedUrlIndex(url_indices, cache_filename, {'sources_id': 1})
+        assert not merged_index.from_cache and merged_index.filename == cache_filename
+        del merged_index
+        merged_index = MergedUrlIndex(url_indices, cache_filename, {'sources_id': 1})
+        assert merged_index.from_cache
+        assert dict(merged_index.items()) == expected_merged_index
+        del merged_index
+        merged_index = MergedUrlIndex(url_indices[:2], cache_filename, {'sources_id': 2})  # The sources changed
+        assert not merged_index.from_cache
+        assert merged_index['https://example.com/article/0'][0] == \
+               (1 if 'https://example.com/article/0' in url_indices[1] else 0)
+        del merged_index
+
+    test_logger.log('INFO', 'Testing the merged index of a single source (not merged)')
+    assert dict(merge_url_indices(url_indices[:1]).items()) == \
+           {url: (0, reqv, resp) for url, (reqv, resp) in url_indices[0].items()}
+    assert len(merge_url_indices([])) == 0
+    test_logger.log('INFO', 'Test OK!')
+
+
+def merged_warc_files_last_file_wins_test(filenames, test_logger):
+    """The URLs of more source WARC files must be read from the last WARC file containing them"""
+    with TemporaryDirectory() as tmp_dir:
+        # The first file is repeated as the last, so all of its URLs must be read from the copy
+        warc_filenames = [copy_warc_file(filename, tmp_dir, '{0}.warc.gz'.format(i))
+                          for i, filename in enumerate(filenames + filenames[:1])]
+        expected_src = {}
+        for src, warc_filename in enumerate(warc_filenames):
+            expected_src.update((url, src) for url in read_url_index(warc_filename).keys())
+
+        for index_sidecar, from_cache in ((False, False), (True, False), (True, True)):
+            test_logger.log('INFO', 'Testing the merged WARC files (index sidecar: {0}, merged index from cache: {1})'.
+                            format(index_sidecar, from_cache))
+            w = WarcCachingDownloader(warc_filenames, None, test_logger, just_cache=True,
+                                      download_params={'stay_offline': True, 'index_sidecar': index_sidecar})
+            assert set(w.url_index) == set(expected_src.keys())
+            assert getattr(w._merged_url_index, 'from_cache', False) == from_cache
+            assert os.path.exists('{0}.merged{1}'.format(warc_filenames[-1], WarcReader.sidecar_ext)) == \
+                   index_sidecar
+            for url, src in expected_src.items():
+                cache, reqv, resp = w.get_records_offset(url)
+                assert cache.filename == warc_filenames[src]
+                assert w.download_url(url) == cache.download_url(url)
+            del w
+    test_logger.log('INFO', 'Test OK!')
+
+
+def content_cache_size_test(test_logger):
+    """The size of the decoded content cache must be counted in bytes of memory, not in characters"""
+    test_logger.log('INFO', 'Testing the size of the decoded content cache')
+    ascii_text, non_ascii_text = 'a' * 1000, 'ő' * 1000  # The latter needs 2 bytes per character
+    cache = DecodedContentCache(sys.getsizeof(ascii_text) * 2)
+    cache.put('ascii1', ascii_text)
+    cache.put('ascii2', ascii_text)
+    assert cache.evictions == 0
+    cache.put('non-ascii', non_ascii_text)  # Evicts both ASCII texts
+    assert cache.evictions == 2 and cache.get('ascii1') is None and cache.get('non-ascii') == non_ascii_text
+    cache.put('too-big', 'ő' * 2000)  # Larger than the whole cache, it is not cached
+    assert cache.evictions == 2 and cache.get('too-big') is None
+    test_logger.log('INFO', 'Test OK!')
+
+
+def main_test():
+    main_logger = Logger()
+
+    # Relative path from this directory to the files in the project's test directory
+    choices = {'archive': os_path_join(dirname(abspath(__file__)), 'extract_article_urls_from_page.warc.gz'),
+               'nextpage': os_path_join(dirname(abspath(__file__)), 'next_page_url.warc.gz'),
+               'article_nextpage': os_path_join(dirname(abspath(__file__)), 'next_page_of_article.warc.gz')}
+
+    index_sidecar_round_trip_test(choices['archive'], main_logger)
+    index_external_sort_test(choices['nextpage'], main_logger)
+    cdxj_index_round_trip_test(choices['archive'], main_logger)
+    parallel_indexing_test([choices['archive'], choices['nextpage'], choices['article_nextpage']], main_logger)
+    merged_index_last_file_wins_test(main_logger)
+    merged_warc_files_last_file_wins_test([choices['archive'], choices['nextpage'], choices['article_nextpage']],
+                                          main_logger)
+    content_cache_size_test(main_logger)
+
+
+if __name__ == '__main__':
+    main_test()